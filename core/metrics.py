@@ -0,0 +1,235 @@
+from django.conf import settings
+from bisect import bisect_left
+import threading
+import logging
+import json
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+# seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+STREAMING_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900)
+
+# name → (type, help)
+METRICS = {
+    'http_requests_total': ('counter', 'Requests by view, method and status'),
+    'http_request_duration_seconds': ('histogram', 'Time spent in the view and middlewares'),
+    'http_request_db_queries_total': ('counter', 'SQL queries run by the view'),
+    'http_request_db_seconds_total': ('counter', 'Time spent in SQL queries by the view'),
+    'http_response_bytes_total': ('counter', 'Bytes sent in response bodies'),
+    'http_streaming_duration_seconds': ('histogram', 'Time to send a streamed response body'),
+    'sso_requests_total': ('counter', 'Session validations sent to the SSO by outcome'),
+    'sso_request_duration_seconds': ('histogram', 'Time waiting for the SSO, retries included'),
+}
+
+class Registry:
+    """
+    Counters and histograms of the process. Updates take
+    one lock and touch a few dict entries, so recording a
+    request costs microseconds.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, labels)
+
+        with self.lock:
+            histogram = self.histograms.get(key)
+
+            if histogram is None:
+                # counts per bucket, the last one is +Inf
+                histogram = self.histograms[key] = {
+                    'buckets': list(buckets),
+                    'counts': [0] * (len(buckets) + 1),
+                    'sum': 0,
+                }
+
+            histogram['counts'][bisect_left(buckets, value)] += 1
+            histogram['sum'] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [
+                    [name, list(labels), {**histogram, 'counts': list(histogram['counts'])}]
+                    for (name, labels), histogram in self.histograms.items()
+                ],
+            }
+
+registry = Registry()
+
+def record_request(view, method, status, duration, queries, db_time, size=None):
+    labels = (('view', view),)
+
+    registry.inc('http_requests_total', (*labels, ('method', method), ('status', str(status))))
+    registry.observe('http_request_duration_seconds', labels, duration, LATENCY_BUCKETS)
+    registry.inc('http_request_db_queries_total', labels, queries)
+    registry.inc('http_request_db_seconds_total', labels, db_time)
+
+    if size is not None:
+        registry.inc('http_response_bytes_total', labels, size)
+
+    _dump_if_due()
+
+def record_streaming(view, duration, size):
+    labels = (('view', view),)
+
+    registry.observe('http_streaming_duration_seconds', labels, duration, STREAMING_BUCKETS)
+    registry.inc('http_response_bytes_total', labels, size)
+
+def record_sso_request(outcome, duration=None):
+    registry.inc('sso_requests_total', (('outcome', outcome),))
+
+    if duration is not None:
+        registry.observe('sso_request_duration_seconds', (), duration, LATENCY_BUCKETS)
+
+    _dump_if_due()
+
+# gunicorn runs several processes: each one writes its
+# metrics to METRICS_DIR so any of them can serve the total
+
+_last_dump = 0
+_dump_lock = threading.Lock()
+
+# seconds after which the file of a silent process is dropped
+STALE_AFTER = 3600
+
+def _dump_if_due():
+    global _last_dump
+
+    directory = settings.METRICS_DIR
+    now = time.monotonic()
+
+    if not directory or now - _last_dump < settings.METRICS_DUMP_INTERVAL:
+        return
+
+    # another thread of the process is writing
+    if not _dump_lock.acquire(blocking=False):
+        return
+
+    _last_dump = now
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+
+        path = os.path.join(directory, f'{os.getpid()}.json')
+
+        with open(f'{path}.part', 'w') as f:
+            json.dump(registry.snapshot(), f)
+
+        os.replace(f'{path}.part', path)
+
+    except OSError as e:
+        logger.warning(f'unable to write metrics: {e}')
+
+    finally:
+        _dump_lock.release()
+
+def _load_snapshots():
+    """
+    Snapshots of the other processes, the
+    live registry for the current one
+    """
+
+    snapshots = [registry.snapshot()]
+    directory = settings.METRICS_DIR
+
+    if not directory or not os.path.isdir(directory):
+        return snapshots
+
+    own = f'{os.getpid()}.json'
+
+    # processes that stopped writing are gone
+    expired = time.time() - STALE_AFTER
+
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+
+        if name == own or not name.endswith('.json'):
+            continue
+
+        try:
+            if os.path.getmtime(path) < expired:
+                os.remove(path)
+                continue
+
+            with open(path) as f:
+                snapshots.append(json.load(f))
+
+        except (OSError, ValueError):
+            continue
+
+    return snapshots
+
+def _format_labels(labels, extra=()):
+    labels = [*labels, *extra]
+
+    if not labels:
+        return ''
+
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+def render_prometheus():
+    """
+    Metrics of all the processes in the
+    Prometheus text exposition format
+    """
+
+    counters = {}
+    histograms = {}
+
+    for snapshot in _load_snapshots():
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(tuple(label) for label in labels))
+            counters[key] = counters.get(key, 0) + value
+
+        for name, labels, histogram in snapshot['histograms']:
+            key = (name, tuple(tuple(label) for label in labels))
+            total = histograms.get(key)
+
+            if total is None:
+                histograms[key] = {**histogram, 'counts': list(histogram['counts'])}
+                continue
+
+            total['counts'] = [a + b for a, b in zip(total['counts'], histogram['counts'])]
+            total['sum'] += histogram['sum']
+
+    lines = []
+
+    for metric, (kind, description) in METRICS.items():
+        lines.append(f'# HELP {metric} {description}')
+        lines.append(f'# TYPE {metric} {kind}')
+
+        if kind == 'counter':
+            for (name, labels), value in sorted(counters.items()):
+                if name == metric:
+                    lines.append(f'{metric}{_format_labels(labels)} {value}')
+            continue
+
+        for (name, labels), histogram in sorted(histograms.items(), key=lambda item: item[0]):
+            if name != metric:
+                continue
+
+            cumulative = 0
+
+            for bound, count in zip([*histogram['buckets'], '+Inf'], histogram['counts']):
+                cumulative += count
+                lines.append(f'{metric}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+
+            lines.append(f'{metric}_sum{_format_labels(labels)} {histogram["sum"]}')
+            lines.append(f'{metric}_count{_format_labels(labels)} {cumulative}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,129 @@
+from django.db import connections
+from django.conf import settings
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from contextlib import ExitStack
+from .metrics import record_request, record_streaming
+import time
+
+class QueryTimer:
+    """
+    Database execute wrapper counting the
+    queries of a request and their time
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+def _count_bytes(content, counter):
+    for chunk in content:
+        counter[0] += len(chunk)
+        yield chunk
+
+async def _acount_bytes(content, counter):
+    async for chunk in content:
+        counter[0] += len(chunk)
+        yield chunk
+
+class MetricsMiddleware:
+    """
+    Record latency, SQL queries and response size of every
+    request under the name of its url, and add a
+    Server-Timing header. Streamed bodies are measured
+    until the server closes the response.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+        # no thread hop in front of async views under ASGI
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        timer = QueryTimer()
+        started = time.perf_counter()
+
+        with self.time_queries(timer):
+            response = self.get_response(request)
+
+        return self.record(request, response, timer, started)
+
+    async def __acall__(self, request):
+        timer = QueryTimer()
+        started = time.perf_counter()
+
+        with self.time_queries(timer):
+            response = await self.get_response(request)
+
+        return self.record(request, response, timer, started)
+
+    def time_queries(self, timer):
+        stack = ExitStack()
+
+        for alias in settings.DATABASES:
+            stack.enter_context(connections[alias].execute_wrapper(timer))
+
+        return stack
+
+    def record(self, request, response, timer, started):
+        duration = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        view = (match and match.url_name) or 'unmatched'
+
+        if settings.METRICS_SERVER_TIMING:
+            response['Server-Timing'] = (
+                f'db;dur={timer.duration * 1000:.1f};desc="{timer.count} queries", '
+                f'app;dur={(duration - timer.duration) * 1000:.1f}, '
+                f'total;dur={duration * 1000:.1f}'
+            )
+
+        size = None
+
+        if response.streaming:
+            self.track_streaming(response, view)
+        else:
+            size = len(response.content)
+
+        record_request(view, request.method, response.status_code, duration, timer.count, timer.duration, size)
+
+        return response
+
+    def track_streaming(self, response, view):
+        """
+        Measure the body as it is sent: the server closes
+        the response once the last byte is written
+        """
+
+        started = time.perf_counter()
+        length = response.get('Content-Length')
+        counter = [0]
+
+        if length is None and getattr(response, 'file_to_stream', None) is None:
+            # files keep their sendfile path, their size is known
+            if response.is_async:
+                response.streaming_content = _acount_bytes(response.streaming_content, counter)
+            else:
+                response.streaming_content = _count_bytes(response.streaming_content, counter)
+
+        def closed():
+            size = int(length) if length is not None else counter[0]
+            record_streaming(view, time.perf_counter() - started, size)
+
+        response._resource_closers.append(closed)
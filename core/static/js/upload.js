@@ -0,0 +1,175 @@
+// resumable uploads: files are sent in chunks, several at a time,
+// and an interrupted upload resumes from the chunks already received
+(function () {
+  const CHUNK_SIZE = 8 * 1024 * 1024;
+  const PARALLEL_CHUNKS = 3;
+  const MAX_RETRIES = 5;
+
+  function csrfToken(form) {
+    return form.querySelector('[name=csrfmiddlewaretoken]').value;
+  }
+
+  function sessionKey(form, file) {
+    return `upload:${form.dataset.createUrl}:${file.name}:${file.size}:${file.lastModified}`;
+  }
+
+  async function send(url, options) {
+    // retry network errors and server errors with a backoff
+    for (let attempt = 0; ; attempt++) {
+      try {
+        const response = await fetch(url, { credentials: 'same-origin', ...options });
+
+        if (response.status < 500 || attempt >= MAX_RETRIES) {
+          return response;
+        }
+      } catch (error) {
+        if (attempt >= MAX_RETRIES) {
+          throw error;
+        }
+      }
+
+      await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** attempt));
+    }
+  }
+
+  async function errorOf(response) {
+    try {
+      return new Error((await response.json()).error);
+    } catch (error) {
+      return new Error('Échec du téléversement');
+    }
+  }
+
+  async function startSession(form, file) {
+    const key = sessionKey(form, file);
+    const saved = localStorage.getItem(key);
+
+    if (saved) {
+      // resume the previous attempt
+      const response = await send(saved, { headers: { 'Accept': 'application/json' } });
+
+      if (response.ok) {
+        return [key, await response.json()];
+      }
+
+      localStorage.removeItem(key);
+    }
+
+    const body = new FormData();
+    body.append('name', file.name);
+    body.append('size', file.size);
+
+    const response = await send(form.dataset.createUrl, {
+      method: 'POST',
+      headers: { 'X-CSRFToken': csrfToken(form) },
+      body: body,
+    });
+
+    if (!response.ok) {
+      throw await errorOf(response);
+    }
+
+    const session = await response.json();
+    localStorage.setItem(key, session.url);
+
+    return [key, session];
+  }
+
+  function missingChunks(size, received) {
+    const chunks = [];
+
+    for (let start = 0; start < size; start += CHUNK_SIZE) {
+      const end = Math.min(start + CHUNK_SIZE, size);
+
+      if (!received.some(([from, to]) => from <= start && end <= to)) {
+        chunks.push([start, end]);
+      }
+    }
+
+    return chunks;
+  }
+
+  async function uploadFile(form, file, onProgress) {
+    const [key, session] = await startSession(form, file);
+    const chunks = missingChunks(file.size, session.received);
+
+    let sent = file.size - chunks.reduce((total, [start, end]) => total + end - start, 0);
+    onProgress(sent);
+
+    async function worker() {
+      while (chunks.length) {
+        const [start, end] = chunks.shift();
+
+        const response = await send(session.url, {
+          method: 'PATCH',
+          headers: {
+            'X-CSRFToken': csrfToken(form),
+            'Upload-Offset': start,
+            'Content-Type': 'application/offset+octet-stream',
+          },
+          body: file.slice(start, end),
+        });
+
+        if (!response.ok) {
+          throw await errorOf(response);
+        }
+
+        sent += end - start;
+        onProgress(sent);
+      }
+    }
+
+    await Promise.all(Array.from({ length: PARALLEL_CHUNKS }, worker));
+
+    const response = await send(session.finalize_url, {
+      method: 'POST',
+      headers: { 'X-CSRFToken': csrfToken(form) },
+    });
+
+    if (!response.ok) {
+      throw await errorOf(response);
+    }
+
+    localStorage.removeItem(key);
+  }
+
+  document.addEventListener('DOMContentLoaded', function () {
+    const form = document.getElementById('uploadFilesForm');
+    const progress = document.getElementById('uploadFilesProgress');
+
+    if (!form || !form.dataset.createUrl || !window.fetch) {
+      // plain multipart form
+      return;
+    }
+
+    form.addEventListener('submit', async (event) => {
+      event.preventDefault();
+
+      const files = Array.from(form.querySelector('input[type=file]').files);
+      const total = files.reduce((sum, file) => sum + file.size, 0) || 1;
+      const buttons = form.querySelectorAll('button');
+
+      let done = 0;
+
+      progress?.classList.remove('hidden');
+      buttons.forEach(button => button.disabled = true);
+
+      try {
+        for (const file of files) {
+          await uploadFile(form, file, sent => {
+            if (progress) {
+              progress.value = (done + sent) / total * 100;
+            }
+          });
+
+          done += file.size;
+        }
+
+        window.location.reload();
+      } catch (error) {
+        alert(`${error.message}. Relancez l'import pour reprendre.`);
+        buttons.forEach(button => button.disabled = false);
+      }
+    });
+  });
+})();
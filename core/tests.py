@@ -0,0 +1,134 @@
+from django.test import RequestFactory, TestCase, override_settings
+from django.http import HttpResponse, StreamingHttpResponse
+from asgiref.sync import iscoroutinefunction
+from unittest import mock
+from .metrics import Registry, render_prometheus
+from .middleware import MetricsMiddleware
+import tempfile
+import shutil
+import json
+import os
+
+class MetricsMiddlewareTests(TestCase):
+
+    def setUp(self):
+        # each test starts from empty counters
+        patcher = mock.patch('core.metrics.registry', Registry())
+        self.registry = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.request = RequestFactory().get('/telechargement')
+
+    def counter(self, name, **labels):
+        return self.registry.counters.get((name, tuple(labels.items())))
+
+    def test_requests_are_labelled_with_the_url_name(self):
+        self.client.get('/robots.txt')
+        self.client.get('/nulle-part')
+
+        self.assertEqual(self.counter('http_requests_total', view='robots.txt', method='GET', status='200'), 1)
+        self.assertEqual(self.counter('http_requests_total', view='unmatched', method='GET', status='404'), 1)
+
+    def test_response_size_is_recorded(self):
+        middleware = MetricsMiddleware(lambda request: HttpResponse(b'hello'))
+
+        response = middleware(self.request)
+
+        self.assertIn('Server-Timing', response)
+        self.assertEqual(self.counter('http_response_bytes_total', view='unmatched'), 5)
+
+    def test_streamed_bytes_are_counted_once_sent(self):
+        middleware = MetricsMiddleware(lambda request: StreamingHttpResponse(iter([b'ab', b'cde'])))
+
+        response = middleware(self.request)
+
+        # nothing sent yet
+        self.assertIsNone(self.counter('http_response_bytes_total', view='unmatched'))
+
+        self.assertEqual(b''.join(response.streaming_content), b'abcde')
+        response.close()
+
+        self.assertEqual(self.counter('http_response_bytes_total', view='unmatched'), 5)
+        self.assertIn(('http_streaming_duration_seconds', (('view', 'unmatched'),)), self.registry.histograms)
+
+    async def test_async_views_are_awaited(self):
+        async def chunks():
+            yield b'ab'
+            yield b'cde'
+
+        async def view(request):
+            return StreamingHttpResponse(chunks())
+
+        middleware = MetricsMiddleware(view)
+
+        self.assertTrue(iscoroutinefunction(middleware))
+
+        response = await middleware(self.request)
+
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), b'abcde')
+        response.close()
+
+        self.assertEqual(self.counter('http_requests_total', view='unmatched', method='GET', status='200'), 1)
+        self.assertEqual(self.counter('http_response_bytes_total', view='unmatched'), 5)
+
+    def test_sync_views_stay_sync(self):
+        middleware = MetricsMiddleware(lambda request: HttpResponse(b'hello'))
+
+        self.assertFalse(iscoroutinefunction(middleware))
+
+class MetricsSnapshotTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+        patcher = mock.patch('core.metrics.registry', Registry())
+        self.registry = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, name, snapshot, age=0):
+        path = os.path.join(self.directory, name)
+
+        with open(path, 'w') as f:
+            json.dump(snapshot, f)
+
+        if age:
+            modified = os.path.getmtime(path) - age
+            os.utime(path, (modified, modified))
+
+        return path
+
+    def test_snapshots_of_all_processes_are_merged(self):
+        labels = (('view', 'home'),)
+
+        self.registry.inc('http_response_bytes_total', labels, 10)
+        self.registry.observe('http_request_duration_seconds', labels, 0.2, (0.1, 1))
+
+        # another worker
+        other = Registry()
+        other.inc('http_response_bytes_total', labels, 5)
+        other.observe('http_request_duration_seconds', labels, 0.05, (0.1, 1))
+        self.write('1.json', other.snapshot())
+
+        # a worker gone for long
+        gone = Registry()
+        gone.inc('http_response_bytes_total', labels, 1000)
+        stale = self.write('2.json', gone.snapshot(), age=7200)
+
+        with override_settings(METRICS_DIR=self.directory):
+            lines = render_prometheus().splitlines()
+
+        self.assertIn('http_response_bytes_total{view="home"} 15', lines)
+        self.assertIn('http_request_duration_seconds_bucket{view="home",le="0.1"} 1', lines)
+        self.assertIn('http_request_duration_seconds_bucket{view="home",le="+Inf"} 2', lines)
+        self.assertIn('http_request_duration_seconds_count{view="home"} 2', lines)
+        self.assertFalse(os.path.exists(stale))
+
+    def test_own_snapshot_is_read_live(self):
+        self.registry.inc('http_response_bytes_total', (('view', 'home'),), 10)
+
+        # written by this process before the last request
+        self.write(f'{os.getpid()}.json', Registry().snapshot())
+
+        with override_settings(METRICS_DIR=self.directory):
+            self.assertIn('http_response_bytes_total{view="home"} 10', render_prometheus().splitlines())
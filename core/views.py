@@ -1,6 +1,10 @@
 from django.shortcuts import  render, redirect, HttpResponse
 from django.views.decorators.http import require_http_methods
+from django.http import Http404
+from django.conf import settings
 from .forms import ContactForm
+from .metrics import render_prometheus
+import secrets
 
 # Create your views here.
 
@@ -46,3 +50,21 @@ def robots_txt_view(request):
     content = "User-agent: *\nDisallow: /"
     return HttpResponse(content, content_type="text/plain")
 
+@require_http_methods(['GET'])
+def metrics_view(request):
+    """
+    Metrics in Prometheus format, for staff or the scraper token
+    """
+
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+
+    allowed = request.user.is_authenticated and request.user.is_staff
+
+    if not allowed and token:
+        allowed = secrets.compare_digest(authorization, f'Bearer {token}')
+
+    if not allowed:
+        raise Http404
+
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,365 @@
+from django.core.cache import cache
+from django.conf import settings
+from django.utils import timezone
+from django.db.models import Q
+from .models import FileRecord, FolderRecord, ShareRecord
+from .cache import share_grant_key
+import logging
+
+logger = logging.getLogger(__name__)
+
+OWNER = 'owner'
+SHARED = 'shared'
+
+class AccessGrant:
+    """
+    Effective permission of a user on a file or folder
+    """
+
+    def __init__(self, permission, share=None):
+        self.permission = permission
+        self.share = share
+
+    @property
+    def is_owner(self):
+        return self.permission == OWNER
+
+    def __bool__(self):
+        return True
+
+    def __repr__(self):
+        return f'<AccessGrant {self.permission} share={self.share.pk if self.share else None}>'
+
+def active_share_filter(now=None):
+    """
+    Shares that are not deleted nor expired
+    """
+
+    now = now or timezone.now()
+
+    return Q(is_deleted=False) & (Q(expires_at__isnull=True) | Q(expires_at__gt=now))
+
+def shared_folder_filter(now=None):
+    """
+    Folders explicitly shared and not expired
+    """
+
+    now = now or timezone.now()
+
+    return Q(shared_at__isnull=False) & (Q(share_expires_at__isnull=True) | Q(share_expires_at__gt=now))
+
+def is_explicitly_shared(record, now=None):
+    """
+    Check the shared flag of the record itself,
+    without looking at its parents
+    """
+
+    now = now or timezone.now()
+
+    return bool(record.shared_at and (not record.share_expires_at or record.share_expires_at > now))
+
+def folder_chain_ids(record):
+    """
+    Ids of the folders whose shares apply to the record,
+    root first: the parents of a folder and the folder
+    itself, or the parents of a file and its folder.
+    No query when the folder of a file is already loaded.
+    """
+
+    if isinstance(record, FolderRecord):
+        return record.get_ancestor_ids() + [record.pk]
+
+    if not record.folder_id:
+        return []
+
+    return record.folder.get_ancestor_ids() + [record.folder_id]
+
+def live_folder_ids(record):
+    """
+    Ids of the folders in the chain of the record, from
+    the nearest one up to the first deleted folder
+    """
+
+    chain = folder_chain_ids(record)
+
+    if not chain:
+        return []
+
+    deleted = set(FolderRecord.objects.filter(
+        id__in=chain,
+        is_deleted=True
+    ).values_list('id', flat=True))
+
+    live = []
+
+    for pk in reversed(chain):
+        if pk in deleted:
+            break
+        live.append(pk)
+
+    return live
+
+def is_record_shared(record):
+    """
+    Check if the record or any of its
+    parent folders is shared, in one query
+    """
+
+    now = timezone.now()
+
+    if is_explicitly_shared(record, now):
+        return True
+
+    chain = folder_chain_ids(record)
+
+    if isinstance(record, FolderRecord):
+        # the folder itself has already been checked
+        chain = chain[:-1]
+
+    if not chain:
+        return False
+
+    return FolderRecord.objects.filter(
+        shared_folder_filter(now),
+        id__in=chain
+    ).exists()
+
+def is_reachable_by_link(record, now=None):
+    """
+    Check if an active share on the record or one
+    of its folders still gives access to it by link
+    """
+
+    target = Q(folder_id__in=live_folder_ids(record))
+
+    if isinstance(record, FileRecord):
+        target |= Q(file_id=record.pk)
+
+    return ShareRecord.objects.filter(
+        active_share_filter(now),
+        target,
+        contact__is_deleted=False,
+    ).exists()
+
+def resolve_access(user, record):
+    """
+    Get the effective access of `user` on a file or folder,
+    taking shares on parent folders and expiry into account.
+    Returns None when the user has no access.
+    """
+
+    if not user.is_authenticated:
+        return None
+
+    if record.user_id == user.pk:
+        return AccessGrant(OWNER)
+
+    folder_ids = live_folder_ids(record)
+
+    target = Q(folder_id__in=folder_ids)
+
+    if isinstance(record, FileRecord):
+        target |= Q(file_id=record.pk)
+
+    shares = list(ShareRecord.objects.filter(
+        active_share_filter(),
+        target,
+        recipient=user,
+        contact__is_deleted=False,
+    ))
+
+    if not shares:
+        return None
+
+    # the most specific share wins: the file itself, then the nearest folder
+    rank = {pk: index for index, pk in enumerate(folder_ids)}
+    shares.sort(key=lambda share: -1 if share.file_id else rank[share.folder_id])
+
+    return AccessGrant(SHARED, shares[0])
+
+def resolve_share_token(token, kind=None):
+    """
+    Get the grant given by a share link, loading the share
+    with its file or folder in one indexed query. Only the
+    id of the share is cached by token, the share itself is
+    read every time so a revoked link stops working at once.
+    `kind` is 'file' or 'folder' to accept only that target.
+    Returns None when the link gives no access.
+    """
+
+    key = share_grant_key(token)
+    share_id = cache.get(key)
+
+    shares = ShareRecord.objects.select_related('file', 'folder').filter(
+        is_deleted=False,
+        contact__is_deleted=False,
+    )
+
+    if share_id is None:
+        share = shares.filter(token=token).first()
+
+        if share and settings.DRIVE_SHARE_GRANT_CACHE_TIMEOUT > 0:
+            cache.set(key, share.pk, settings.DRIVE_SHARE_GRANT_CACHE_TIMEOUT)
+    else:
+        share = shares.filter(pk=share_id).first()
+
+    if not share:
+        return None
+
+    target = share.file or share.folder
+
+    if not target or target.is_deleted:
+        return None
+
+    if share.expires_at and share.expires_at <= timezone.now():
+        return None
+
+    if kind and not getattr(share, f'{kind}_id'):
+        return None
+
+    return AccessGrant(SHARED, share)
+
+def find_legacy_share(slug, kind=None):
+    """
+    Get the share of an old link, made with the slug of
+    the share or of the shared item, so it can be
+    redirected to the token of the share
+    """
+
+    target = Q(slug=slug)
+
+    if kind != 'folder':
+        target |= Q(file__slug=slug, file__is_deleted=False)
+
+    if kind != 'file':
+        target |= Q(folder__slug=slug, folder__is_deleted=False)
+
+    shares = ShareRecord.objects.filter(
+        target,
+        is_deleted=False,
+        contact__is_deleted=False,
+    )
+
+    if kind:
+        shares = shares.filter(**{f'{kind}__isnull': False, f'{kind}__is_deleted': False})
+
+    return shares.first()
+
+def _load_folders(records):
+    """
+    Make sure the folder of every file is loaded
+    with a single query instead of one per row
+    """
+
+    missing = {
+        record.folder_id for record in records
+        if isinstance(record, FileRecord)
+        and record.folder_id
+        and not FileRecord.folder.is_cached(record)
+    }
+
+    if not missing:
+        return
+
+    folders = FolderRecord.objects.in_bulk(missing)
+
+    for record in records:
+        if isinstance(record, FileRecord) and record.folder_id in folders:
+            record.folder = folders[record.folder_id]
+
+def annotate_shared_state(records):
+    """
+    Compute `is_shared` for a whole listing at once.
+    The result is cached on each record so templates
+    and views can read `is_shared` without any query.
+    """
+
+    records = [record for record in records if record is not None]
+
+    if not records:
+        return records
+
+    now = timezone.now()
+
+    _load_folders(records)
+
+    chains = {id(record): folder_chain_ids(record) for record in records}
+    folder_ids = {pk for chain in chains.values() for pk in chain}
+
+    shared_ids = set()
+
+    if folder_ids:
+        shared_ids = set(FolderRecord.objects.filter(
+            shared_folder_filter(now),
+            id__in=folder_ids
+        ).values_list('id', flat=True))
+
+    for record in records:
+        record._is_shared = (
+            is_explicitly_shared(record, now)
+            or any(pk in shared_ids for pk in chains[id(record)])
+        )
+
+    return records
+
+def annotate_access(user, records):
+    """
+    Compute the effective access of `user` for a whole
+    listing at once and store it as `access` on each record
+    """
+
+    records = [record for record in records if record is not None]
+
+    if not records:
+        return records
+
+    _load_folders(records)
+
+    chains = {id(record): folder_chain_ids(record) for record in records}
+    folder_ids = {pk for chain in chains.values() for pk in chain}
+    file_ids = [record.pk for record in records if isinstance(record, FileRecord)]
+
+    deleted_ids = set()
+    shares_by_folder = {}
+    shares_by_file = {}
+
+    if folder_ids:
+        deleted_ids = set(FolderRecord.objects.filter(
+            id__in=folder_ids,
+            is_deleted=True
+        ).values_list('id', flat=True))
+
+    if user.is_authenticated and (folder_ids or file_ids):
+        shares = ShareRecord.objects.filter(
+            active_share_filter(),
+            Q(folder_id__in=folder_ids) | Q(file_id__in=file_ids),
+            recipient=user,
+            contact__is_deleted=False,
+        )
+
+        for share in shares:
+            if share.file_id:
+                shares_by_file.setdefault(share.file_id, share)
+            else:
+                shares_by_folder.setdefault(share.folder_id, share)
+
+    for record in records:
+        record.access = None
+
+        if user.is_authenticated and record.user_id == user.pk:
+            record.access = AccessGrant(OWNER)
+            continue
+
+        if isinstance(record, FileRecord) and record.pk in shares_by_file:
+            record.access = AccessGrant(SHARED, shares_by_file[record.pk])
+            continue
+
+        for pk in reversed(chains[id(record)]):
+            if pk in deleted_ids:
+                break
+
+            if pk in shares_by_folder:
+                record.access = AccessGrant(SHARED, shares_by_folder[pk])
+                break
+
+    return records
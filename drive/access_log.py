@@ -0,0 +1,141 @@
+from django.db.models import Case, When, Value, DateTimeField
+from django.db import connections
+from django.utils import timezone
+from django.conf import settings
+import threading
+import logging
+import atexit
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+_lock = threading.Lock()
+
+# model → {pk: last access}
+_pending = {}
+
+_flusher = None
+_flusher_pid = None
+
+def record_access(instance, when=None):
+    """
+    Record an access to a file or share. The timestamp is
+    buffered in memory and written with the next flush, so
+    the request does not wait on a row lock. Repeated hits
+    on the same row are coalesced into a single update.
+    """
+
+    when = when or timezone.now()
+    instance.last_accessed_at = when
+
+    interval = settings.DRIVE_ACCESS_FLUSH_INTERVAL
+
+    if interval <= 0:
+        # buffering disabled → write through
+        type(instance).objects.filter(pk=instance.pk).update(last_accessed_at=when)
+        return
+
+    with _lock:
+        _merge(type(instance), {instance.pk: when})
+
+        _start_flusher(interval)
+
+def _merge(model, rows):
+    """
+    Add rows to the buffer keeping the last access of each,
+    the caller holds the lock
+    """
+
+    pending = _pending.setdefault(model, {})
+
+    for pk, when in rows.items():
+        pending[pk] = max(when, pending.get(pk, when))
+
+def _start_flusher(interval):
+    """
+    Start the flush thread once per process,
+    again in each worker after a fork
+    """
+
+    global _flusher, _flusher_pid
+
+    if _flusher_pid == os.getpid() and _flusher.is_alive():
+        return
+
+    _flusher = threading.Thread(
+        target=_flush_forever,
+        args=(interval,),
+        name='access-log-flush',
+        daemon=True,
+    )
+    _flusher_pid = os.getpid()
+    _flusher.start()
+
+def _flush_forever(interval):
+    while True:
+        time.sleep(interval)
+
+        try:
+            flush()
+        except Exception as e:
+            logger.error(f'Unable to flush access log: {e}')
+        finally:
+            # the thread owns its own connections
+            connections.close_all()
+
+def flush():
+    """
+    Write the buffered timestamps with one
+    bulk UPDATE per model and batch of rows.
+    Rows not written go back to the buffer.
+    """
+
+    global _pending
+
+    with _lock:
+        pending, _pending = _pending, {}
+
+    count = 0
+
+    try:
+        for model, rows in pending.items():
+            items = list(rows.items())
+
+            for start in range(0, len(items), BATCH_SIZE):
+                batch = items[start:start + BATCH_SIZE]
+
+                model.objects.filter(
+                    pk__in=[pk for pk, _ in batch]
+                ).update(last_accessed_at=Case(
+                    *[When(pk=pk, then=Value(when)) for pk, when in batch],
+                    output_field=DateTimeField(),
+                ))
+
+                for pk, _ in batch:
+                    del rows[pk]
+
+                count += len(batch)
+
+    except Exception:
+        # retried with the next flush, merged
+        # with the accesses recorded meanwhile
+        with _lock:
+            for model, rows in pending.items():
+                _merge(model, rows)
+
+        raise
+
+    if count:
+        logger.debug(f'{count} access timestamps flushed')
+
+    return count
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception as e:
+        logger.error(f'Unable to flush access log at exit: {e}')
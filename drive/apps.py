@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def create_search_index(using, **kwargs):
+    from .search import create_search_index
+    create_search_index(using)
 
 
 class DriveConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'drive'
+
+    def ready(self):
+        # runs on every migrate, so existing
+        # deployments get the search index too
+        post_migrate.connect(create_search_index, sender=self)
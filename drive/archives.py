@@ -0,0 +1,152 @@
+from django.utils import timezone
+from datetime import timedelta
+from .models import ArchiveJob
+from .zipstream import iter_folder_entries, stream_zip
+from .delivery import serve_file
+from .workers import run_in_background
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_ROOT = 'archives'
+
+# a build without progress for this long was interrupted
+STALE_AFTER = timedelta(minutes=30)
+
+def _storage():
+    return ArchiveJob._meta.get_field('file').storage
+
+def folder_content_version(folder):
+    """
+    Version of the archive of the folder: a hash of the
+    entries it would contain, read from the database by
+    the zip walk, so a change committed by any process
+    gives a new version
+    """
+
+    hasher = hashlib.sha256()
+
+    for entry in iter_folder_entries(folder):
+        hasher.update(f'{entry.arcname}\0{entry.path}\0{entry.size}\0{entry.modified_at}\n'.encode())
+
+    return hasher.hexdigest()
+
+def get_archive(folder, version):
+    """
+    Archive built or being built for this
+    version of the folder content, if any
+    """
+
+    return ArchiveJob.objects.filter(folder=folder, version=version).first()
+
+def request_archive(folder, version):
+    """
+    Get the archive job of the folder, queuing
+    a build when there is none for this version
+    """
+
+    job, created = ArchiveJob.objects.get_or_create(folder=folder, version=version)
+
+    stale = job.status == 'running' and job.updated_at < timezone.now() - STALE_AFTER
+
+    if created or job.status == 'failed' or stale:
+        job.status = 'pending'
+        job.error = ''
+        job.save(update_fields=['status', 'error', 'updated_at'])
+
+        run_in_background(build_archive, job.pk)
+
+        job.refresh_from_db()
+
+    return job
+
+def build_archive(job_id):
+    """
+    Write the zip of the folder on the disk. The archive is
+    written next to its final name and moved in place once
+    complete, so a half written file is never served.
+    """
+
+    job = ArchiveJob.objects.select_related('folder').get(pk=job_id)
+
+    if job.status == 'done':
+        return job
+
+    job.status = 'running'
+    job.save(update_fields=['status', 'updated_at'])
+
+    name = os.path.join(ARCHIVE_ROOT, str(job.folder_id), f'{job.version}.zip')
+    path = _storage().path(name)
+    partial_path = f'{path}.part'
+
+    try:
+        entries = iter_folder_entries(job.folder)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with open(partial_path, 'wb') as f:
+            for chunk in stream_zip(entries):
+                f.write(chunk)
+
+        os.replace(partial_path, path)
+
+    except Exception as e:
+        logger.error(f'archive of folder {job.folder_id} failed: {e}')
+
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+        job.status = 'failed'
+        job.error = str(e)
+        job.save(update_fields=['status', 'error', 'updated_at'])
+
+        return job
+
+    job.file.name = name
+    job.size = os.path.getsize(path)
+    job.status = 'done'
+    job.finished_at = timezone.now()
+    job.save(update_fields=['file', 'size', 'status', 'finished_at', 'updated_at'])
+
+    logger.info(f'archive of folder {job.folder_id} built: {job.size} bytes')
+
+    # archives of older versions will never be served again
+    old_jobs = ArchiveJob.objects.filter(
+        folder_id=job.folder_id,
+        created_at__lt=job.created_at,
+    ).exclude(status__in=['pending', 'running'])
+
+    for old_job in old_jobs:
+        delete_archive(old_job)
+
+    return job
+
+def delete_archive(job):
+    """
+    Remove an archive from the disk and its job
+    """
+
+    if job.file.name:
+        _storage().delete(job.file.name)
+
+    job.delete()
+
+def archive_response(request, job):
+    """
+    Serve a built archive
+    """
+
+    ArchiveJob.objects.filter(pk=job.pk).update(last_used_at=timezone.now())
+
+    return serve_file(
+        request,
+        job.file,
+        name=f'{job.folder.name}.zip',
+        content_type='application/zip',
+        etag=f'"{job.version}"',
+        last_modified=int(job.finished_at.timestamp()),
+        size=job.size,
+        as_attachment=True,
+    )
@@ -0,0 +1,197 @@
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from django.db.models.functions import Greatest
+from .models import Blob, FileRecord
+from .usage import remove_files
+from .cache import bump_listings, listing_scope
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _storage():
+    return Blob._meta.get_field('file').storage
+
+def _group_by_count(counts):
+    """
+    {blob_id: n} → {n: [blob_id, ...]}, so that
+    blobs with the same delta share one UPDATE
+    """
+
+    groups = {}
+
+    for blob_id, count in counts.items():
+        groups.setdefault(count, []).append(blob_id)
+
+    return groups
+
+def acquire_blobs(counts):
+    """
+    Add references to blobs, `counts` maps blob ids
+    to the number of new file records pointing to them
+    """
+
+    for count, blob_ids in _group_by_count(counts).items():
+        Blob.objects.filter(id__in=blob_ids).update(ref_count=F('ref_count') + count)
+
+def release_blobs(counts):
+    """
+    Drop references to blobs, and delete the
+    blobs nobody points to anymore with their file
+    """
+
+    if not counts:
+        return 0
+
+    with transaction.atomic():
+        for count, blob_ids in _group_by_count(counts).items():
+            Blob.objects.filter(id__in=blob_ids).update(
+                ref_count=Greatest(F('ref_count') - count, 0)
+            )
+
+        orphans = Blob.objects.filter(
+            id__in=counts.keys(),
+            ref_count=0,
+            files__isnull=True,
+        )
+
+        names = list(orphans.values_list('file', flat=True))
+        orphans.delete()
+
+        # only remove the files once the rows are gone for good
+        transaction.on_commit(lambda: _delete_files(names))
+
+    return len(names)
+
+def _delete_files(names):
+    from .thumbnails import delete_thumbnails
+
+    storage = _storage()
+
+    for name in names:
+        storage.delete(name)
+        delete_thumbnails(storage, name)
+
+    if names:
+        logger.info(f'{len(names)} files deleted from the storage')
+
+def store_blob(content, checksum, size):
+    """
+    Get the blob of `content` with a new reference,
+    storing the bytes only when the checksum is unknown
+    """
+
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(checksum=checksum).first()
+
+        if blob:
+            acquire_blobs({blob.pk: 1})
+            return blob
+
+        blob = Blob(checksum=checksum, size=size, ref_count=1)
+        blob.file.save(checksum, content, save=False)
+
+        try:
+            with transaction.atomic():
+                blob.save()
+        except IntegrityError:
+            # stored at the same time by another upload
+            _storage().delete(blob.file.name)
+            blob = Blob.objects.get(checksum=checksum)
+            acquire_blobs({blob.pk: 1})
+
+    return blob
+
+def discard_blob(blob):
+    """
+    Delete the bytes of a blob stored by a
+    transaction that was rolled back
+    """
+
+    if not Blob.objects.filter(pk=blob.pk).exists():
+        _storage().delete(blob.file.name)
+
+def adopt_blob(name, checksum, size):
+    """
+    Same as store_blob for a file already on the disk:
+    it becomes the blob, or is deleted if the blob exists
+    """
+
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(checksum=checksum).first()
+
+        if not blob:
+            blob = Blob(checksum=checksum, size=size, ref_count=1)
+            blob.file.name = name
+
+            try:
+                with transaction.atomic():
+                    blob.save()
+                return blob
+            except IntegrityError:
+                blob = Blob.objects.get(checksum=checksum)
+
+        acquire_blobs({blob.pk: 1})
+
+        if blob.file.name != name:
+            # duplicate content
+            transaction.on_commit(lambda: _storage().delete(name))
+
+    return blob
+
+def ensure_blob(file_record):
+    """
+    Move a file uploaded before blobs
+    existed into the blob storage
+    """
+
+    if file_record.blob_id:
+        return file_record.blob
+
+    if not file_record.checksum:
+        file_record.capture_file_metadata()
+
+    blob = adopt_blob(file_record.file.name, file_record.checksum, file_record.size)
+
+    FileRecord.objects.filter(pk=file_record.pk).update(
+        blob=blob,
+        file=blob.file.name,
+        size=file_record.size,
+        mime_type=file_record.mime_type,
+        checksum=file_record.checksum,
+    )
+
+    file_record.blob = blob
+    file_record.file = blob.file.name
+
+    return blob
+
+def purge_files(records):
+    """
+    Delete file records for good and free
+    the content that is not used anymore
+    """
+
+    counts = {}
+    names = []
+    scopes = set()
+
+    with transaction.atomic():
+        for blob_id, name, user_id, folder_id in records.values_list('blob_id', 'file', 'user_id', 'folder_id'):
+            if blob_id:
+                counts[blob_id] = counts.get(blob_id, 0) + 1
+            elif name:
+                # files stored before blobs belong to a single record
+                names.append(name)
+
+            scopes.add(listing_scope(user_id, folder_id))
+
+        remove_files(records)
+        bump_listings(scopes)
+
+        _, deleted = records.delete()
+
+        release_blobs(counts)
+
+        transaction.on_commit(lambda: _delete_files(names))
+
+    return deleted.get(FileRecord._meta.label, 0)
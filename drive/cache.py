@@ -0,0 +1,143 @@
+from django.core.cache import cache
+from django.conf import settings
+from django.db import transaction
+from .listing import FolderFirstListing
+import time
+
+# backends private to each process: a version bumped by one
+# worker would not reach the others, serving stale pages
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+def cache_is_shared():
+    """
+    Whether every process sees the same cache, the
+    test runner being a single process
+    """
+
+    return settings.TESTING or settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_BACKENDS
+
+# Listing pages are cached under the version of their folder.
+# Any change to the content bumps the version once the change
+# is committed, so old pages are never read again and simply
+# expire. A version lost by the cache restarts from the clock,
+# above every version used before.
+
+def folder_scope(folder_id):
+    return f'folder:{folder_id}'
+
+def root_scope(user_id):
+    return f'root:{user_id}'
+
+def listing_scope(user_id, folder_id=None):
+    """
+    Listing of a folder, or of the root of a user
+    """
+
+    if folder_id:
+        return folder_scope(folder_id)
+
+    return root_scope(user_id)
+
+def _version_key(scope):
+    return f'drive:listing-version:{scope}'
+
+def get_version(scope):
+    version = cache.get(_version_key(scope))
+
+    if version is None:
+        cache.add(_version_key(scope), time.time_ns(), timeout=None)
+        version = cache.get(_version_key(scope), 0)
+
+    return version
+
+def _bump(scopes):
+    for scope in scopes:
+        try:
+            cache.incr(_version_key(scope))
+        except ValueError:
+            # not cached, nothing to invalidate
+            pass
+
+def bump_listings(scopes):
+    """
+    Invalidate the cached pages of listings once
+    the current transaction is committed
+    """
+
+    scopes = set(scopes)
+
+    if scopes:
+        transaction.on_commit(lambda: _bump(scopes))
+
+def bump_folders(folder_ids, user_ids=()):
+    bump_listings(
+        [folder_scope(pk) for pk in folder_ids] +
+        [root_scope(pk) for pk in user_ids]
+    )
+
+class CachedFolderListing(FolderFirstListing):
+    """
+    Folder listing whose counts and pages come from the
+    cache, shared by every user browsing the same folder
+    """
+
+    def __init__(self, folders, files, scope):
+        super().__init__(folders, files)
+        self.prefix = f'drive:listing:{scope}:{get_version(scope)}'
+        self.timeout = settings.DRIVE_LISTING_CACHE_TIMEOUT
+
+    def count(self):
+        if self._folder_count is None:
+            key = f'{self.prefix}:count'
+            counts = cache.get(key)
+
+            if counts is None:
+                counts = (super().folder_count, super().file_count)
+                cache.set(key, counts, self.timeout)
+
+            self._folder_count, self._file_count = counts
+
+        return self._folder_count + self._file_count
+
+    @property
+    def folder_count(self):
+        self.count()
+        return self._folder_count
+
+    @property
+    def file_count(self):
+        self.count()
+        return self._file_count
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step:
+            return super().__getitem__(key)
+
+        cache_key = f'{self.prefix}:{key.start or 0}:{key.stop}'
+        items = cache.get(cache_key)
+
+        if items is None:
+            items = super().__getitem__(key)
+            cache.set(cache_key, items, self.timeout)
+
+        return items
+
+# Share links cache the id of their share by token. A token
+# always names the same share, so there is nothing to forget.
+
+def share_grant_key(token):
+    return f'drive:share-grant:{token}'
+
+def folder_listing(folders, files, scope):
+    """
+    Listing of a folder, cached unless disabled
+    or the cache is not shared
+    """
+
+    if settings.DRIVE_LISTING_CACHE_TIMEOUT <= 0 or not cache_is_shared():
+        return FolderFirstListing(folders, files)
+
+    return CachedFolderListing(folders, files, scope)
@@ -0,0 +1,200 @@
+from django.db import transaction
+from django.utils import timezone
+from .models import FileRecord, FolderRecord, CopyJob, generate_slug
+from .blobs import ensure_blob, acquire_blobs
+from .search import index_records
+from .usage import add_files
+from .cache import bump_folders
+from .workers import run_in_background
+import logging
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+def start_copy_job(user, folder):
+    """
+    Queue the copy of `folder` into the drive of `user`
+    """
+
+    job = CopyJob.objects.create(user=user, source=folder)
+
+    run_in_background(run_copy_job, job.pk)
+
+    job.refresh_from_db()
+
+    return job
+
+def _live_levels(folder):
+    """
+    Folders of the tree outside of the trash, grouped
+    by depth so each level only needs its parents
+    """
+
+    folders = folder.get_descendants().filter(
+        is_deleted=False
+    ).only('id', 'name', 'parent_id', 'depth').order_by('depth', 'id')
+
+    kept = set()
+    levels = {}
+
+    for child in folders:
+        if child.pk == folder.pk or child.parent_id in kept:
+            kept.add(child.pk)
+            levels.setdefault(child.depth, []).append(child)
+
+    return [levels[depth] for depth in sorted(levels)]
+
+def _copy_tree(job):
+    """
+    Create the copy of every folder with one bulk insert
+    per level, in a single transaction: the tree is either
+    fully built or not at all
+    """
+
+    source = job.source
+
+    if not source or source.is_deleted:
+        raise ValueError('Source folder no longer exists')
+
+    source.ensure_tree_path()
+
+    levels = _live_levels(source)
+
+    folder_map = {}
+    paths = {}
+
+    with transaction.atomic():
+        for level in levels:
+            copies = []
+
+            for folder in level:
+                if folder.pk == source.pk:
+                    name = f'{source.name} - copie {timezone.now().strftime("%d-%m-%Y %H:%M")}'
+                    parent_id = None
+                else:
+                    name = folder.name
+                    parent_id = folder_map[folder.parent_id]
+
+                copy = FolderRecord(user_id=job.user_id, name=name, parent_id=parent_id)
+                copy.slug = generate_slug(copy, is_folder=True)
+                copies.append(copy)
+
+            FolderRecord.objects.bulk_create(copies, batch_size=BATCH_SIZE)
+
+            for folder, copy in zip(level, copies):
+                copy.tree_path = f'{paths.get(copy.parent_id, "/")}{copy.pk}/'
+                copy.depth = copy.tree_path.count('/') - 2
+
+                paths[copy.pk] = copy.tree_path
+                folder_map[folder.pk] = copy.pk
+
+            FolderRecord.objects.bulk_update(copies, ['tree_path', 'depth'], batch_size=BATCH_SIZE)
+            index_records(copies, batch_size=BATCH_SIZE)
+
+        job.folder_map = {str(pk): copy_pk for pk, copy_pk in folder_map.items()}
+        job.target_id = folder_map[source.pk]
+        job.total_folders = len(folder_map)
+        job.copied_folders = len(folder_map)
+        job.total_files = FileRecord.objects.filter(
+            folder_id__in=folder_map.keys(),
+            is_deleted=False,
+        ).count()
+        job.save(update_fields=[
+            'folder_map', 'target', 'total_folders',
+            'copied_folders', 'total_files', 'updated_at',
+        ])
+
+        # the copy shows up at the root of the user
+        bump_folders([], [job.user_id])
+
+def _copy_files(job):
+    """
+    Copy the files in batches. Each batch is one bulk insert,
+    committed with the position of the job so an interrupted
+    copy resumes after the last saved batch.
+    """
+
+    folder_map = {int(pk): copy_pk for pk, copy_pk in job.folder_map.items()}
+
+    files = FileRecord.objects.filter(
+        folder__tree_path__startswith=job.source.tree_path,
+        is_deleted=False,
+    ).select_related('blob').order_by('id')
+
+    while True:
+        batch = list(files.filter(id__gt=job.last_file_id)[:BATCH_SIZE])
+
+        if not batch:
+            break
+
+        copies = []
+        counts = {}
+
+        for file_record in batch:
+            if file_record.folder_id not in folder_map or not file_record.file:
+                # inside a trashed folder
+                continue
+
+            # content is shared, nothing is copied on the disk
+            blob = ensure_blob(file_record)
+            counts[blob.pk] = counts.get(blob.pk, 0) + 1
+
+            copy = FileRecord(
+                user_id=job.user_id,
+                folder_id=folder_map[file_record.folder_id],
+                name=file_record.name,
+                file=blob.file.name,
+                blob=blob,
+                size=file_record.size,
+                mime_type=file_record.mime_type,
+                checksum=file_record.checksum,
+            )
+            copy.slug = generate_slug(copy)
+            copies.append(copy)
+
+        with transaction.atomic():
+            acquire_blobs(counts)
+            add_files(copies)
+            FileRecord.objects.bulk_create(copies, batch_size=BATCH_SIZE)
+            index_records(copies, batch_size=BATCH_SIZE)
+            bump_folders({copy.folder_id for copy in copies})
+
+            job.last_file_id = batch[-1].pk
+            job.copied_files += len(copies)
+            job.save(update_fields=['last_file_id', 'copied_files', 'updated_at'])
+
+def run_copy_job(job_id):
+    """
+    Run or resume a copy job
+    """
+
+    job = CopyJob.objects.select_related('source').get(pk=job_id)
+
+    if job.is_finished:
+        return job
+
+    job.status = 'running'
+    job.save(update_fields=['status', 'updated_at'])
+
+    try:
+        if not job.target_id:
+            _copy_tree(job)
+
+        _copy_files(job)
+
+    except Exception as e:
+        logger.error(f'copy job {job.job_uuid} failed: {e}')
+
+        job.status = 'failed'
+        job.error = str(e)
+
+    else:
+        job.status = 'done'
+
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at', 'updated_at'])
+
+    logger.info(f'copy job {job.job_uuid}: {job.copied_folders} folders, {job.copied_files} files')
+
+    return job
@@ -0,0 +1,329 @@
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+from django.utils.cache import get_conditional_response
+from django.core.handlers.asgi import ASGIRequest
+from django.conf import settings
+from asgiref.sync import sync_to_async
+from functools import wraps
+from urllib.parse import quote
+from .utils import guess_mime_type
+import secrets
+import logging
+
+logger = logging.getLogger(__name__)
+
+PYTHON = 'python'
+NGINX = 'nginx'
+APACHE = 'apache'
+
+CHUNK_SIZE = 64 * 1024
+
+# more ranges than this are answered with the whole file
+MAX_RANGES = 16
+
+def streaming_view(view):
+    """
+    Make a download view async. Under ASGI its lookups still
+    run in Django's sync thread, then the body is sent from
+    the event loop: a slow client holds neither a thread nor
+    a worker. Under WSGI the view is left sync, an async view
+    would cost an event loop round trip per request.
+    """
+
+    if settings.SERVER_INTERFACE != 'asgi':
+        return view
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        return await sync_to_async(view)(request, *args, **kwargs)
+
+    return wrapper
+
+def is_async_request(request):
+    return isinstance(request, ASGIRequest)
+
+_DONE = object()
+
+async def iterate_in_thread(iterator):
+    """
+    Iterate a blocking iterator from the event loop. Each item
+    is produced in a worker thread and only asked for once the
+    server has sent the previous one, so the transfer follows
+    the pace of the client with a single chunk in memory.
+    """
+
+    iterator = iter(iterator)
+    next_item = sync_to_async(next, thread_sensitive=False)
+
+    try:
+        while True:
+            item = await next_item(iterator, _DONE)
+
+            if item is _DONE:
+                return
+
+            yield item
+
+    finally:
+        # closes the file of an unfinished transfer
+        close = getattr(iterator, 'close', None)
+
+        if close:
+            await sync_to_async(close, thread_sensitive=False)()
+
+def streaming_body(request, iterator):
+    """
+    Body of a streamed response: async under ASGI, where
+    Django would otherwise read a blocking iterator whole
+    before sending it
+    """
+
+    if is_async_request(request):
+        return iterate_in_thread(iterator)
+
+    return iterator
+
+def _local_path(stored_file):
+    """
+    Absolute path of a stored file, or None
+    when the storage is not on the local disk
+    """
+
+    try:
+        return stored_file.path
+    except NotImplementedError:
+        return None
+
+def get_etag(file_record):
+    """
+    Strong validator: the content checksum, or the uuid
+    and size of the file for records not backfilled yet
+    """
+
+    if file_record.checksum:
+        return f'"{file_record.checksum}"'
+
+    return f'"{file_record.file_uuid.hex}-{file_record.size}"'
+
+def parse_range_header(header, size):
+    """
+    Parse a `bytes=` Range header into (start, end) pairs.
+    Returns None when the header should be ignored and an
+    empty list when none of the ranges can be satisfied.
+    """
+
+    if not header or not header.startswith('bytes='):
+        return None
+
+    ranges = []
+
+    for part in header[6:].split(','):
+        first, sep, last = part.strip().partition('-')
+
+        if not sep:
+            return None
+
+        try:
+            if not first:
+                # suffix range: the last n bytes
+                length = int(last)
+
+                if length <= 0:
+                    continue
+
+                ranges.append((max(size - length, 0), size - 1))
+                continue
+
+            start = int(first)
+            end = int(last) if last else size - 1
+        except ValueError:
+            return None
+
+        if start < 0 or (last and start > end):
+            return None
+
+        if start >= size:
+            continue
+
+        ranges.append((start, min(end, size - 1)))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    return ranges
+
+def _if_range_matches(request, etag, last_modified):
+    """
+    A Range is only honoured when If-Range,
+    if present, still matches the file
+    """
+
+    if_range = request.headers.get('If-Range')
+
+    if not if_range:
+        return True
+
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+
+    return parse_http_date_safe(if_range) == last_modified
+
+def _iter_ranges(stored_file, ranges, parts=None):
+    """
+    Read the requested ranges, with the
+    multipart headers between them if any
+    """
+
+    with stored_file.open('rb') as f:
+        for index, (start, end) in enumerate(ranges):
+            if parts:
+                yield parts[index]
+
+            f.seek(start)
+            remaining = end - start + 1
+
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+
+                if not chunk:
+                    break
+
+                remaining -= len(chunk)
+                yield chunk
+
+            if parts:
+                yield b'\r\n'
+
+        if parts:
+            yield parts[-1]
+
+def _range_response(request, stored_file, ranges, size, content_type):
+    """
+    206 response for one range, or
+    multipart/byteranges for several
+    """
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+
+        response = StreamingHttpResponse(streaming_body(request, _iter_ranges(stored_file, ranges)), status=206)
+        response['Content-Type'] = content_type
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+
+        return response
+
+    boundary = secrets.token_hex(16)
+
+    parts = [
+        (
+            f'--{boundary}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+        ).encode()
+        for start, end in ranges
+    ]
+    parts.append(f'--{boundary}--\r\n'.encode())
+
+    length = sum(len(part) for part in parts) + sum(end - start + 1 + 2 for start, end in ranges)
+
+    response = StreamingHttpResponse(streaming_body(request, _iter_ranges(stored_file, ranges, parts)), status=206)
+    response['Content-Type'] = f'multipart/byteranges; boundary={boundary}'
+    response['Content-Length'] = length
+
+    return response
+
+def _offload_response(stored_file, backend):
+    """
+    Empty response telling the front proxy to send the file,
+    the proxy also takes care of the Range header
+    """
+
+    path = _local_path(stored_file)
+
+    if not path:
+        return None
+
+    response = HttpResponse()
+
+    if backend == NGINX:
+        # internal location mapped on MEDIA_ROOT
+        prefix = settings.DRIVE_FILE_DELIVERY_PREFIX.rstrip('/')
+        response['X-Accel-Redirect'] = f'{prefix}/{quote(stored_file.name)}'
+    else:
+        response['X-Sendfile'] = path
+
+    return response
+
+def serve_file(request, stored_file, name, content_type, etag, last_modified, size=None, as_attachment=False, cache_control='private, no-cache'):
+    """
+    Serve a stored file after the view has authorized it.
+
+    Answers conditional requests with a 304 and byte ranges
+    with a 206, so players can seek and browsers revalidate.
+    With the nginx or apache backend, Django only sends the
+    headers and the proxy transfers the bytes, so the worker
+    is released right away. The python backend streams the
+    file, gunicorn uses os.sendfile through wsgi.file_wrapper
+    and ASGI servers get it chunk by chunk from the event loop.
+    By default browsers revalidate on every use, content that
+    never changes under its url can pass a long max-age.
+    """
+
+    backend = settings.DRIVE_FILE_DELIVERY
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+    if response is None and backend in (NGINX, APACHE):
+        response = _offload_response(stored_file, backend)
+
+        if response is None:
+            logger.warning(f'{backend} delivery needs a local storage, falling back to python')
+
+    if response is None:
+        size = size or stored_file.size
+        ranges = None
+
+        if _if_range_matches(request, etag, last_modified):
+            ranges = parse_range_header(request.headers.get('Range'), size)
+
+        if ranges:
+            response = _range_response(request, stored_file, ranges, size, content_type)
+        elif ranges == []:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+        elif is_async_request(request):
+            # no sendfile under ASGI, the file is read in threads
+            response = StreamingHttpResponse(iterate_in_thread(_iter_ranges(stored_file, [(0, size - 1)])))
+            response['Content-Length'] = size
+        else:
+            response = FileResponse(stored_file.open('rb'))
+
+    if response.status_code == 200:
+        response['Content-Type'] = content_type
+
+    if response.status_code in (200, 206):
+        response['Content-Disposition'] = content_disposition_header(as_attachment, name)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = cache_control
+
+    return response
+
+def file_response(request, file_record, as_attachment=False):
+    """
+    Serve the content of a file record
+    """
+
+    return serve_file(
+        request,
+        file_record.file,
+        name=file_record.name,
+        content_type=file_record.mime_type or guess_mime_type(file_record.name),
+        etag=get_etag(file_record),
+        last_modified=int(file_record.created_at.timestamp()),
+        size=file_record.size,
+        as_attachment=as_attachment,
+    )
@@ -0,0 +1,83 @@
+"""
+Rendering of thumbnails. This module runs in the thumbnail
+worker processes: it must not import Django or the project.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+JPEG_QUALITY = 80
+
+def _save_jpeg(image, path):
+    image = image.convert('RGB')
+
+    partial_path = f'{path}.part'
+    image.save(partial_path, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    os.replace(partial_path, path)
+
+def render_image(source, outputs):
+    """
+    Write a JPEG of the image at each (max side, path) of
+    `outputs`, from the largest to the smallest so each
+    size is resized from the previous one
+    """
+
+    if Image is None:
+        raise RuntimeError('Pillow is not installed')
+
+    outputs = sorted(outputs, reverse=True)
+
+    with Image.open(source) as image:
+        # let the JPEG decoder downscale while reading
+        largest = outputs[0][0]
+        image.draft('RGB', (largest, largest))
+
+        image = ImageOps.exif_transpose(image)
+
+        for side, path in outputs:
+            image.thumbnail((side, side))
+            _save_jpeg(image, path)
+
+def render_pdf(source, outputs):
+    """
+    Write a JPEG of the first page of the PDF at each
+    (max side, path) of `outputs`, with poppler's pdftoppm
+    """
+
+    for side, path in outputs:
+        with tempfile.TemporaryDirectory() as tmp:
+            prefix = os.path.join(tmp, 'page')
+
+            subprocess.run(
+                [
+                    'pdftoppm', '-f', '1', '-l', '1', '-singlefile',
+                    '-scale-to', str(side), '-jpeg',
+                    '-jpegopt', f'quality={JPEG_QUALITY}',
+                    source, prefix,
+                ],
+                check=True,
+                capture_output=True,
+                timeout=60,
+            )
+
+            # the temporary directory may be on another disk
+            shutil.move(f'{prefix}.jpg', path)
+
+RENDERERS = {
+    'image': render_image,
+    'pdf': render_pdf,
+}
+
+def render(kind, source, outputs):
+    """
+    Entry point of the worker processes
+    """
+
+    RENDERERS[kind](source, outputs)
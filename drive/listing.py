@@ -0,0 +1,63 @@
+from django.db.models import QuerySet
+
+def _count(items):
+    if isinstance(items, QuerySet):
+        return items.count()
+    return len(items)
+
+class FolderFirstListing:
+    """
+    Folders followed by files, paginated in the database.
+
+    Works with Paginator: counting runs one COUNT per
+    table and a page only fetches the rows it shows,
+    instead of loading the whole directory in memory.
+    """
+
+    def __init__(self, folders, files):
+        self.folders = folders
+        self.files = files
+        self._folder_count = None
+        self._file_count = None
+
+    @property
+    def folder_count(self):
+        if self._folder_count is None:
+            self._folder_count = _count(self.folders)
+        return self._folder_count
+
+    @property
+    def file_count(self):
+        if self._file_count is None:
+            self._file_count = _count(self.files)
+        return self._file_count
+
+    def count(self):
+        return self.folder_count + self.file_count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            items = self[key:key + 1]
+            if not items:
+                raise IndexError('listing index out of range')
+            return items[0]
+
+        start = key.start or 0
+        stop = self.count() if key.stop is None else key.stop
+
+        items = []
+
+        # folders come first
+        if start < self.folder_count:
+            items.extend(self.folders[start:min(stop, self.folder_count)])
+
+        # then files, offset by the number of folders
+        if stop > self.folder_count:
+            file_start = max(start - self.folder_count, 0)
+            file_stop = stop - self.folder_count
+            items.extend(self.files[file_start:file_stop])
+
+        return items
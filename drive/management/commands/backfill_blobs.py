@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from drive.models import FileRecord
+from drive.blobs import ensure_blob
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Move files uploaded before blobs existed into the deduplicated blob storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        records = FileRecord.objects.filter(blob__isnull=True).exclude(file='')
+
+        moved = 0
+        missing = 0
+
+        for record in records.iterator(chunk_size=options['batch_size']):
+            try:
+                ensure_blob(record)
+            except OSError:
+                logger.warning(f'file missing on disk for record {record.id}')
+                missing += 1
+                continue
+
+            moved += 1
+
+        self.stdout.write(self.style.SUCCESS(f'{moved} files moved to blobs, {missing} missing on disk'))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from drive.models import FileRecord
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Capture size, mime type and checksum of files uploaded before metadata was stored'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--all', action='store_true', help='Recompute metadata of every file')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        records = FileRecord.objects.exclude(file='')
+
+        if not options['all']:
+            records = records.filter(checksum='')
+
+        batch = []
+        updated = 0
+        missing = 0
+
+        for record in records.only('id', 'name', 'file').iterator(chunk_size=batch_size):
+            try:
+                record.capture_file_metadata()
+            except OSError:
+                logger.warning(f'file missing on disk for record {record.id}')
+                missing += 1
+                continue
+
+            batch.append(record)
+
+            if len(batch) >= batch_size:
+                FileRecord.objects.bulk_update(batch, ['size', 'mime_type', 'checksum'])
+                updated += len(batch)
+                batch = []
+
+        if batch:
+            FileRecord.objects.bulk_update(batch, ['size', 'mime_type', 'checksum'])
+            updated += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'{updated} files updated, {missing} missing on disk'))
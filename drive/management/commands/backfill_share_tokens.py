@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from drive.models import ShareRecord, generate_share_token
+
+class Command(BaseCommand):
+    help = 'Give a link token to the shares created before tokens existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        records = ShareRecord.objects.filter(token__isnull=True)
+
+        batch = []
+        updated = 0
+
+        for record in records.only('id').iterator(chunk_size=batch_size):
+            record.token = generate_share_token()
+            batch.append(record)
+
+            if len(batch) >= batch_size:
+                ShareRecord.objects.bulk_update(batch, ['token'])
+                updated += len(batch)
+                batch = []
+
+        if batch:
+            ShareRecord.objects.bulk_update(batch, ['token'])
+            updated += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'{updated} shares updated'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from drive.models import Blob, FileRecord
+from drive.thumbnails import get_thumbnail_kind, build_thumbnails
+
+class Command(BaseCommand):
+    help = 'Render the thumbnails of the content stored before thumbnails existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--failed', action='store_true', help='Also retry the content that failed')
+
+    def handle(self, *args, **options):
+        statuses = ['', 'failed'] if options['failed'] else ['']
+
+        blobs = Blob.objects.filter(thumbnail_status__in=statuses).order_by('id')
+
+        counts = {}
+
+        for blob in blobs.iterator():
+            mime_type = FileRecord.objects.filter(blob=blob).values_list('mime_type', flat=True).first()
+            kind = get_thumbnail_kind(mime_type)
+
+            if not kind:
+                continue
+
+            status = build_thumbnails(blob.pk, kind)
+            counts[status] = counts.get(status, 0) + 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{counts.get('done', 0)} blobs rendered, {counts.get('failed', 0)} failed"
+        ))
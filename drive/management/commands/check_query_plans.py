@@ -0,0 +1,122 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Count
+from drive.models import FolderRecord
+from drive import queries
+import re
+
+# page queries as the views run them: first page, default size
+PAGE_SIZE = 20
+
+def get_checks(user, folder):
+    return [
+        ('racine: fichiers', queries.root_files(user)),
+        ('racine: dossiers', queries.root_folders(user)),
+        ('dossier: fichiers', queries.folder_files(folder)),
+        ('dossier: sous-dossiers', queries.folder_subfolders(folder)),
+        ('fichiers-recents', queries.recent_files(user)),
+        ('favoris: fichiers', queries.favorite_files(user)),
+        ('favoris: dossiers', queries.favorite_folders(user)),
+        ('corbeille: fichiers', queries.trashed_files(user)),
+        ('corbeille: dossiers', queries.trashed_folders(user)),
+        ('partages-avec-moi', queries.inbox_shares(user)),
+    ]
+
+def sqlite_scan(plan, table):
+    """
+    Name of the index used to read `table`, or None
+    when sqlite reads the whole table
+    """
+
+    for line in plan.splitlines():
+        match = re.search(rf'\b(SCAN|SEARCH) {table}\b(.*)', line)
+
+        if not match:
+            continue
+
+        index = re.search(r'USING (?:COVERING )?INDEX (\w+)|USING (INTEGER PRIMARY KEY)', match.group(2))
+
+        if index:
+            return index.group(1) or index.group(2)
+
+        return None
+
+    return None
+
+def postgresql_scan(plan, table):
+    for line in plan.splitlines():
+        if re.search(rf'Seq Scan on {table}\b', line):
+            return None
+
+        match = re.search(r'(?:Index Scan|Index Only Scan|Bitmap Index Scan)(?: Backward)? (?:using|on) (\w+)', line)
+
+        if match:
+            return match.group(1)
+
+    return None
+
+PARSERS = {
+    'sqlite': sqlite_scan,
+    'postgresql': postgresql_scan,
+}
+
+class Command(BaseCommand):
+    help = (
+        'EXPLAIN the main query of each drive page and fail when one reads '
+        'a whole table. Run it on a large dataset, see seed_workload.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='User whose pages are checked, the one with most files by default')
+        parser.add_argument('--analyze', action='store_true', help='Update the planner statistics first')
+        parser.add_argument('--show-plans', action='store_true')
+
+    def handle(self, *args, **options):
+        parse = PARSERS.get(connection.vendor)
+
+        if not parse:
+            raise CommandError(f'No plan parser for {connection.vendor}')
+
+        users = get_user_model().objects.all()
+
+        if options['user']:
+            user = users.filter(id=options['user']).first()
+        else:
+            user = users.annotate(file_count=Count('files')).order_by('-file_count').first()
+
+        if not user:
+            raise CommandError('No user to check')
+
+        folder = FolderRecord.objects.filter(
+            user=user,
+            is_deleted=False,
+        ).annotate(file_count=Count('files')).order_by('-file_count').first()
+
+        if not folder:
+            raise CommandError(f'User {user.pk} has no folder')
+
+        if options['analyze']:
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+        failures = []
+
+        for label, queryset in get_checks(user, folder):
+            table = queryset.model._meta.db_table
+            plan = queryset[:PAGE_SIZE].explain()
+            index = parse(plan, table)
+
+            if index:
+                self.stdout.write(f'{label}: {index}')
+            else:
+                failures.append(label)
+                self.stdout.write(self.style.ERROR(f'{label}: full scan of {table}'))
+
+            if options['show_plans'] or not index:
+                self.stdout.write(plan)
+
+        if failures:
+            raise CommandError(f'{len(failures)} queries without index: {", ".join(failures)}')
+
+        self.stdout.write(self.style.SUCCESS('All queries use an index'))
@@ -0,0 +1,235 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model, SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+from drive.models import FileRecord
+from urllib.parse import urlsplit
+from .run_benchmarks import percentile, git_revision
+import asyncio
+import json
+import time
+
+CHUNK_SIZE = 64 * 1024
+
+class Transfer:
+    """
+    Result of one request: time to the status line,
+    total time and bytes read, or the error
+    """
+
+    def __init__(self):
+        self.first_byte = None
+        self.elapsed = None
+        self.size = 0
+        self.status = None
+        self.error = None
+
+async def fetch(base_url, path, cookie, rate=None, timeout=None):
+    """
+    GET a url with a plain socket, reading the body at `rate`
+    bytes per second at most like a client on a slow link
+    """
+
+    url = urlsplit(base_url)
+    transfer = Transfer()
+    started = time.perf_counter()
+
+    try:
+        async with asyncio.timeout(timeout):
+            reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+
+            try:
+                writer.write((
+                    f'GET {path} HTTP/1.1\r\n'
+                    f'Host: {url.netloc}\r\n'
+                    f'Cookie: {cookie}\r\n'
+                    f'Connection: close\r\n\r\n'
+                ).encode())
+                await writer.drain()
+
+                status_line = await reader.readline()
+                transfer.first_byte = time.perf_counter() - started
+                transfer.status = int(status_line.split()[1])
+
+                # headers
+                while (await reader.readline()) not in (b'\r\n', b''):
+                    pass
+
+                while True:
+                    chunk = await reader.read(CHUNK_SIZE)
+
+                    if not chunk:
+                        break
+
+                    transfer.size += len(chunk)
+
+                    if rate:
+                        await asyncio.sleep(len(chunk) / rate)
+
+            finally:
+                writer.close()
+
+    except (OSError, ValueError, IndexError, TimeoutError) as e:
+        transfer.error = repr(e)
+
+    transfer.elapsed = time.perf_counter() - started
+
+    return transfer
+
+def summarize(values):
+    if not values:
+        return None
+
+    return {
+        'p50': round(percentile(values, 50) * 1000, 1),
+        'p90': round(percentile(values, 90) * 1000, 1),
+        'p99': round(percentile(values, 99) * 1000, 1),
+        'max': round(max(values) * 1000, 1),
+    }
+
+class Command(BaseCommand):
+    help = (
+        'Compare a sync (WSGI) and an async (ASGI) deployment: slow clients download '
+        'a file while a light page is probed, the report shows who kept answering'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sync-url', help='Base url of the WSGI server, e.g. http://127.0.0.1:8001')
+        parser.add_argument('--async-url', help='Base url of the ASGI server, e.g. http://127.0.0.1:8002')
+        parser.add_argument('--user', help='Username to download as, bench-0 by default')
+        parser.add_argument('--slug', help='File to download, the largest file of the user by default')
+        parser.add_argument('--clients', type=int, default=100, help='Concurrent downloads')
+        parser.add_argument('--rate', type=int, default=256 * 1024, help='Bytes per second read by each client')
+        parser.add_argument('--probe-interval', type=float, default=0.5, help='Seconds between two probes')
+        parser.add_argument('--timeout', type=float, default=120, help='Seconds allowed per request')
+        parser.add_argument('--output', default='download-load-report.json')
+
+    def login(self, user):
+        """
+        Session cookie of the user, read by both
+        servers from the shared database
+        """
+
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+
+        return f'{settings.SESSION_COOKIE_NAME}={session.session_key}', session
+
+    async def run(self, base_url, download_path, probe_path, cookie, options):
+        """
+        Start every download at once and probe the
+        server until the last one is finished
+        """
+
+        downloads = [
+            asyncio.create_task(fetch(base_url, download_path, cookie, options['rate'], options['timeout']))
+            for _ in range(options['clients'])
+        ]
+
+        probes = []
+        started = time.perf_counter()
+
+        while not all(task.done() for task in downloads):
+            probes.append(await fetch(base_url, probe_path, cookie, timeout=options['timeout']))
+            await asyncio.sleep(options['probe_interval'])
+
+        transfers = [task.result() for task in downloads]
+        duration = time.perf_counter() - started
+
+        completed = [t for t in transfers if not t.error and t.status == 200]
+        failed_probes = [p for p in probes if p.error or p.status != 200]
+
+        return {
+            'duration_s': round(duration, 2),
+            'downloads': {
+                'completed': len(completed),
+                'failed': len(transfers) - len(completed),
+                'first_byte_ms': summarize([t.first_byte for t in completed]),
+                'total_ms': summarize([t.elapsed for t in completed]),
+                'throughput_mb_s': round(sum(t.size for t in completed) / duration / 1024 / 1024, 2),
+                'errors': sorted({t.error for t in transfers if t.error})[:5],
+            },
+            'probes': {
+                'count': len(probes),
+                'failed': len(failed_probes),
+                'latency_ms': summarize([p.elapsed for p in probes if not p.error]),
+            },
+        }
+
+    def handle(self, *args, **options):
+        targets = {
+            name: options[f'{name}_url']
+            for name in ('sync', 'async')
+            if options[f'{name}_url']
+        }
+
+        if not targets:
+            raise CommandError('Give --sync-url, --async-url or both')
+
+        if options['clients'] < 1:
+            raise CommandError('At least one client is needed')
+
+        username = options['user'] or 'bench-0'
+        user = get_user_model().objects.filter(username=username).first()
+
+        if not user:
+            raise CommandError(f'User {username} not found, run seed_workload first')
+
+        files = FileRecord.objects.filter(user=user, is_deleted=False).exclude(file='')
+
+        if options['slug']:
+            files = files.filter(slug=options['slug'])
+
+        file_record = files.order_by('-size').first()
+
+        if not file_record:
+            raise CommandError(f'No file to download for {username}')
+
+        download_path = reverse('download-file', args=[file_record.slug])
+        probe_path = reverse('my-box')
+
+        cookie, session = self.login(user)
+
+        results = {}
+
+        try:
+            for name, base_url in targets.items():
+                self.stdout.write(
+                    f'{name}: {options["clients"]} clients downloading {file_record.name} '
+                    f'({file_record.size} bytes) at {options["rate"]} B/s from {base_url}...'
+                )
+
+                result = asyncio.run(self.run(base_url, download_path, probe_path, cookie, options))
+                results[name] = result
+
+                downloads = result['downloads']
+                probes = result['probes']
+
+                self.stdout.write(
+                    f'{name:6} {downloads["completed"]}/{options["clients"]} downloads in {result["duration_s"]} s, '
+                    f'first byte p99 {(downloads["first_byte_ms"] or {}).get("p99")} ms, '
+                    f'probe p50 {(probes["latency_ms"] or {}).get("p50")} ms '
+                    f'p99 {(probes["latency_ms"] or {}).get("p99")} ms, '
+                    f'{probes["failed"]}/{probes["count"]} probes failed'
+                )
+        finally:
+            session.delete()
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'revision': git_revision(),
+            'file_size': file_record.size,
+            'clients': options['clients'],
+            'rate': options['rate'],
+            'results': results,
+        }
+
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+
+        self.stdout.write(self.style.SUCCESS(f'report written to {options["output"]}'))
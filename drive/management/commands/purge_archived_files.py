@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from datetime import timedelta
+from drive.models import FileRecord
+from drive.blobs import purge_files
+
+class Command(BaseCommand):
+    help = 'Delete archived files for good and free the content nobody uses anymore'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Only files archived for at least this many days')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'])
+        purged = 0
+
+        while True:
+            ids = list(FileRecord.objects.filter(
+                is_archived=True,
+                archived_at__lte=before,
+            ).values_list('id', flat=True)[:options['batch_size']])
+
+            if not ids:
+                break
+
+            purged += purge_files(FileRecord.objects.filter(id__in=ids))
+
+        self.stdout.write(self.style.SUCCESS(f'{purged} files purged'))
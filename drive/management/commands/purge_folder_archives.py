@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from datetime import timedelta
+from django.db.models import Q
+from drive.models import ArchiveJob
+from drive.archives import delete_archive
+
+class Command(BaseCommand):
+    help = 'Delete folder archives that have not been downloaded for a while'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='Archives unused for this many days are deleted')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'])
+
+        jobs = ArchiveJob.objects.filter(
+            Q(status='done', last_used_at__lte=before) |
+            Q(status='failed', updated_at__lte=before) |
+            Q(folder__is_deleted=True)
+        ).exclude(status='running')
+
+        count = 0
+
+        for job in jobs:
+            delete_archive(job)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'{count} archives deleted'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from drive.uploads import purge_expired_uploads
+
+class Command(BaseCommand):
+    help = 'Delete expired unfinished uploads and their partial files'
+
+    def handle(self, *args, **options):
+        count = purge_expired_uploads()
+
+        self.stdout.write(self.style.SUCCESS(f'{count} uploads purged'))
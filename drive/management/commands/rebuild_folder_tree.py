@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from drive.models import FolderRecord
+
+class Command(BaseCommand):
+    help = 'Recompute the materialized path and depth of every folder'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        children = {}
+
+        for pk, parent_id in FolderRecord.objects.values_list('id', 'parent_id'):
+            children.setdefault(parent_id, []).append(pk)
+
+        # walk the tree from the roots
+        paths = {}
+        pending = [(pk, '/') for pk in children.get(None, [])]
+
+        while pending:
+            pk, parent_path = pending.pop()
+            paths[pk] = f'{parent_path}{pk}/'
+
+            for child_pk in children.get(pk, []):
+                pending.append((child_pk, paths[pk]))
+
+        folders = [
+            FolderRecord(id=pk, tree_path=path, depth=path.count('/') - 2)
+            for pk, path in paths.items()
+        ]
+
+        with transaction.atomic():
+            FolderRecord.objects.bulk_update(folders, ['tree_path', 'depth'], batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'{len(folders)} folders indexed'))
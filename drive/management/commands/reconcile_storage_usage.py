@@ -0,0 +1,96 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from drive.models import FileRecord, StorageUsage
+from drive.usage import compute_usage
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+USAGE_FIELDS = ['total_bytes', 'file_count', 'trashed_bytes', 'trashed_count', 'bytes_by_type']
+
+class Command(BaseCommand):
+    help = 'Recompute the storage usage of users, fixing file sizes that differ from the disk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='Only this user id')
+        parser.add_argument('--records-only', action='store_true', help='Trust the recorded sizes, do not stat the files')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def fix_sizes(self, user_id, batch_size):
+        """
+        Set the size of the records to the size of their file on the disk
+        """
+
+        storage = FileRecord._meta.get_field('file').storage
+        sizes = {}
+        fixed = []
+
+        records = FileRecord.objects.filter(
+            user_id=user_id,
+            is_archived=False,
+        ).exclude(file='').only('id', 'file', 'size')
+
+        for record in records.iterator(chunk_size=batch_size):
+            name = record.file.name
+
+            if name not in sizes:
+                # blobs are shared, stat each file once
+                try:
+                    sizes[name] = os.path.getsize(storage.path(name))
+                except OSError:
+                    logger.warning(f'file missing on disk for record {record.id}')
+                    sizes[name] = None
+
+            if sizes[name] is not None and sizes[name] != record.size:
+                record.size = sizes[name]
+                fixed.append(record)
+
+        FileRecord.objects.bulk_update(fixed, ['size'], batch_size=batch_size)
+
+        return len(fixed)
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by('id')
+
+        if options['user']:
+            users = users.filter(id=options['user'])
+
+        checked = 0
+        drifted = 0
+        sizes_fixed = 0
+
+        for user_id in users.values_list('id', flat=True).iterator():
+            with transaction.atomic():
+                usage = StorageUsage.objects.select_for_update().filter(user_id=user_id).first()
+
+                if not options['records_only']:
+                    sizes_fixed += self.fix_sizes(user_id, options['batch_size'])
+
+                expected = compute_usage(user_id)
+                checked += 1
+
+                if usage is None:
+                    StorageUsage.objects.create(user_id=user_id, **expected)
+                    continue
+
+                changed = [name for name in USAGE_FIELDS if getattr(usage, name) != expected[name]]
+
+                if not changed:
+                    continue
+
+                drifted += 1
+
+                self.stdout.write(f'user {user_id}: ' + ', '.join(
+                    f'{name} {getattr(usage, name)} → {expected[name]}' for name in changed
+                ))
+
+                for name in changed:
+                    setattr(usage, name, expected[name])
+
+                usage.save(update_fields=[*changed, 'updated_at'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{checked} users checked, {drifted} usages fixed, {sizes_fixed} file sizes fixed'
+        ))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from drive.models import FileRecord, FolderRecord, SearchEntry
+from drive.search import create_search_index, index_records
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the search entries of all files and folders, '
+        'creating the search tables and indexes if missing'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        create_search_index()
+
+        with transaction.atomic():
+            SearchEntry.objects.all().delete()
+
+            count = 0
+
+            for model in (FolderRecord, FileRecord):
+                records = model.objects.only('id', 'name', 'description', 'user_id')
+                batch = []
+
+                for record in records.iterator(chunk_size=batch_size):
+                    batch.append(record)
+
+                    if len(batch) >= batch_size:
+                        index_records(batch, batch_size)
+                        count += len(batch)
+                        batch = []
+
+                if batch:
+                    index_records(batch, batch_size)
+                    count += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'{count} records indexed'))
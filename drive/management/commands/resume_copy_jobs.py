@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from datetime import timedelta
+from drive.models import CopyJob, FolderRecord
+from drive.copying import run_copy_job
+from drive.tree import soft_delete_folder_tree
+
+class Command(BaseCommand):
+    help = 'Resume folder copies interrupted by a restart, or clean them up'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-minutes', type=int, default=10, help='Jobs without progress for this long are considered interrupted')
+        parser.add_argument('--cleanup', action='store_true', help='Move the partial copies to the trash instead of resuming')
+
+    def handle(self, *args, **options):
+        stale = timezone.now() - timedelta(minutes=options['stale_minutes'])
+
+        jobs = CopyJob.objects.filter(
+            status__in=['pending', 'running'],
+            updated_at__lte=stale,
+        )
+
+        resumed = 0
+        cleaned = 0
+
+        for job in jobs:
+            if not options['cleanup']:
+                job = run_copy_job(job.pk)
+                resumed += 1
+                continue
+
+            target = FolderRecord.objects.filter(pk=job.target_id, is_deleted=False).first()
+
+            if target:
+                soft_delete_folder_tree(target)
+
+            job.status = 'failed'
+            job.error = 'Interrupted'
+            job.finished_at = timezone.now()
+            job.save(update_fields=['status', 'error', 'finished_at', 'updated_at'])
+            cleaned += 1
+
+        self.stdout.write(self.style.SUCCESS(f'{resumed} jobs resumed, {cleaned} cleaned up'))
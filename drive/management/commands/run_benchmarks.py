@@ -0,0 +1,291 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment, override_settings
+from django.db import connection
+from django.db.models import Count, Sum
+from django.urls import reverse
+from django.utils import timezone
+from drive.models import FileRecord, FolderRecord, ShareRecord, CopyJob
+from drive.blobs import purge_files
+from drive.tree import restore_file
+import django
+import platform
+import subprocess
+import statistics
+import tracemalloc
+import json
+import time
+
+class Scenario:
+    """
+    One endpoint to time. `prepare` runs before each request
+    and returns its url, `cleanup` puts the data back after it.
+    """
+
+    def __init__(self, label, prepare, method='get', data=None, cleanup=None):
+        self.label = label
+        self.prepare = prepare
+        self.method = method
+        self.data = data
+        self.cleanup = cleanup
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile
+    """
+
+    values = sorted(values)
+    rank = max(int(round(percent / 100 * len(values))) - 1, 0)
+
+    return values[min(rank, len(values) - 1)]
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True, cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def dataset_stats():
+    files = FileRecord.objects.aggregate(count=Count('id'), size=Sum('size'))
+
+    return {
+        'users': get_user_model().objects.count(),
+        'folders': FolderRecord.objects.count(),
+        'files': files['count'],
+        'bytes': files['size'] or 0,
+        'shares': ShareRecord.objects.count(),
+    }
+
+class Command(BaseCommand):
+    help = 'Time the hot drive endpoints and write latency, query count and memory to a JSON report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Username to browse as, bench-0 by default')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--only', action='append', help='Only the scenarios with this label')
+        parser.add_argument('--output', default='benchmark-report.json')
+        parser.add_argument('--baseline', help='Previous report to compare with')
+
+    def get_scenarios(self, user):
+        my_box = reverse('my-box')
+
+        biggest = FolderRecord.objects.filter(
+            user=user,
+            is_deleted=False,
+        ).annotate(file_count=Count('files')).order_by('-file_count').first()
+
+        deepest = FolderRecord.objects.filter(user=user, is_deleted=False).order_by('-depth').first()
+
+        top = FolderRecord.objects.filter(user=user, is_deleted=False, parent=None).first()
+
+        received = ShareRecord.objects.filter(
+            recipient=user,
+            is_deleted=False,
+            folder__isnull=False,
+            folder__is_deleted=False,
+            expires_at__gt=timezone.now(),
+        ).select_related('folder').first()
+
+        if not biggest or not top:
+            raise CommandError(f'{user.username} has no folder, run seed_workload first')
+
+        scenarios = [
+            Scenario('my_drive: racine', lambda: my_box),
+            Scenario('my_drive: dossier', lambda: f'{my_box}?dossier={biggest.slug}'),
+            Scenario('my_drive: dossier profond', lambda: f'{my_box}?dossier={deepest.slug}'),
+            Scenario('my_drive: fichiers-recents', lambda: f'{my_box}?dossier=fichiers-recents'),
+            Scenario('my_drive: favoris', lambda: f'{my_box}?dossier=favoris'),
+            Scenario('my_drive: partages', lambda: f'{my_box}?dossier=partages'),
+            Scenario('my_drive: partages-avec-moi', lambda: f'{my_box}?dossier=partages-avec-moi'),
+            Scenario('my_drive: recherche', lambda: my_box, method='post', data={'search_term': 'fichier-1'}),
+            Scenario('download_folder', lambda: reverse('download-folder', args=[top.slug])),
+        ]
+
+        if received:
+            scenarios += [
+                Scenario('shared_folder', lambda: reverse('shared-folder-details', args=[received.token])),
+                Scenario(
+                    'copy_shared_folder',
+                    lambda: reverse('copy-shared-folder', args=[received.token]),
+                    method='post',
+                    cleanup=lambda: self.delete_copies(user),
+                ),
+            ]
+
+        deleted = []
+
+        def prepare_delete():
+            file_record = FileRecord.objects.filter(user=user, is_deleted=False).order_by('?').first()
+            deleted.append(file_record)
+            return reverse('delete-file', args=[file_record.slug])
+
+        def restore_deleted():
+            file_record = deleted.pop()
+            file_record.refresh_from_db()
+            restore_file(file_record)
+
+        scenarios.append(Scenario('delete_file', prepare_delete, cleanup=restore_deleted))
+
+        return scenarios
+
+    def delete_copies(self, user):
+        """
+        Remove the folders made by the copy scenario
+        """
+
+        for job in CopyJob.objects.filter(user=user).select_related('target'):
+            if job.target:
+                purge_files(FileRecord.objects.filter(
+                    folder__tree_path__startswith=job.target.ensure_tree_path()
+                ))
+                job.target.delete()
+
+            job.delete()
+
+    def request(self, client, scenario):
+        """
+        Run one request, reading streamed bodies to the end
+        """
+
+        url = scenario.prepare()
+
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+
+            response = getattr(client, scenario.method)(url, scenario.data or {})
+
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+
+            elapsed = time.perf_counter() - started
+
+        if scenario.cleanup:
+            scenario.cleanup()
+
+        return response.status_code, elapsed, len(queries)
+
+    def measure(self, client, scenario, iterations, warmup):
+        for _ in range(warmup):
+            self.request(client, scenario)
+
+        latencies = []
+        query_counts = []
+        statuses = set()
+
+        for _ in range(iterations):
+            status, elapsed, query_count = self.request(client, scenario)
+
+            statuses.add(status)
+            latencies.append(elapsed * 1000)
+            query_counts.append(query_count)
+
+        # tracing slows everything down, so memory gets its own run
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+
+        try:
+            self.request(client, scenario)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'status': sorted(statuses),
+            'latency_ms': {
+                'mean': round(statistics.mean(latencies), 2),
+                'p50': round(percentile(latencies, 50), 2),
+                'p90': round(percentile(latencies, 90), 2),
+                'p99': round(percentile(latencies, 99), 2),
+                'max': round(max(latencies), 2),
+            },
+            'queries': {
+                'mean': round(statistics.mean(query_counts), 1),
+                'max': max(query_counts),
+            },
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+
+    def compare(self, results, baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)['results']
+
+        self.stdout.write(f'\ncompared with {baseline_path}:')
+
+        for label, result in results.items():
+            before = baseline.get(label)
+
+            if not before:
+                continue
+
+            old = before['latency_ms']['p50']
+            new = result['latency_ms']['p50']
+            change = (new - old) / old * 100 if old else 0
+
+            self.stdout.write(
+                f'{label:32} p50 {old:8.2f} → {new:8.2f} ms ({change:+.0f}%)  '
+                f'queries {before["queries"]["mean"]} → {result["queries"]["mean"]}'
+            )
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('At least one iteration is needed')
+
+        username = options['user'] or 'bench-0'
+        user = get_user_model().objects.filter(username=username).first()
+
+        if not user:
+            raise CommandError(f'User {username} not found, run seed_workload first')
+
+        # the test client needs the testserver host
+        setup_test_environment()
+
+        results = {}
+
+        try:
+            client = Client()
+            client.force_login(user)
+
+            # background jobs run inside the request so they are timed
+            with override_settings(DRIVE_BACKGROUND_WORKERS=0):
+                for scenario in self.get_scenarios(user):
+                    if options['only'] and scenario.label not in options['only']:
+                        continue
+
+                    result = self.measure(client, scenario, options['iterations'], options['warmup'])
+                    results[scenario.label] = result
+
+                    self.stdout.write(
+                        f'{scenario.label:32} p50 {result["latency_ms"]["p50"]:8.2f} ms  '
+                        f'p99 {result["latency_ms"]["p99"]:8.2f} ms  '
+                        f'{result["queries"]["mean"]:6} queries  '
+                        f'{result["peak_memory_kb"]:10} KB  {result["status"]}'
+                    )
+        finally:
+            teardown_test_environment()
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'revision': git_revision(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'user': user.username,
+            'iterations': options['iterations'],
+            'dataset': dataset_stats(),
+            'results': results,
+        }
+
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+        self.stdout.write(self.style.SUCCESS(f'report written to {options["output"]}'))
+
+        if options['baseline']:
+            self.compare(results, options['baseline'])
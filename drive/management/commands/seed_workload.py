@@ -0,0 +1,179 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from datetime import timedelta
+from drive.models import FileRecord, FolderRecord, ShareRecord, ContactDetails
+from drive.blobs import purge_files
+import random
+
+# no image or pdf: random bytes would only make thumbnails fail
+EXTENSIONS = ['txt', 'md', 'docx', 'csv', 'xlsx', 'mp4', 'mp3', 'zip']
+
+PASSWORD = 'bench'
+
+class Command(BaseCommand):
+    help = 'Create synthetic users with folder trees, files with real bytes, contacts and shares'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5)
+        parser.add_argument('--depth', type=int, default=3, help='Levels of folders under the root')
+        parser.add_argument('--breadth', type=int, default=3, help='Subfolders per folder')
+        parser.add_argument('--files', type=int, default=10, help='Files per folder, and at the root')
+        parser.add_argument('--file-size', type=int, default=16 * 1024, help='Average file size in bytes')
+        parser.add_argument('--shares', type=int, default=5, help='Shares sent by each user')
+        parser.add_argument('--trash-ratio', type=float, default=0.05, help='Part of the files moved to the trash')
+        parser.add_argument('--prefix', default='bench', help='Prefix of the usernames')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--reset', action='store_true', help='Delete the users of a previous run first')
+
+    def reset(self, prefix):
+        users = get_user_model().objects.filter(username__startswith=f'{prefix}-')
+
+        # through purge_files so the stored content is released
+        purged = purge_files(FileRecord.objects.filter(user__in=users))
+        users.delete()
+
+        self.stdout.write(f'{purged} files of a previous run deleted')
+
+    def make_file(self, rng, user, folder, index, options):
+        size = rng.randint(options['file_size'] // 2, options['file_size'] * 3 // 2)
+        name = f'fichier-{index}.{rng.choice(EXTENSIONS)}'
+
+        return FileRecord.objects.create(
+            user=user,
+            folder=folder,
+            name=name,
+            file=ContentFile(rng.randbytes(size), name=name),
+            is_favorite=rng.random() < 0.05,
+        )
+
+    def make_tree(self, rng, user, options):
+        """
+        Folder tree of `depth` levels with `breadth`
+        subfolders each, and `files` files in every folder
+        """
+
+        folders = []
+        files = []
+        level = [None]
+
+        for depth in range(options['depth'] + 1):
+            next_level = []
+
+            for parent in level:
+                for index in range(options['files']):
+                    files.append(self.make_file(rng, user, parent, len(files), options))
+
+                if depth == options['depth']:
+                    continue
+
+                for index in range(options['breadth']):
+                    folder = FolderRecord.objects.create(
+                        user=user,
+                        parent=parent,
+                        name=f'dossier-{depth}-{index}',
+                        is_favorite=rng.random() < 0.05,
+                    )
+                    next_level.append(folder)
+
+            folders.extend(next_level)
+            level = next_level
+
+        return folders, files
+
+    def share(self, owner, recipient, record):
+        contact = ContactDetails.objects.filter(user=owner, email=recipient.email).first()
+
+        if not contact:
+            contact = ContactDetails.objects.create(
+                user=owner,
+                first_name=recipient.username,
+                last_name='bench',
+                email=recipient.email,
+            )
+
+        expires_at = timezone.now() + timedelta(days=30)
+
+        record.shared_at = timezone.now()
+        record.share_expires_at = expires_at
+        record.save()
+
+        kind = 'file' if isinstance(record, FileRecord) else 'folder'
+
+        ShareRecord.objects.create(
+            contact=contact,
+            recipient=recipient,
+            expires_at=expires_at,
+            **{kind: record},
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('At least one user is needed')
+
+        rng = random.Random(options['seed'])
+        prefix = options['prefix']
+
+        User = get_user_model()
+
+        if options['reset']:
+            self.reset(prefix)
+
+        if User.objects.filter(username__startswith=f'{prefix}-').exists():
+            raise CommandError(f'Users {prefix}-* already exist, use --reset')
+
+        # hashing is slow on purpose, do it once
+        password = make_password(PASSWORD)
+
+        users = []
+        records = {}
+        file_count = 0
+        folder_count = 0
+
+        for index in range(options['users']):
+            with transaction.atomic():
+                user = User.objects.create(
+                    username=f'{prefix}-{index}',
+                    email=f'{prefix}-{index}@example.com',
+                    password=password,
+                )
+
+                folders, files = self.make_tree(rng, user, options)
+
+                for file_record in files:
+                    if rng.random() < options['trash_ratio']:
+                        file_record.is_deleted = True
+                        file_record.deleted_at = timezone.now()
+                        file_record.save()
+
+            users.append(user)
+            records[user.pk] = folders + [f for f in files if not f.is_deleted]
+            file_count += len(files)
+            folder_count += len(folders)
+
+            self.stdout.write(f'{user.username}: {len(folders)} folders, {len(files)} files')
+
+        share_count = 0
+
+        if len(users) > 1:
+            with transaction.atomic():
+                for index, owner in enumerate(users):
+                    for count in range(options['shares']):
+                        if count == 0 and records[owner.pk]:
+                            # every user receives at least a whole top folder
+                            recipient = users[index - 1]
+                            record = records[owner.pk][0]
+                        else:
+                            recipient = rng.choice([user for user in users if user.pk != owner.pk])
+                            record = rng.choice(records[owner.pk])
+
+                        self.share(owner, recipient, record)
+                        share_count += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(users)} users, {folder_count} folders, {file_count} files, {share_count} shares '
+            f'(password: {PASSWORD})'
+        ))
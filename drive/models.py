@@ -1,18 +1,28 @@
 from django.contrib.auth import get_user_model
-from django.core.files.base import ContentFile
+from django.conf import settings
 from django.utils.text import slugify
 from django.utils import timezone
-from django.db.models import Q
-from django.db import models
+from django.db.models.functions import Concat, Substr
+from django.db.models import Q, Sum, Count, F, Value
+from django.db import models, transaction
+from .utils import guess_mime_type
+import hashlib
 import logging
+import secrets
 import uuid
 import os
 
 logger = logging.getLogger(__name__)
 
-FOLDER_SIZE_30MB = 30 * 1024 * 1024
 MAX_SLUG_LENGTH = 255
 
+def generate_share_token():
+    """
+    Random token of a share link, 24 url-safe characters
+    """
+
+    return secrets.token_urlsafe(18)
+
 def generate_slug(instance, is_folder = False):
     """
     Generate file slug
@@ -61,6 +71,104 @@ def sizeof_fmt(num, suffix="B"):
         num /= 1024.0
     return f"{num:.1f} Y{suffix}"
 
+FILE_TYPE_GROUPS = {
+    'pdf': ['pdf'],
+    'image': ['jpg', 'jpeg', 'png', 'gif', 'bmp', 'svg', 'webp', 'tiff'],
+    'document': ['pdf', 'doc', 'docx', 'odt', 'rtf', 'txt', 'md'],
+    'spreadsheet': ['xls', 'xlsx', 'csv', 'ods'],
+    'presentation': ['ppt', 'pptx', 'odp'],
+    'archive': ['zip', 'rar', '7z', 'tar', 'gz'],
+    'audio': ['mp3', 'wav', 'ogg', 'aac', 'flac', 'm4a'],
+    'video': ['mp4', 'webm', 'mov', 'avi', 'mkv', 'wmv', 'flv'],
+}
+
+def get_type_group(name):
+    """
+    Category of a file name, from its extension
+    """
+
+    ext = os.path.splitext(name)[1].lower().lstrip('.')
+
+    for category, extensions in FILE_TYPE_GROUPS.items():
+        if ext in extensions:
+            return category
+
+    return 'other'
+
+class TrackedFieldsMixin:
+    """
+    Remember the values of `tracked_fields` as loaded
+    from the database, so save() can tell what changed
+    without fetching the row again
+    """
+
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_tracked_fields()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._snapshot_tracked_fields(fields)
+
+    def _snapshot_tracked_fields(self, fields=None):
+        deferred = self.get_deferred_fields()
+
+        if fields is None:
+            self._loaded_values = {}
+        else:
+            # partial refresh, e.g. a deferred field being loaded
+            fields = {name.removesuffix('_id') for name in fields}
+
+        loaded = getattr(self, '_loaded_values', {})
+
+        for name in self.tracked_fields:
+            if name in deferred:
+                continue
+
+            if fields is None or name.removesuffix('_id') in fields:
+                loaded[name] = getattr(self, name)
+
+        self._loaded_values = loaded
+
+    def get_loaded_values(self, fields):
+        """
+        Get the database values of `fields`, only querying
+        the ones that were deferred when the row was loaded
+        """
+
+        loaded = getattr(self, '_loaded_values', {})
+        missing = [name for name in fields if name not in loaded]
+
+        if missing and self.pk:
+            row = type(self).objects.filter(pk=self.pk).values(*missing).first() or {}
+            loaded.update(row)
+            self._loaded_values = loaded
+
+        return {name: loaded.get(name) for name in fields}
+
+    def get_changed_fields(self, update_fields=None):
+        """
+        Get the tracked fields whose value differs
+        from the database, within `update_fields` if given
+        """
+
+        # a field never loaded was not changed in memory
+        deferred = self.get_deferred_fields()
+
+        fields = [
+            name for name in self.tracked_fields
+            if name not in deferred
+            and (update_fields is None or name in update_fields or name.removesuffix('_id') in update_fields)
+        ]
+
+        loaded = self.get_loaded_values(fields)
+
+        return {name for name in fields if loaded[name] != getattr(self, name)}
+
 def user_hashed_upload_to(instance, filename):
     user_id = instance.user.id
     file_uuid = instance.file_uuid
@@ -75,7 +183,12 @@ def user_hashed_upload_to(instance, filename):
 
     return path
 
-class FileRecord(models.Model):
+def blob_upload_to(instance, filename):
+    checksum = instance.checksum
+
+    return os.path.join('blobs', checksum[:2], checksum[2:4], f"{checksum}.dat")
+
+class FileRecord(TrackedFieldsMixin, models.Model):
     file = models.FileField(upload_to=user_hashed_upload_to)
     
     name = models.CharField(max_length=255)
@@ -86,20 +199,28 @@ class FileRecord(models.Model):
     
     is_favorite = models.BooleanField(default=False)
 
+    # content metadata captured once at upload time
+    size = models.PositiveBigIntegerField(default=0)
+    mime_type = models.CharField(max_length=255, blank=True, db_index=True)
+    checksum = models.CharField(max_length=64, blank=True, db_index=True)
+
+    # shared content, `file` points to the blob file
+    blob = models.ForeignKey(
+        'Blob',
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+        related_name='files'
+    )
+
     @property
     def is_shared(self):
-        # Check if the file itself is explicitly shared and not expired
-        if self.shared_at and (not self.share_expires_at or self.share_expires_at > timezone.now()):
-            return True
+        # computed for a whole listing by annotate_shared_state
+        if '_is_shared' in self.__dict__:
+            return self._is_shared
 
-        # Check parent folders
-        folder = self.folder
-        while folder:
-            if folder.shared_at and (not folder.share_expires_at or folder.share_expires_at > timezone.now()):
-                return True
-            folder = folder.parent
-
-        return False
+        from .access import is_record_shared
+        return is_record_shared(self)
 
     shared_at = models.DateTimeField(null=True, blank=True)
     share_expires_at = models.DateTimeField(null=True, blank=True)
@@ -131,16 +252,6 @@ class FileRecord(models.Model):
         related_name='files'
     )
     
-    @property
-    def size(self):
-        if self.file and hasattr(self.file, 'path'):
-            try:
-                size_bytes = os.path.getsize(self.file.path)
-                return size_bytes
-            except OSError:
-                return 0
-        return 0
-    
     @property
     def file_extension(self):
         name = self.name
@@ -160,28 +271,16 @@ class FileRecord(models.Model):
     
     @property
     def display_type_group(self):
-        ext = self.display_type.lower()
-
-        categories = {
-            'pdf': ['pdf'],
-            'image': ['jpg', 'jpeg', 'png', 'gif', 'bmp', 'svg', 'webp', 'tiff'],
-            'document': ['pdf', 'doc', 'docx', 'odt', 'rtf', 'txt', 'md'],
-            'spreadsheet': ['xls', 'xlsx', 'csv', 'ods'],
-            'presentation': ['ppt', 'pptx', 'odp'],
-            'archive': ['zip', 'rar', '7z', 'tar', 'gz'],
-            'audio': ['mp3', 'wav', 'ogg', 'aac', 'flac', 'm4a'],
-            'video': ['mp4', 'webm', 'mov', 'avi', 'mkv', 'wmv', 'flv'],
-        }
-
-        for category, extensions in categories.items():
-            if ext in extensions:
-                return category
-
-        return 'other'
+        return get_type_group(self.name)
     
     @property
     def display_size(self):
         return sizeof_fmt(self.size)
+
+    @property
+    def has_thumbnail(self):
+        # listings select the blob with the files
+        return bool(self.blob_id) and self.blob.thumbnail_status == 'done'
     
     @property
     def name_without_ext(self):
@@ -192,41 +291,32 @@ class FileRecord(models.Model):
         return shares.filter(is_deleted = False)
     
     def get_all_parent_folders(self):
+        if not self.folder_id:
+            return []
+
         parents = []
-        folder = self.folder
-        
-        while folder is not None and not folder.is_deleted:
+
+        for folder in self.folder.get_ancestors(include_self=True):
+            if folder.is_deleted:
+                break
             parents.append(folder)
-            folder = folder.parent
+
         return parents
     
     def get_all_shared_parents(self):
-        parents = []
-        folder = self.folder
-        
-        while folder is not None and not folder.is_deleted:
-            if folder.is_shared:
-                parents.append(folder)
-            folder = folder.parent
-        return parents
+        from .access import annotate_shared_state
+
+        parents = annotate_shared_state(self.get_all_parent_folders())
+        return [folder for folder in parents if folder.is_shared]
     
     def is_accessible_by_user(self, user):
         """
         Check if the file is directly shared with the user
         or if any of its parent folders is shared with the user.
         """
-        # 1. Check if file is directly shared with the user
-        if self.shares.filter(is_deleted=False, contact__user=user).exists():
-            return True
+        from .access import resolve_access
 
-        # 2. Check if any parent folder is shared with the user
-        folder = self.folder
-        while folder is not None and not folder.is_deleted:
-            if folder.shares.filter(is_deleted=False, contact__user=user).exists():
-                return True
-            folder = folder.parent
-        
-        return False
+        return resolve_access(user, self) is not None
 
     def get_users_with_access(self):
         parents = self.get_all_parent_folders()
@@ -256,12 +346,11 @@ class FileRecord(models.Model):
         Return all ShareRecord instances that give access to this file,
         including shares on the file itself and shares on any parent folder.
         """
-        # Get all parent folders
-        parents = self.get_all_parent_folders()
+        from .access import live_folder_ids
 
         return ShareRecord.objects.filter(
             Q(file=self) |
-            Q(folder__in=parents),
+            Q(folder_id__in=live_folder_ids(self)),
             is_deleted=False
         ).select_related('contact', 'recipient').distinct()
         
@@ -291,28 +380,79 @@ class FileRecord(models.Model):
         original_file_record = self
 
         if original_file_record and original_file_record.file:
-            # Open and read the actual file
-            with original_file_record.file.open("rb") as f:
-                file_content = ContentFile(
-                    f.read(),
-                    name=os.path.basename(original_file_record.file.name)
-                )
-
-            # Create a new FileRecord for the target user
-            new_file_record = FileRecord.objects.create(
+            return original_file_record.make_copy(
+                target_user,
                 name=f"{original_file_record.name} - copie {timezone.now().strftime("%d-%m-%Y %H:%M")}",
                 description=original_file_record.description,
-                user=target_user,
-                file=file_content
             )
 
-            return new_file_record
-
         return None
+
+    def make_copy(self, target_user, name=None, folder=None, description=None):
+        """
+        Copy the record for `target_user`. The content
+        is shared through the blob, nothing is read
+        or written on the disk.
+        """
+
+        from .blobs import ensure_blob, acquire_blobs
+
+        blob = ensure_blob(self)
+
+        with transaction.atomic():
+            acquire_blobs({blob.pk: 1})
+
+            return FileRecord.objects.create(
+                name=name or self.name,
+                description=description,
+                user=target_user,
+                folder=folder,
+                file=blob.file.name,
+                blob=blob,
+                size=self.size,
+                mime_type=self.mime_type,
+                checksum=self.checksum,
+            )
     
 
+    tracked_fields = ('name', 'description', 'is_deleted', 'is_archived', 'folder_id')
+
     class Meta:
         ordering = ['-created_at']
+
+        # partial indexes only hold the rows the views
+        # filter on, backends without them ignore them
+        indexes = [
+            # root and folder listings
+            models.Index(
+                fields=['user', 'folder', '-created_at'],
+                condition=Q(is_deleted=False),
+                name='file_live_user_folder_idx',
+            ),
+            models.Index(
+                fields=['folder', '-created_at'],
+                condition=Q(is_deleted=False),
+                name='file_live_folder_idx',
+            ),
+            # fichiers-recents
+            models.Index(
+                fields=['user', '-last_accessed_at'],
+                condition=Q(is_deleted=False),
+                name='file_live_recent_idx',
+            ),
+            # favoris
+            models.Index(
+                fields=['user', '-created_at'],
+                condition=Q(is_deleted=False, is_favorite=True),
+                name='file_live_favorite_idx',
+            ),
+            # corbeille
+            models.Index(
+                fields=['user', '-deleted_at'],
+                condition=Q(is_deleted=True, is_archived=False),
+                name='file_trash_idx',
+            ),
+        ]
         
     def __str__(self):
         return f"{self.name} by {self.user.username}"
@@ -321,27 +461,128 @@ class FileRecord(models.Model):
         from django.utils import timezone
         return self.expires_at and timezone.now() > self.expires_at
 
+    def capture_file_metadata(self):
+        """
+        Compute size, mime type and
+        checksum of the attached file
+        """
+
+        hasher = hashlib.sha256()
+        size = 0
+
+        for chunk in self.file.chunks():
+            hasher.update(chunk)
+            size += len(chunk)
+
+        self.size = size
+        self.checksum = hasher.hexdigest()
+        self.mime_type = guess_mime_type(self.name)
+
     def save(self, *args, **kwargs):
-        
-        slug_candidate = generate_slug(self)
-        
-        if not self.pk:
+        # new content to store with the record
+        content = None
+
+        if self.file and not self.file._committed:
+            # new content → capture metadata before it hits the disk
+            self.capture_file_metadata()
+            content = self.file
+
+        from .usage import apply_changes, file_state, record_state
+        from .cache import bump_listings, listing_scope
+
+        update_fields = kwargs.get('update_fields')
+        reindex = True
+        # usage state of the row as stored, none when new
+        previous_state = None
+        is_new = self._state.adding
+        # cached listings showing the file
+        scopes = {listing_scope(self.user_id, self.folder_id)}
+
+        if is_new:
             # New record → always generate slug
-            self.slug = slug_candidate
+            self.slug = generate_slug(self)
             
         else:
+            changed = self.get_changed_fields(update_fields)
+
+            previous_state = record_state(self)
+
+            if changed & {'name', 'is_deleted', 'is_archived'}:
+                loaded = self.get_loaded_values(['name', 'is_deleted', 'is_archived'])
+                previous_state = file_state(**loaded)
+
             # Existing record → check if name changed
-            original = type(self).objects.get(pk=self.pk)
-            if original.name != self.name:
-                self.slug = slug_candidate
+            if 'name' in changed:
+                self.slug = generate_slug(self)
 
-            if not original.is_deleted and self.is_deleted:
+                if update_fields is not None:
+                    kwargs['update_fields'] = {*update_fields, 'slug'}
+
+            if 'is_deleted' in changed and self.is_deleted:
                 # Mark related shares as deleted
                 self.shares.update(is_deleted=True, deleted_at=timezone.now())
 
-        super().save(*args, **kwargs)
+            if 'folder_id' in changed:
+                scopes.add(listing_scope(self.user_id, self.get_loaded_values(['folder_id'])['folder_id']))
+
+            reindex = bool(changed & {'name', 'description'})
+
+        try:
+            with transaction.atomic():
+                if content is not None:
+                    # identical content is only stored once, the reference
+                    # is rolled back with the record if the save fails
+                    from .blobs import store_blob
+                    self.blob = store_blob(content, self.checksum, self.size)
+                    self.file = self.blob.file.name
+
+                # uploads, trash, restore and archive move the storage usage
+                apply_changes(self.user_id, [(self.size, previous_state, record_state(self))])
 
-class FolderRecord(models.Model):
+                super().save(*args, **kwargs)
+
+                bump_listings(scopes)
+
+        except Exception:
+            if content is not None and self.blob_id:
+                from .blobs import discard_blob
+                discard_blob(self.blob)
+
+            raise
+
+        self._snapshot_tracked_fields()
+
+        if is_new and self.blob_id:
+            # content seen for the first time gets its thumbnails
+            from .thumbnails import queue_thumbnails
+            queue_thumbnails(self.blob, self.mime_type)
+
+        if reindex:
+            from .search import index_record
+            index_record(self)
+
+    def delete(self, *args, **kwargs):
+        from .blobs import release_blobs
+        from .usage import apply_changes, file_state
+        from .cache import bump_listings, listing_scope
+
+        blob_id = self.blob_id
+
+        with transaction.atomic():
+            loaded = self.get_loaded_values(['name', 'is_deleted', 'is_archived'])
+            apply_changes(self.user_id, [(self.size, file_state(**loaded), None)])
+
+            bump_listings([listing_scope(self.user_id, self.folder_id)])
+
+            result = super().delete(*args, **kwargs)
+
+        if blob_id:
+            # the blob is freed with its last reference
+            release_blobs({blob_id: 1})
+
+        return result
+
+class FolderRecord(TrackedFieldsMixin, models.Model):
     name = models.CharField(max_length=255)
     description = models.CharField(max_length=255, null=True, blank=True)
     
@@ -352,18 +593,12 @@ class FolderRecord(models.Model):
 
     @property
     def is_shared(self):
-        # Check if the file itself is explicitly shared and not expired
-        if self.shared_at and (not self.share_expires_at or self.share_expires_at > timezone.now()):
-            return True
-
-        # Check parent folders
-        folder = self.parent
-        while folder:
-            if folder.shared_at and (not folder.share_expires_at or folder.share_expires_at > timezone.now()):
-                return True
-            folder = folder.parent
+        # computed for a whole listing by annotate_shared_state
+        if '_is_shared' in self.__dict__:
+            return self._is_shared
 
-        return False
+        from .access import is_record_shared
+        return is_record_shared(self)
     
     shared_at = models.DateTimeField(null=True, blank=True)
     share_expires_at = models.DateTimeField(null=True, blank=True)
@@ -374,6 +609,10 @@ class FolderRecord(models.Model):
     is_deleted = models.BooleanField(default=False)
     deleted_at = models.DateTimeField(null=True, blank=True)
 
+    # materialized path of folder ids from the root, e.g. /3/17/42/
+    tree_path = models.CharField(max_length=1024, blank=True, db_index=True)
+    depth = models.PositiveIntegerField(default=0)
+
     user = models.ForeignKey(
         get_user_model(), 
         on_delete=models.CASCADE, 
@@ -388,9 +627,32 @@ class FolderRecord(models.Model):
         related_name='subfolders'
     )
 
+    tracked_fields = ('name', 'description', 'is_deleted', 'parent_id')
+
     class Meta:
         unique_together = ('user', 'parent', 'name')  # prevent duplicate folder names within same parent
         ordering = ['name']
+
+        indexes = [
+            # root and subfolder listings
+            models.Index(
+                fields=['parent', 'name'],
+                condition=Q(is_deleted=False),
+                name='folder_live_parent_idx',
+            ),
+            # favoris
+            models.Index(
+                fields=['user', 'name'],
+                condition=Q(is_deleted=False, is_favorite=True),
+                name='folder_live_favorite_idx',
+            ),
+            # corbeille
+            models.Index(
+                fields=['user', '-deleted_at'],
+                condition=Q(is_deleted=True),
+                name='folder_trash_idx',
+            ),
+        ]
         
     def __str__(self):
         return self.name
@@ -399,17 +661,78 @@ class FolderRecord(models.Model):
         shares = self.shares.all()
         return shares.filter(is_deleted = False)
     
+    def ensure_tree_path(self):
+        """
+        Get the materialized path of the folder,
+        computing it for rows that predate the tree index
+        """
+
+        if not self.tree_path:
+            parent_path = self.parent.ensure_tree_path() if self.parent_id else '/'
+
+            self.tree_path = f'{parent_path}{self.pk}/'
+            self.depth = self.tree_path.count('/') - 2
+
+            FolderRecord.objects.filter(pk=self.pk).update(
+                tree_path=self.tree_path,
+                depth=self.depth
+            )
+
+        return self.tree_path
+
+    def get_ancestor_ids(self):
+        """
+        Get ids of all parent folders, root first
+        """
+
+        ids = self.ensure_tree_path().strip('/').split('/')
+        return [int(pk) for pk in ids[:-1]]
+
+    def get_ancestors(self, include_self=False):
+        """
+        Get all parent folders in one query,
+        from the direct parent up to the root
+        """
+
+        ids = self.get_ancestor_ids()
+
+        if include_self:
+            ids.append(self.pk)
+
+        return FolderRecord.objects.filter(id__in=ids).order_by('-depth')
+
+    def get_descendants(self, include_self=True):
+        """
+        Get all subfolders at any depth in one query
+        """
+
+        descendants = FolderRecord.objects.filter(
+            tree_path__startswith=self.ensure_tree_path()
+        )
+
+        if not include_self:
+            descendants = descendants.exclude(pk=self.pk)
+
+        return descendants
+
+    def is_descendant_of(self, folder):
+        """
+        Check if this folder is under `folder`
+        """
+
+        return self.ensure_tree_path().startswith(folder.ensure_tree_path())
+
     def get_all_parent_folders(self):
         """
         Get all parent folders that
         are not deleted
         """
         parents = []
-        folder = self.parent
-        
-        while folder is not None and not folder.is_deleted:
+
+        for folder in self.get_ancestors():
+            if folder.is_deleted:
+                break
             parents.append(folder)
-            folder = folder.parent
 
         return parents
     
@@ -418,35 +741,19 @@ class FolderRecord(models.Model):
         Get all shared parent folders
         that are not deleted
         """
+        from .access import annotate_shared_state
 
-        parents = []
-        folder = self.parent
-        
-        while folder is not None and not folder.is_deleted:
-            if folder.is_shared:
-                parents.append(folder)
-            folder = folder.parent
-
-        return parents
+        parents = annotate_shared_state(self.get_all_parent_folders())
+        return [folder for folder in parents if folder.is_shared]
     
     def is_accessible_by_user(self, user):
         """
         Check if the file is directly shared with the user
         or if any of its parent folders is shared with the user.
         """
+        from .access import resolve_access
 
-        # 1. Check if file is directly shared with the user
-        if self.shares.filter(is_deleted=False, contact__user=user).exists():
-            return True
-
-        # 2. Check if any parent folder is shared with the user
-        folder = self.parent
-        while folder is not None and not folder.is_deleted:
-            if folder.shares.filter(is_deleted=False, contact__user=user).exists():
-                return True
-            folder = folder.parent
-        
-        return False
+        return resolve_access(user, self) is not None
 
     def get_users_with_access(self):
         parents = self.get_all_parent_folders()
@@ -481,12 +788,11 @@ class FolderRecord(models.Model):
         Return all ShareRecord instances that give access to this file,
         including shares on the file itself and shares on any parent folder.
         """
-        # Get all parent folders
-        parents = self.get_all_parent_folders()
+        from .access import live_folder_ids
 
+        # the folder itself is the first id of the chain
         return ShareRecord.objects.filter(
-            Q(folder=self) |
-            Q(folder__in=parents),
+            folder_id__in=live_folder_ids(self),
             is_deleted=False
         ).select_related('contact', 'recipient').distinct()
 
@@ -509,14 +815,10 @@ class FolderRecord(models.Model):
 
     def get_descendant_folders(self):
         """
-        Get all descentant folders
+        Get ids of all descentant folders
         """
         
-        descendants = [self.id]
-        for subfolder in self.subfolders.all():
-            descendants.extend(subfolder.get_descendant_folders())
-            
-        return descendants
+        return self.get_descendants().values_list('id', flat=True)
 
     def contains_file_with_slug(self, slug):
         """
@@ -524,10 +826,8 @@ class FolderRecord(models.Model):
         contains a file with the provided slug
         """
         
-        folder_ids = self.get_descendant_folders()
-        
         return FileRecord.objects.filter(
-            folder_id__in=folder_ids, 
+            folder__tree_path__startswith=self.ensure_tree_path(),
             slug=slug, 
             is_deleted=False
         ).exists()
@@ -538,10 +838,7 @@ class FolderRecord(models.Model):
         contains a folder with the provided slug
         """
         
-        folder_ids = self.get_descendant_folders()
-        
-        return FolderRecord.objects.filter(
-            id__in=folder_ids, 
+        return self.get_descendants().filter(
             slug=slug, 
             is_deleted=False
         ).exists()
@@ -552,13 +849,14 @@ class FolderRecord(models.Model):
         Returns a list of parent folders (including the matching one if found).
         """
         parents = []
-        folder = self.parent
 
-        while folder is not None and not folder.is_deleted:
+        for folder in self.get_ancestors():
+            if folder.is_deleted:
+                break
+
             parents.append(folder)
             if folder.slug == target_slug:
                 break
-            folder = folder.parent
 
         return parents
     
@@ -581,17 +879,7 @@ class FolderRecord(models.Model):
 
         # Step 2: Copy all files in this folder
         for file_record in self.files.filter(is_deleted=False):
-            with file_record.file.open("rb") as f:
-                file_content = ContentFile(
-                    f.read(),
-                    name=os.path.basename(file_record.file.name),
-                )
-            FileRecord.objects.create(
-                name=file_record.name,
-                user=target_user,
-                folder=new_folder,
-                file=file_content,
-            )
+            file_record.make_copy(target_user, folder=new_folder)
 
         # Step 3: Recursively copy subfolders
         for child in self.subfolders.filter(is_deleted=False):
@@ -624,25 +912,42 @@ class FolderRecord(models.Model):
     def display_type(self):
         return 'dossier'
 
-    def is_over_30mb(self):
-        return self.get_size() >= FOLDER_SIZE_30MB
-        
+    def is_over_download_limit(self):
+        return self.get_size() >= settings.DRIVE_FOLDER_DOWNLOAD_MAX_SIZE
+
+    def get_content_stats(self):
+        """
+        Get total size and file count
+        of the folder and its subfolders
+        """
+
+        stats = FileRecord.objects.filter(
+            folder__tree_path__startswith=self.ensure_tree_path(),
+            folder__is_deleted=False,
+            is_deleted=False,
+        ).aggregate(
+            total_size=Sum('size'),
+            file_count=Count('id'),
+        )
+
+        return {
+            'total_size': stats['total_size'] or 0,
+            'file_count': stats['file_count'],
+        }
+
     def get_size(self):
         """
         Get folder size
         """
-        total = 0
 
-        # Sum sizes of files directly in this folder
-        for f in self.files.filter(is_deleted=False):
-            if f.file:
-                total += f.file.size
+        return self.get_content_stats()['total_size']
 
-        # Recurse into subfolders
-        for subfolder in self.subfolders.filter(is_deleted=False):
-            total += subfolder.get_size()
+    def get_file_count(self):
+        """
+        Get number of files in the folder
+        """
 
-        return total
+        return self.get_content_stats()['file_count']
     
     def get_depth(self):
         """
@@ -650,71 +955,130 @@ class FolderRecord(models.Model):
         Root folder (parent=None) → depth 0
         One level under root → depth 1, and so on.
         """
-        depth = 0
-        current = self.parent
-        while current:
-            depth += 1
-            current = current.parent
-        return depth
+
+        self.ensure_tree_path()
+        return self.depth
+
+    def move_subtree(self, old_path):
+        """
+        Rewrite the materialized path of the folder
+        and all its descendants after a parent change
+        """
+
+        parent_path = self.parent.ensure_tree_path() if self.parent_id else '/'
+        new_path = f'{parent_path}{self.pk}/'
+        new_depth = new_path.count('/') - 2
+        old_depth = old_path.count('/') - 2
+
+        FolderRecord.objects.filter(tree_path__startswith=old_path).update(
+            tree_path=Concat(
+                Value(new_path),
+                Substr('tree_path', len(old_path) + 1),
+                output_field=models.CharField()
+            ),
+            depth=F('depth') + (new_depth - old_depth)
+        )
+
+        self.tree_path = new_path
+        self.depth = new_depth
     
     def save(self, *args, **kwargs):
+        from .cache import bump_listings, listing_scope
         
-        slug_candidate = generate_slug(self, is_folder=True)
+        update_fields = kwargs.get('update_fields')
+
+        is_new = self._state.adding
+        moved_from_path = None
+        reindex = True
+        # cached listings showing the folder
+        scopes = {listing_scope(self.user_id, self.parent_id)}
         
-        if not self.pk:
+        if is_new:
             # New record → always generate slug
-            self.slug = slug_candidate
+            self.slug = generate_slug(self, is_folder=True)
             
         else:
+            changed = self.get_changed_fields(update_fields)
+
             # Existing record → check if name changed
-            original = type(self).objects.get(pk=self.pk)
-            if original and original.name != self.name:
-                self.slug = slug_candidate
+            if 'name' in changed:
+                self.slug = generate_slug(self, is_folder=True)
+
+                if update_fields is not None:
+                    kwargs['update_fields'] = {*update_fields, 'slug'}
             
-            if original and not original.is_deleted and self.is_deleted:
+            if 'is_deleted' in changed and self.is_deleted:
                 # Mark related shares as deleted
                 self.shares.update(is_deleted=True, deleted_at=timezone.now())
 
+            if 'parent_id' in changed:
+                # Existing record → moved to another parent
+                original = type(self).objects.only('id', 'parent_id', 'tree_path').get(pk=self.pk)
+                moved_from_path = original.ensure_tree_path()
+
+                if self.parent_id and self.parent.ensure_tree_path().startswith(moved_from_path):
+                    raise ValueError('Cannot move a folder into its own subtree')
+
+                scopes.add(listing_scope(self.user_id, original.parent_id))
+
+            reindex = bool(changed & {'name', 'description'})
+
         super().save(*args, **kwargs)
 
+        bump_listings(scopes)
+
+        self._snapshot_tracked_fields()
+
+        if is_new:
+            self.tree_path = ''
+            self.ensure_tree_path()
+
+        elif moved_from_path:
+            self.move_subtree(moved_from_path)
+
+        if reindex:
+            from .search import index_record
+            index_record(self)
+
+    def delete(self, *args, **kwargs):
+        from .cache import bump_listings, listing_scope
+
+        bump_listings([listing_scope(self.user_id, self.parent_id)])
+
+        return super().delete(*args, **kwargs)
+
     def is_expired(self):
         from django.utils import timezone
         return self.expires_at and timezone.now() > self.expires_at
 
     def full_path_data(self):
         parts = [{
+            'id': parent.id,
+            'slug': parent.slug,
+            'name': parent.name,
+            'is_favorite': parent.is_favorite,
+        } for parent in self.get_ancestors()]
+
+        parts.insert(0, {
             'id': self.id,
             'slug': self.slug,
             'name': self.name,
             'is_favorite': self.is_favorite,
-        }]
-        
-        parent = self.parent
-        
-        while parent:
-            
-            parts.append(
-            {
-                'id': parent.id,
-                'slug': parent.slug,
-                'name': parent.name,
-                'is_favorite': parent.is_favorite,
-            })
-            
-            parent = parent.parent
+        })
             
         return reversed(parts)
     
     def full_path(self):
         parts = [self.name]
-        parent = self.parent
-        while parent:
-            parts.append(parent.name)
-            parent = parent.parent
+        parts.extend(parent.name for parent in self.get_ancestors())
         return "/" + "/".join(reversed(parts))    
 
-class ShareRecord(models.Model):
+class ShareRecord(TrackedFieldsMixin, models.Model):
     slug = models.SlugField(max_length=255, unique=True, blank=True)
+
+    # canonical id of the share in its links, the slugs
+    # of shares and items are only kept for old links
+    token = models.CharField(max_length=32, unique=True, null=True, blank=True)
     
     shared_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField(null=True, blank=True)
@@ -754,6 +1118,16 @@ class ShareRecord(models.Model):
         related_name='shares'
     )
 
+    class Meta:
+        indexes = [
+            # partages-avec-moi
+            models.Index(
+                fields=['recipient', 'expires_at'],
+                condition=Q(is_deleted=False),
+                name='share_live_inbox_idx',
+            ),
+        ]
+
     def copy_file_to_user(self, target_user):
         """
         Copy the shared file into target_user's account.
@@ -763,23 +1137,11 @@ class ShareRecord(models.Model):
         original_file_record = self.file
 
         if original_file_record and original_file_record.file:
-            # Open and read the actual file
-            with original_file_record.file.open("rb") as f:
-                file_content = ContentFile(
-                    f.read(),
-                    name=os.path.basename(original_file_record.file.name)
-                )
-
-            # Create a new FileRecord for the target user
-            new_file_record = FileRecord.objects.create(
-                name=original_file_record.name,
+            return original_file_record.make_copy(
+                target_user,
                 description=original_file_record.description,
-                user=target_user,
-                file=file_content
             )
 
-            return new_file_record
-
         return None
     
     def __str__(self):
@@ -792,30 +1154,39 @@ class ShareRecord(models.Model):
             
         return f"{self.contact.full_name} - {name}"
         
-    def save(self, *args, **kwargs):
-        
+    tracked_fields = ('file_id', 'folder_id')
+
+    def get_slug_candidate(self):
         if self.folder:
-            slug_candidate = generate_slug(self.folder, is_folder=True)
+            return generate_slug(self.folder, is_folder=True)
             
-        elif self.file:
-            slug_candidate = generate_slug(self.file)
+        return generate_slug(self.file)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
         
-        if not self.pk:
+        if self._state.adding:
             # New record → always generate slug
-            self.slug = slug_candidate
+            self.slug = self.get_slug_candidate()
             logger.info('creating slug for new share')
             
-        else:
-            # Existing record → check if name changed
-            original = type(self).objects.get(pk=self.pk)
-            if original.file and original.file.name != self.file.name:
-                self.slug = slug_candidate
-            
-            elif original.folder and original.folder.name != self.folder.name:
-                self.slug = slug_candidate
+        elif self.get_changed_fields(update_fields):
+            # Existing record → shared item changed
+            self.slug = self.get_slug_candidate()
+
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'slug'}
+
+        if not self.token:
+            self.token = generate_share_token()
+
+            if update_fields is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'token'}
 
         super().save(*args, **kwargs)
 
+        self._snapshot_tracked_fields()
+
 class ContactDetails(models.Model):
 
     first_name = models.CharField(max_length=255)
@@ -918,4 +1289,296 @@ class UserNotification(models.Model):
     
     
     class Meta:
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+
+class SearchEntry(models.Model):
+    """
+    Accent-folded search document of a file or folder,
+    indexed by the configured search backend
+    """
+
+    document = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    user = models.ForeignKey(
+        get_user_model(), 
+        on_delete=models.CASCADE, 
+        related_name='search_entries'
+    )
+
+    file = models.OneToOneField(
+        'FileRecord',
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name='search_entry'
+    )
+
+    folder = models.OneToOneField(
+        'FolderRecord',
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name='search_entry'
+    )
+
+    def __str__(self):
+        return self.document
+
+class UploadSession(models.Model):
+    """
+    Resumable upload: chunks are written at their offset in
+    the final file, which becomes a FileRecord once complete
+    """
+
+    upload_uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    file_uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+
+    name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+
+    # storage name of the final file
+    path = models.CharField(max_length=512, blank=True)
+
+    # merged [start, end) byte ranges received so far
+    received = models.JSONField(default=list, blank=True)
+
+    # bytes received without gap from the start
+    offset = models.PositiveBigIntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    user = models.ForeignKey(
+        get_user_model(), 
+        on_delete=models.CASCADE, 
+        related_name='upload_sessions'
+    )
+
+    folder = models.ForeignKey(
+        'FolderRecord',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='upload_sessions'
+    )
+
+    file = models.OneToOneField(
+        'FileRecord',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='upload_session'
+    )
+
+    @property
+    def is_complete(self):
+        return self.offset >= self.size
+
+    def __str__(self):
+        return f'{self.name} ({self.offset}/{self.size})'
+
+class Blob(models.Model):
+    """
+    Content stored once per checksum and shared by every
+    file record with the same bytes, whatever the user
+    """
+
+    checksum = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to=blob_upload_to)
+    size = models.PositiveBigIntegerField(default=0)
+
+    THUMBNAIL_STATUS_CHOICES = [
+        ('pending', 'En attente'),
+        ('done', 'Terminée'),
+        ('failed', 'Échouée'),
+    ]
+
+    # number of file records pointing to the blob
+    ref_count = models.PositiveIntegerField(default=0)
+
+    # empty when the content has no thumbnails
+    thumbnail_status = models.CharField(max_length=20, choices=THUMBNAIL_STATUS_CHOICES, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.checksum} ({self.ref_count})'
+
+class CopyJob(models.Model):
+    """
+    Background copy of a folder tree into a user's drive
+    """
+
+    STATUS_CHOICES = [
+        ('pending', 'En attente'),
+        ('running', 'En cours'),
+        ('done', 'Terminée'),
+        ('failed', 'Échouée'),
+    ]
+
+    job_uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', db_index=True)
+
+    # source folder id → id of its copy, filled once the tree is built
+    folder_map = models.JSONField(default=dict, blank=True)
+
+    # files are copied in id order, resumes after this one
+    last_file_id = models.BigIntegerField(default=0)
+
+    total_folders = models.PositiveIntegerField(default=0)
+    total_files = models.PositiveIntegerField(default=0)
+    copied_folders = models.PositiveIntegerField(default=0)
+    copied_files = models.PositiveIntegerField(default=0)
+
+    error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    user = models.ForeignKey(
+        get_user_model(), 
+        on_delete=models.CASCADE, 
+        related_name='copy_jobs'
+    )
+
+    source = models.ForeignKey(
+        'FolderRecord',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+'
+    )
+
+    target = models.ForeignKey(
+        'FolderRecord',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+'
+    )
+
+    @property
+    def is_finished(self):
+        return self.status in ('done', 'failed')
+
+    @property
+    def progress(self):
+        """
+        Percentage of copied folders and files
+        """
+
+        total = self.total_folders + self.total_files
+
+        if not total:
+            return 100 if self.status == 'done' else 0
+
+        return int((self.copied_folders + self.copied_files) * 100 / total)
+
+    def __str__(self):
+        return f'{self.job_uuid} {self.status} {self.progress}%'
+
+class ArchiveJob(models.Model):
+    """
+    Zip archive of a folder built in the background, kept
+    on the disk for as long as the folder content is the same
+    """
+
+    STATUS_CHOICES = [
+        ('pending', 'En attente'),
+        ('running', 'En cours'),
+        ('done', 'Terminée'),
+        ('failed', 'Échouée'),
+    ]
+
+    job_uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', db_index=True)
+
+    # hash of the folder content the archive was built from
+    version = models.CharField(max_length=64)
+
+    file = models.FileField(blank=True)
+    size = models.PositiveBigIntegerField(default=0)
+
+    error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_used_at = models.DateTimeField(auto_now_add=True)
+
+    folder = models.ForeignKey(
+        'FolderRecord',
+        on_delete=models.CASCADE,
+        related_name='archive_jobs'
+    )
+
+    class Meta:
+        unique_together = ('folder', 'version')
+
+    @property
+    def is_finished(self):
+        return self.status in ('done', 'failed')
+
+    def __str__(self):
+        return f'{self.folder_id} {self.version[:8]} {self.status}'
+
+class UploadCounter(models.Model):
+    """
+    Sliding window counter of the uploads of a user,
+    one row per user and window length
+    """
+
+    # window length in seconds
+    period = models.PositiveIntegerField()
+
+    # index of the current window, epoch // period
+    window = models.BigIntegerField(default=0)
+
+    current = models.PositiveIntegerField(default=0)
+    previous = models.PositiveIntegerField(default=0)
+
+    user = models.ForeignKey(
+        get_user_model(), 
+        on_delete=models.CASCADE, 
+        related_name='upload_counters'
+    )
+
+    class Meta:
+        unique_together = ('user', 'period')
+
+    def __str__(self):
+        return f'{self.user_id} {self.period}s {self.current}'
+
+class StorageUsage(models.Model):
+    """
+    Space used by a user, kept up to date with every file
+    change so it never has to be summed over the drive.
+    Archived files do not count, trashed ones do.
+    """
+
+    total_bytes = models.PositiveBigIntegerField(default=0)
+    file_count = models.PositiveIntegerField(default=0)
+
+    trashed_bytes = models.PositiveBigIntegerField(default=0)
+    trashed_count = models.PositiveIntegerField(default=0)
+
+    # display_type_group → bytes
+    bytes_by_type = models.JSONField(default=dict, blank=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    user = models.OneToOneField(
+        get_user_model(), 
+        on_delete=models.CASCADE, 
+        related_name='storage_usage'
+    )
+
+    def __str__(self):
+        return f'{self.user_id} {sizeof_fmt(self.total_bytes)}'
+
+    @property
+    def display_total(self):
+        return sizeof_fmt(self.total_bytes)
@@ -0,0 +1,51 @@
+from django.utils import timezone
+from .models import FileRecord, FolderRecord, ShareRecord
+
+# Main queries of the drive pages. Each one has an index
+# in the models' Meta, check_query_plans verifies they
+# are used.
+
+def root_files(user):
+    return FileRecord.objects.filter(user=user, is_deleted=False, folder=None)
+
+def root_folders(user):
+    return FolderRecord.objects.filter(user=user, is_deleted=False, parent=None)
+
+def folder_files(folder):
+    return FileRecord.objects.filter(folder=folder, is_deleted=False)
+
+def folder_subfolders(folder):
+    return FolderRecord.objects.filter(parent=folder, is_deleted=False)
+
+def recent_files(user):
+    return FileRecord.objects.filter(user=user, is_deleted=False).order_by('-last_accessed_at')
+
+def favorite_files(user):
+    return FileRecord.objects.filter(user=user, is_deleted=False, is_favorite=True)
+
+def favorite_folders(user):
+    return FolderRecord.objects.filter(user=user, is_deleted=False, is_favorite=True)
+
+def trashed_files(user):
+    return FileRecord.objects.filter(
+        user=user,
+        is_deleted=True,
+        is_archived=False,
+    ).order_by('-deleted_at')
+
+def trashed_folders(user):
+    return FolderRecord.objects.filter(
+        user=user,
+        is_deleted=True,
+    ).order_by('-deleted_at')
+
+def inbox_shares(user):
+    """
+    Shares received by the user and not expired
+    """
+
+    return ShareRecord.objects.filter(
+        recipient=user,
+        is_deleted=False,
+        expires_at__gt=timezone.now(),
+    )
@@ -0,0 +1,125 @@
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from django.conf import settings
+from .models import UploadCounter, sizeof_fmt
+from .usage import get_usage
+import time
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+def get_plan(user):
+    """
+    Limits of the plan of the user, the
+    default plan for unknown or missing ones
+    """
+
+    plans = settings.DRIVE_PLANS
+    profile = getattr(user, 'profile', None)
+    name = getattr(profile, 'plan', None)
+
+    return plans.get(name) or plans[settings.DRIVE_DEFAULT_PLAN]
+
+def _get_counter(user, period, window):
+    """
+    Counter row of the user for this window length,
+    rolled over to the current window if needed
+    """
+
+    counter = UploadCounter.objects.filter(user=user, period=period).first()
+
+    if counter is None:
+        try:
+            with transaction.atomic():
+                return UploadCounter.objects.create(user=user, period=period, window=window)
+        except IntegrityError:
+            # created by a concurrent upload
+            counter = UploadCounter.objects.get(user=user, period=period)
+
+    if counter.window != window:
+        previous = counter.current if counter.window == window - 1 else 0
+
+        # only one request moves the row to the new window
+        UploadCounter.objects.filter(pk=counter.pk, window=counter.window).update(
+            window=window,
+            previous=previous,
+            current=0,
+        )
+
+        counter.refresh_from_db()
+
+    return counter
+
+def _reserve(user, period, limit, count, now):
+    """
+    Add `count` uploads to the sliding window of `period`
+    seconds when it stays under `limit`. The previous window
+    weighs in proportion to its overlap with the last period.
+    Check and increment are one conditional UPDATE, so two
+    requests can never both take the last slot.
+    """
+
+    window, elapsed = divmod(now, period)
+    weight = 1 - elapsed / period
+
+    for _ in range(3):
+        counter = _get_counter(user, period, int(window))
+
+        allowed = limit - int(counter.previous * weight) - count
+
+        if counter.current > allowed:
+            return False
+
+        updated = UploadCounter.objects.filter(
+            pk=counter.pk,
+            window=counter.window,
+            previous=counter.previous,
+            current__lte=allowed,
+        ).update(current=F('current') + count)
+
+        if updated:
+            return True
+
+        # changed by a concurrent upload, read it again
+
+    return False
+
+def reserve_upload_slots(user, count):
+    """
+    Take `count` uploads from the hourly and daily limits of
+    the plan of the user, in constant time whatever the number
+    of files. Nothing is taken when either limit is reached.
+    Returns the message to show, or None when allowed.
+    """
+
+    plan = get_plan(user)
+    now = time.time()
+
+    limits = [
+        (HOUR, plan['files_per_hour'], 'heure'),
+        (DAY, plan['files_per_day'], 'jour'),
+    ]
+
+    with transaction.atomic():
+        for period, limit, label in limits:
+            if not _reserve(user, period, limit, count, now):
+                transaction.set_rollback(True)
+                return f'Limite atteinte : {limit} fichiers maximum par {label}'
+
+    return None
+
+def check_storage_quota(user, size):
+    """
+    Check that `size` more bytes fit in the storage quota
+    of the plan, returns the message to show or None
+    """
+
+    quota = get_plan(user).get('storage')
+
+    if not quota:
+        return None
+
+    if get_usage(user).total_bytes + size > quota:
+        return f'Espace de stockage insuffisant : {sizeof_fmt(quota)} maximum'
+
+    return None
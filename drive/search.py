@@ -0,0 +1,272 @@
+from django.utils.module_loading import import_string
+from django.db.models import BooleanField, FloatField, OuterRef, Q, Subquery, Value
+from django.db.models.expressions import RawSQL
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.conf import settings
+from .models import FileRecord, FolderRecord, SearchEntry
+import unicodedata
+import re
+
+def normalize_text(text):
+    """
+    Lowercase and strip accents so that
+    'Énergie' and 'energie' match
+    """
+
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return text.lower()
+
+def tokenize(term):
+    """
+    Split a search term into safe words
+    """
+
+    return re.findall(r'[^\W_]+', normalize_text(term))
+
+def build_document(record):
+    return normalize_text(f'{record.name} {record.description or ""}').strip()
+
+def _rank(sql, params):
+    return RawSQL(sql, params, output_field=FloatField())
+
+def _condition(sql, params):
+    return RawSQL(sql, params, output_field=BooleanField())
+
+class BaseSearchBackend:
+    """
+    Portable backend: substring match
+    on the accent-folded document
+    """
+
+    def match(self, entries, tokens):
+        """
+        Narrow search entries to the documents matching the
+        tokens, annotated with a `rank`, best matches first
+        """
+
+        for token in tokens:
+            entries = entries.filter(document__contains=token)
+
+        return entries.annotate(rank=Value(0.0, output_field=FloatField()))
+
+    def create_index(self, connection):
+        """
+        Create the tables and indexes the backend
+        searches, safe to run again
+        """
+
+        pass
+
+    def _records(self, model, field, user, entries):
+        rank = entries.filter(**{field: OuterRef('pk')}).values('rank')[:1]
+
+        return model.objects.filter(
+            user=user,
+            is_deleted=False,
+            pk__in=entries.values(f'{field}_id'),
+        ).annotate(rank=Subquery(rank)).order_by('rank', 'name', 'pk')
+
+    def search(self, user, term):
+        """
+        Return (folders, files) querysets ordered by
+        relevance, to be paginated in the database
+        """
+
+        tokens = tokenize(term)
+
+        if not tokens:
+            return FolderRecord.objects.none(), FileRecord.objects.none()
+
+        entries = self.match(SearchEntry.objects.filter(user=user), tokens)
+
+        return (
+            self._records(FolderRecord, 'folder', user, entries),
+            self._records(FileRecord, 'file', user, entries),
+        )
+
+class SqliteSearchBackend(BaseSearchBackend):
+    """
+    SQLite FTS5 backend on word prefixes, with a
+    substring table for matches inside words.
+    There is no typo tolerance on SQLite.
+    """
+
+    fts_table = 'drive_searchentry_fts'
+    substring_table = 'drive_searchentry_substring'
+
+    # tables of earlier versions of the search
+    dropped_tables = ['drive_searchentry_trigram']
+
+    def create_index(self, connection):
+        entry_table = SearchEntry._meta.db_table
+
+        with connection.cursor() as cursor:
+            for table in self.dropped_tables:
+                for trigger in ('ai', 'ad', 'au'):
+                    cursor.execute(f"DROP TRIGGER IF EXISTS {table}_{trigger}")
+                cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+            existing = set(connection.introspection.table_names(cursor))
+
+            # the fts5 trigram tokenizer indexes every 3 chars,
+            # which is what substring matches need
+            for table, tokenizer in (
+                (self.fts_table, 'unicode61 remove_diacritics 2'),
+                (self.substring_table, 'trigram'),
+            ):
+                if table in existing:
+                    continue
+
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE {table} USING fts5("
+                    f"document, content='{entry_table}', content_rowid='id', tokenize='{tokenizer}')"
+                )
+
+                # keep the external content table in sync
+                cursor.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON {entry_table} BEGIN "
+                    f"INSERT INTO {table}(rowid, document) VALUES (new.id, new.document); END"
+                )
+                cursor.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON {entry_table} BEGIN "
+                    f"INSERT INTO {table}({table}, rowid, document) VALUES ('delete', old.id, old.document); END"
+                )
+                cursor.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE ON {entry_table} BEGIN "
+                    f"INSERT INTO {table}({table}, rowid, document) VALUES ('delete', old.id, old.document); "
+                    f"INSERT INTO {table}(rowid, document) VALUES (new.id, new.document); END"
+                )
+
+                # index the entries that already exist
+                cursor.execute(f"INSERT INTO {table}({table}) VALUES ('rebuild')")
+
+    def _match(self, entries, table, match):
+        entries = entries.filter(id__in=RawSQL(f"SELECT rowid FROM {table} WHERE {table} MATCH %s", [match]))
+
+        # bm25 is lower for better matches, the fts5
+        # rowid constraint makes it a seek per entry
+        return entries.annotate(rank=_rank(
+            f"SELECT bm25({table}) FROM {table} WHERE {table} MATCH %s AND {table}.rowid = id",
+            [match]
+        ))
+
+    def match(self, entries, tokens):
+        # word prefix search first
+        matches = self._match(entries, self.fts_table, ' '.join(f'"{token}"*' for token in tokens))
+
+        if matches.exists():
+            return matches
+
+        # fallback on substrings, the substring table needs 3 chars
+        if all(len(token) >= 3 for token in tokens):
+            return self._match(entries, self.substring_table, ' '.join(f'"{token}"' for token in tokens))
+
+        return super().match(entries, tokens)
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Postgres full-text backend using the french
+    configuration, with pg_trgm for typo tolerance
+    """
+
+    config = 'french'
+
+    def create_index(self, connection):
+        entry_table = SearchEntry._meta.db_table
+
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {entry_table}_tsv_idx ON {entry_table} "
+                f"USING gin (to_tsvector('{self.config}', document))"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {entry_table}_trgm_idx ON {entry_table} "
+                f"USING gin (document gin_trgm_ops)"
+            )
+
+    def match(self, entries, tokens):
+        query = ' & '.join(f'{token}:*' for token in tokens)
+        document = f"to_tsvector('{self.config}', document)"
+        tsquery = f"to_tsquery('{self.config}', %s)"
+
+        matches = entries.filter(_condition(f"{document} @@ {tsquery}", [query]))
+
+        if matches.exists():
+            return matches.annotate(rank=_rank(f"-ts_rank({document}, {tsquery})", [query]))
+
+        # fallback on trigram similarity for typos,
+        # the <% operator is served by the trigram index
+        term = ' '.join(tokens)
+
+        return entries.filter(_condition("%s <%% document", [term])).annotate(
+            rank=_rank("-word_similarity(%s, document)", [term])
+        )
+
+_backends = {}
+
+def get_backend():
+    """
+    Get the configured search backend,
+    or pick one from the database vendor
+    """
+
+    path = getattr(settings, 'DRIVE_SEARCH_BACKEND', '')
+
+    if not path:
+        path = {
+            'postgresql': 'drive.search.PostgresSearchBackend',
+            'sqlite': 'drive.search.SqliteSearchBackend',
+        }.get(connection.vendor, 'drive.search.BaseSearchBackend')
+
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+
+    return _backends[path]
+
+def create_search_index(using=DEFAULT_DB_ALIAS):
+    """
+    Create the search tables and indexes, after the
+    drive migrations since they are generated on
+    each deployment
+    """
+
+    get_backend().create_index(connections[using])
+
+def _target(record):
+    if isinstance(record, FolderRecord):
+        return Q(folder=record), {'folder': record}
+    return Q(file=record), {'file': record}
+
+def index_record(record):
+    """
+    Create or refresh the search entry of a file or folder
+    """
+
+    lookup, target = _target(record)
+
+    updated = SearchEntry.objects.filter(lookup).update(document=build_document(record))
+
+    if not updated:
+        SearchEntry.objects.create(user_id=record.user_id, document=build_document(record), **target)
+
+def index_records(records, batch_size=500):
+    """
+    Create search entries for new records in bulk
+    """
+
+    entries = []
+
+    for record in records:
+        _, target = _target(record)
+        entries.append(SearchEntry(user_id=record.user_id, document=build_document(record), **target))
+
+    SearchEntry.objects.bulk_create(entries, batch_size=batch_size)
+
+def search_records(user, term):
+    """
+    Search files and folders of `user`
+    """
+
+    return get_backend().search(user, term)
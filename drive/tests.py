@@ -1,3 +1,1454 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.http import HttpResponse
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+from django.urls import reverse
+from django.utils.http import http_date
+from .listing import FolderFirstListing
+from .management.commands.check_query_plans import postgresql_scan, sqlite_scan
+from .management.commands.run_benchmarks import percentile
+from .access import resolve_share_token
+from .archives import folder_content_version
+from .blobs import purge_files
+from .cache import CachedFolderListing, folder_listing, folder_scope, get_version, root_scope, share_grant_key
+from .copying import run_copy_job
+from .delivery import MAX_RANGES, parse_range_header, streaming_view
+from .models import ArchiveJob, Blob, ContactDetails, CopyJob, FileRecord, FolderRecord, ShareRecord, StorageUsage, UploadCounter, UploadSession
+from .quotas import DAY, HOUR, _reserve, reserve_upload_slots
+from .search import BaseSearchBackend, SqliteSearchBackend, create_search_index, index_records, search_records
+from .tree import soft_delete_folder_tree, restore_folder_tree, restore_file
+from .uploads import create_upload_session, write_chunk, finalize_upload
+from .usage import apply_changes, compute_usage
+from .zipstream import ZipEntry, iter_folder_entries, stream_zip
+from . import access_log, thumbnails
+from PIL import Image
+from asgiref.sync import iscoroutinefunction
+from datetime import timedelta
+from unittest import mock, skipUnless
+import tempfile
+import io
+import hashlib
+import zipfile
+import struct
+import shutil
+import os
 
-# Create your tests here.
+class DriveTestCase(TestCase):
+    """
+    Stores uploaded files in a temporary
+    media root removed after the tests
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='secret', email='alice@example.com')
+
+    def create_file(self, name='file.txt', content=b'content', **kwargs):
+        kwargs.setdefault('user', self.user)
+        return FileRecord.objects.create(name=name, file=ContentFile(content, name=name), **kwargs)
+
+    def create_folder(self, name='folder', **kwargs):
+        kwargs.setdefault('user', self.user)
+        return FolderRecord.objects.create(name=name, **kwargs)
+
+    def create_share(self, item, **kwargs):
+        contact = ContactDetails.objects.create(
+            first_name='Bob', last_name='Martin', email='bob@example.com', user=self.user
+        )
+        target = {'folder': item} if isinstance(item, FolderRecord) else {'file': item}
+
+        return ShareRecord.objects.create(contact=contact, **target, **kwargs)
+
+class StreamZipTests(DriveTestCase):
+
+    def write(self, name, content):
+        path = os.path.join(self.media_root, name)
+
+        with open(path, 'wb') as f:
+            f.write(content)
+
+        return path
+
+    def archive(self, entries, **kwargs):
+        chunks = list(stream_zip(entries, **kwargs))
+
+        return chunks, zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+
+    def test_archive_is_valid(self):
+        text = b'hello ' * 10000
+        picture = os.urandom(5000)
+
+        chunks, archive = self.archive([
+            ZipEntry('dossier/a.txt', self.write('a.txt', text), size=len(text)),
+            ZipEntry('dossier/b.jpg', self.write('b.jpg', picture), size=len(picture)),
+            # removed from the disk meanwhile
+            ZipEntry('dossier/c.txt', os.path.join(self.media_root, 'missing.txt')),
+        ], chunk_size=1024)
+
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.namelist(), ['dossier/a.txt', 'dossier/b.jpg'])
+        self.assertEqual(archive.read('dossier/a.txt'), text)
+        self.assertEqual(archive.read('dossier/b.jpg'), picture)
+
+        # text is deflated, already compressed content is stored
+        self.assertEqual(archive.getinfo('dossier/a.txt').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(archive.getinfo('dossier/b.jpg').compress_type, zipfile.ZIP_STORED)
+
+        # streamed, not built in one piece
+        self.assertGreater(len(chunks), 2)
+
+    def test_unknown_size_uses_zip64_headers(self):
+        content = b'x' * 3000
+
+        chunks, archive = self.archive([ZipEntry('a.txt', self.write('a.txt', content))])
+
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.read('a.txt'), content)
+
+        # the local header has a ZIP64 extra field (id 0x0001)
+        data = b''.join(chunks)
+        name_length, extra_length = struct.unpack('<HH', data[26:30])
+        extra = data[30 + name_length:30 + name_length + extra_length]
+
+        self.assertEqual(struct.unpack('<H', extra[:2])[0], 1)
+
+    def test_many_entries_use_zip64_end_records(self):
+        path = self.write('a.txt', b'a')
+
+        # more entries than the 16 bit count of the classic end record
+        chunks, archive = self.archive(ZipEntry(f'{i}.txt', path, size=1) for i in range(0x10000 + 1))
+
+        # ZIP64 end of central directory record
+        self.assertIn(b'PK\x06\x06', chunks[-1])
+        self.assertEqual(len(archive.infolist()), 0x10000 + 1)
+        self.assertEqual(archive.read('65536.txt'), b'a')
+
+    def test_folder_download_streams_a_zip(self):
+        folder = self.create_folder('projets')
+        self.create_file('a.txt', b'a', folder=folder)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('download-folder', args=[folder.slug]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(archive.read('projets/a.txt'), b'a')
+
+class FolderTreeTests(DriveTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.a = self.create_folder('a')
+        self.b = self.create_folder('b', parent=self.a)
+        self.c = self.create_folder('c', parent=self.b)
+        self.other = self.create_folder('other')
+
+    def reload(self, folder):
+        return FolderRecord.objects.get(pk=folder.pk)
+
+    def test_new_folders_get_their_path(self):
+        c = self.reload(self.c)
+
+        self.assertEqual(c.tree_path, f'/{self.a.pk}/{self.b.pk}/{self.c.pk}/')
+        self.assertEqual(c.depth, 2)
+        self.assertEqual(c.get_ancestor_ids(), [self.a.pk, self.b.pk])
+        self.assertEqual(set(self.a.get_descendants().values_list('id', flat=True)), {self.a.pk, self.b.pk, self.c.pk})
+
+    def test_move_subtree_rewrites_the_descendants(self):
+        b = self.reload(self.b)
+        b.parent = self.other
+        b.save()
+
+        self.assertEqual(self.reload(self.b).tree_path, f'/{self.other.pk}/{self.b.pk}/')
+
+        c = self.reload(self.c)
+
+        self.assertEqual(c.tree_path, f'/{self.other.pk}/{self.b.pk}/{self.c.pk}/')
+        self.assertEqual(c.depth, 2)
+        self.assertTrue(c.is_descendant_of(self.other))
+        self.assertFalse(c.is_descendant_of(self.a))
+
+    def test_move_to_the_root(self):
+        b = self.reload(self.b)
+        b.parent = None
+        b.save()
+
+        self.assertEqual(self.reload(self.b).depth, 0)
+        self.assertEqual(self.reload(self.c).tree_path, f'/{self.b.pk}/{self.c.pk}/')
+        self.assertEqual(self.reload(self.c).depth, 1)
+
+    def test_move_into_its_own_subtree_is_refused(self):
+        # into itself, then into its child
+        for target in (self.b, self.c):
+            b = self.reload(self.b)
+            b.parent = self.reload(target)
+
+            with self.assertRaises(ValueError):
+                b.save()
+
+        # nothing changed
+        self.assertEqual(self.reload(self.b).parent_id, self.a.pk)
+        self.assertEqual(self.reload(self.c).tree_path, f'/{self.a.pk}/{self.b.pk}/{self.c.pk}/')
+
+class ParseRangeHeaderTests(SimpleTestCase):
+
+    def test_ranges(self):
+        self.assertEqual(parse_range_header('bytes=0-99', 1000), [(0, 99)])
+        self.assertEqual(parse_range_header('bytes=900-', 1000), [(900, 999)])
+        self.assertEqual(parse_range_header('bytes=-100', 1000), [(900, 999)])
+        self.assertEqual(parse_range_header('bytes=0-0, 10-19', 1000), [(0, 0), (10, 19)])
+
+    def test_ranges_are_clamped_to_the_size(self):
+        self.assertEqual(parse_range_header('bytes=990-2000', 1000), [(990, 999)])
+        self.assertEqual(parse_range_header('bytes=-5000', 1000), [(0, 999)])
+
+    def test_unsatisfiable_ranges(self):
+        self.assertEqual(parse_range_header('bytes=1000-', 1000), [])
+        self.assertEqual(parse_range_header('bytes=-0', 1000), [])
+
+    def test_invalid_headers_are_ignored(self):
+        for header in (None, '', 'items=0-1', 'bytes=abc', 'bytes=5', 'bytes=10-5', 'bytes=a-b'):
+            self.assertIsNone(parse_range_header(header, 1000), header)
+
+        too_many = 'bytes=' + ','.join(f'{i}-{i}' for i in range(MAX_RANGES + 1))
+        self.assertIsNone(parse_range_header(too_many, 1000))
+
+class FileDeliveryTests(DriveTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.content = bytes(range(256)) * 4
+        self.file = self.create_file('data.bin', self.content)
+        self.url = reverse('download-file', args=[self.file.slug])
+        self.client.force_login(self.user)
+
+    def get(self, **headers):
+        response = self.client.get(self.url, headers=headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+
+        return response, body
+
+    def test_full_download(self):
+        response, body = self.get()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['ETag'], f'"{self.file.checksum}"')
+
+    def test_single_range(self):
+        response, body = self.get(Range='bytes=100-199')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.content[100:200])
+        self.assertEqual(response['Content-Range'], 'bytes 100-199/1024')
+        self.assertEqual(response['Content-Length'], '100')
+
+    def test_multiple_ranges(self):
+        response, body = self.get(Range='bytes=0-9,-10')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges; boundary='))
+        self.assertEqual(int(response['Content-Length']), len(body))
+        self.assertIn(b'Content-Range: bytes 0-9/1024\r\n\r\n' + self.content[:10], body)
+        self.assertIn(b'Content-Range: bytes 1014-1023/1024\r\n\r\n' + self.content[-10:], body)
+
+    @override_settings(DRIVE_FILE_DELIVERY='nginx', DRIVE_FILE_DELIVERY_PREFIX='/protected/')
+    def test_nginx_delivery(self):
+        response, body = self.get()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, b'')
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected/{self.file.file.name}')
+        self.assertNotIn('X-Sendfile', response)
+        self.assertEqual(response['ETag'], f'"{self.file.checksum}"')
+
+    @override_settings(DRIVE_FILE_DELIVERY='apache')
+    def test_apache_delivery(self):
+        response, body = self.get()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, b'')
+        self.assertEqual(response['X-Sendfile'], self.file.file.path)
+        self.assertNotIn('X-Accel-Redirect', response)
+
+    @override_settings(DRIVE_FILE_DELIVERY='python')
+    def test_python_delivery(self):
+        response, body = self.get()
+
+        self.assertEqual(body, self.content)
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertNotIn('X-Sendfile', response)
+
+    @override_settings(DRIVE_FILE_DELIVERY='nginx')
+    def test_revalidation_is_answered_by_django(self):
+        response, _ = self.get(If_None_Match=f'"{self.file.checksum}"')
+
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn('X-Accel-Redirect', response)
+
+    def test_views_are_async_only_under_asgi(self):
+        def view(request):
+            return HttpResponse()
+
+        # picked when the view is decorated
+        self.assertIs(streaming_view(view), view)
+
+        with override_settings(SERVER_INTERFACE='asgi'):
+            self.assertTrue(iscoroutinefunction(streaming_view(view)))
+
+    def test_unsatisfiable_range(self):
+        response, _ = self.get(Range='bytes=5000-')
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+    def test_conditional_get(self):
+        response, _ = self.get()
+
+        response, body = self.get(If_None_Match=response['ETag'])
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(body, b'')
+
+        response, _ = self.get(If_Modified_Since=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_if_range(self):
+        etag = f'"{self.file.checksum}"'
+
+        # unchanged: the range is served
+        response, body = self.get(Range='bytes=0-9', If_Range=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.content[:10])
+
+        # changed since: the whole file
+        response, body = self.get(Range='bytes=0-9', If_Range='"other"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+
+        # the same with dates
+        response, _ = self.get(Range='bytes=0-9', If_Range=http_date(self.file.created_at.timestamp()))
+        self.assertEqual(response.status_code, 206)
+
+        response, _ = self.get(Range='bytes=0-9', If_Range=http_date(0))
+        self.assertEqual(response.status_code, 200)
+
+class ResumableUploadTests(DriveTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.content = os.urandom(3000)
+        self.session = create_upload_session(self.user, 'data.bin', len(self.content))
+
+    def send(self, session, start, end):
+        return write_chunk(session, start, io.BytesIO(self.content[start:end]), end - start)
+
+    def test_chunks_in_any_order(self):
+        self.assertEqual(self.send(self.session, 2000, 3000), 0)
+        self.assertEqual(self.send(self.session, 0, 1000), 1000)
+        self.assertEqual(self.session.received, [[0, 1000], [2000, 3000]])
+
+        self.assertEqual(self.send(self.session, 1000, 2000), 3000)
+        self.assertEqual(self.session.received, [[0, 3000]])
+
+        file_record = finalize_upload(self.session)
+
+        with file_record.file.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+
+        self.assertEqual(file_record.size, len(self.content))
+        self.assertEqual(file_record.checksum, hashlib.sha256(self.content).hexdigest())
+
+        # finalizing twice gives the same file
+        self.assertEqual(finalize_upload(UploadSession.objects.get(pk=self.session.pk)).pk, file_record.pk)
+
+    def test_parallel_chunks_do_not_lose_ranges(self):
+        # each request loaded the session before the others wrote
+        first = UploadSession.objects.get(pk=self.session.pk)
+        second = UploadSession.objects.get(pk=self.session.pk)
+        third = UploadSession.objects.get(pk=self.session.pk)
+
+        self.send(first, 1000, 2000)
+        self.send(second, 0, 1000)
+        self.assertEqual(self.send(third, 2000, 3000), 3000)
+
+        self.assertEqual(UploadSession.objects.get(pk=self.session.pk).received, [[0, 3000]])
+
+    def test_chunk_out_of_bounds(self):
+        for start, length in ((-1, 10), (2995, 10), (0, -1)):
+            with self.assertRaises(ValueError):
+                write_chunk(self.session, start, io.BytesIO(b'x' * 10), length)
+
+        self.assertEqual(self.session.received, [])
+
+    def test_short_body_only_records_what_was_written(self):
+        offset = write_chunk(self.session, 0, io.BytesIO(self.content[:400]), 1000)
+
+        self.assertEqual(offset, 400)
+        self.assertEqual(self.session.received, [[0, 400]])
+
+    def test_incomplete_upload_cannot_be_finalized(self):
+        self.send(self.session, 0, 1000)
+        self.send(self.session, 2000, 3000)
+
+        with self.assertRaises(ValueError):
+            finalize_upload(self.session)
+
+        self.assertFalse(FileRecord.objects.exists())
+
+    def test_upload_over_http(self):
+        self.client.force_login(self.user)
+
+        url = reverse('upload-session', args=[self.session.upload_uuid])
+
+        def patch(start, end):
+            return self.client.patch(
+                url,
+                self.content[start:end],
+                content_type='application/offset+octet-stream',
+                headers={'Upload-Offset': str(start)},
+            )
+
+        response = patch(1500, 3000)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response['Upload-Offset'], '0')
+
+        # offset past the end of the upload
+        response = self.client.patch(
+            url, b'x' * 10, content_type='application/offset+octet-stream', headers={'Upload-Offset': '2995'}
+        )
+        self.assertEqual(response.status_code, 416)
+
+        finalize_url = reverse('finalize-upload', args=[self.session.upload_uuid])
+        self.assertEqual(self.client.post(finalize_url).status_code, 409)
+
+        response = patch(0, 1500)
+        self.assertEqual(response['Upload-Offset'], '3000')
+
+        response = self.client.post(finalize_url)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(FileRecord.objects.filter(slug=response.json()['slug']).exists())
+
+@override_settings(DRIVE_BACKGROUND_WORKERS=0)
+class CopyJobTests(DriveTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.recipient = User.objects.create_user('bob', password='secret', email='bob@example.com')
+
+        self.source = self.create_folder('projets')
+        child = self.create_folder('plans', parent=self.source)
+
+        for i in range(3):
+            self.create_file(f'{i}.txt', f'file {i}'.encode(), folder=self.source)
+            self.create_file(f'plan-{i}.txt', f'plan {i}'.encode(), folder=child)
+
+    def copied_names(self):
+        return sorted(FileRecord.objects.filter(user=self.recipient).values_list('name', flat=True))
+
+    def test_copy_of_a_tree(self):
+        job = run_copy_job(CopyJob.objects.create(user=self.recipient, source=self.source).pk)
+
+        self.assertEqual(job.status, 'done')
+        self.assertEqual((job.copied_folders, job.copied_files, job.total_files), (2, 6, 6))
+        self.assertEqual(FolderRecord.objects.get(pk=job.target_id).get_descendants().count(), 2)
+        self.assertEqual(len(self.copied_names()), 6)
+
+        # the content is shared with the copies
+        for blob in Blob.objects.all():
+            self.assertEqual(blob.ref_count, 2)
+
+    def test_interrupted_copy_resumes_after_the_last_batch(self):
+        job = CopyJob.objects.create(user=self.recipient, source=self.source)
+        batches = []
+
+        def index_then_crash(records, **kwargs):
+            # the folders are indexed first, then each batch of files
+            if isinstance(records[0], FileRecord):
+                batches.append(records)
+
+                if len(batches) == 2:
+                    raise RuntimeError('worker stopped')
+
+            return index_records(records, **kwargs)
+
+        with mock.patch('drive.copying.BATCH_SIZE', 2), \
+             mock.patch('drive.copying.index_records', side_effect=index_then_crash):
+            job = run_copy_job(job.pk)
+
+        self.assertEqual(job.status, 'failed')
+
+        # the first batch was committed, the second rolled back
+        first_batch = list(FileRecord.objects.filter(user=self.user).order_by('id').values_list('id', flat=True)[:2])
+        self.assertEqual(job.last_file_id, first_batch[-1])
+        self.assertEqual(job.copied_files, 2)
+        self.assertEqual(len(self.copied_names()), 2)
+
+        # interrupted while running, resumed at startup
+        CopyJob.objects.filter(pk=job.pk).update(status='running', error='', finished_at=None)
+
+        with mock.patch('drive.copying.BATCH_SIZE', 2):
+            call_command('resume_copy_jobs', stale_minutes=0, stdout=io.StringIO())
+
+        job.refresh_from_db()
+
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.copied_files, 6)
+        # each file copied once, in a single tree
+        self.assertEqual(
+            self.copied_names(),
+            sorted(FileRecord.objects.filter(user=self.user).values_list('name', flat=True)),
+        )
+        self.assertEqual(FolderRecord.objects.filter(user=self.recipient).count(), 2)
+
+        for blob in Blob.objects.all():
+            self.assertEqual(blob.ref_count, 2)
+
+class UploadQuotaTests(DriveTestCase):
+
+    # start of an hour window
+    NOW = 1000 * HOUR
+
+    def counter(self, period=HOUR):
+        return UploadCounter.objects.get(user=self.user, period=period)
+
+    def test_window_fills_up_to_the_limit(self):
+        self.assertTrue(_reserve(self.user, HOUR, 5, 3, self.NOW))
+        self.assertTrue(_reserve(self.user, HOUR, 5, 2, self.NOW + 60))
+        self.assertFalse(_reserve(self.user, HOUR, 5, 1, self.NOW + 120))
+
+        self.assertEqual(self.counter().current, 5)
+
+    def test_previous_window_slides_out(self):
+        self.assertTrue(_reserve(self.user, HOUR, 4, 4, self.NOW))
+
+        # start of the next window: the previous one still counts fully
+        self.assertFalse(_reserve(self.user, HOUR, 4, 1, self.NOW + HOUR))
+        self.assertEqual((self.counter().previous, self.counter().current), (4, 0))
+
+        # halfway: it weighs half of its uploads
+        self.assertTrue(_reserve(self.user, HOUR, 4, 2, self.NOW + HOUR * 3 // 2))
+        self.assertFalse(_reserve(self.user, HOUR, 4, 1, self.NOW + HOUR * 3 // 2))
+
+        # a window without uploads in between forgets it
+        self.assertTrue(_reserve(self.user, HOUR, 4, 4, self.NOW + 3 * HOUR))
+        self.assertEqual((self.counter().previous, self.counter().current), (0, 4))
+
+    @override_settings(
+        DRIVE_DEFAULT_PLAN='free',
+        DRIVE_PLANS={'free': {'files_per_hour': 10, 'files_per_day': 3, 'storage': None}},
+    )
+    def test_nothing_is_taken_when_a_limit_is_reached(self):
+        with mock.patch('drive.quotas.time.time', return_value=self.NOW + 60):
+            self.assertIsNone(reserve_upload_slots(self.user, 2))
+            self.assertEqual(reserve_upload_slots(self.user, 2), 'Limite atteinte : 3 fichiers maximum par jour')
+
+        # the hourly slots taken before the daily check are given back
+        self.assertEqual(self.counter(HOUR).current, 2)
+        self.assertEqual(self.counter(DAY).current, 2)
+
+class StorageUsageTests(DriveTestCase):
+
+    def assertUsageMatchesRecords(self):
+        usage = StorageUsage.objects.get(user=self.user)
+
+        self.assertEqual(
+            {field: getattr(usage, field) for field in ('total_bytes', 'file_count', 'trashed_bytes', 'trashed_count', 'bytes_by_type')},
+            compute_usage(self.user.pk),
+        )
+
+    def test_usage_follows_the_records(self):
+        folder = self.create_folder('projets')
+        report = self.create_file('rapport.txt', b'x' * 10, folder=folder)
+        photo = self.create_file('photo.jpg', b'x' * 20, folder=folder)
+        self.create_file('notes.txt', b'x' * 5)
+        self.assertUsageMatchesRecords()
+
+        # a new type group and an emptied one
+        report.name = 'rapport.pdf'
+        report.save()
+        self.assertUsageMatchesRecords()
+
+        soft_delete_folder_tree(folder)
+        self.assertUsageMatchesRecords()
+        self.assertEqual(StorageUsage.objects.get(user=self.user).trashed_count, 2)
+
+        restore_folder_tree(FolderRecord.objects.get(pk=folder.pk))
+        self.assertUsageMatchesRecords()
+
+        photo.refresh_from_db()
+        photo.is_archived = True
+        photo.save()
+        self.assertUsageMatchesRecords()
+
+        purge_files(FileRecord.objects.filter(pk=report.pk))
+        self.assertUsageMatchesRecords()
+
+        usage = StorageUsage.objects.get(user=self.user)
+        self.assertEqual((usage.total_bytes, usage.file_count, usage.trashed_count), (5, 1, 0))
+
+    def test_changes_that_keep_the_state_are_ignored(self):
+        self.create_file('notes.txt', b'x' * 5)
+
+        with self.assertNumQueries(0):
+            apply_changes(self.user.pk, [(5, ('document', False), ('document', False))])
+
+        self.assertUsageMatchesRecords()
+
+class FolderFirstListingTests(DriveTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.folders = [self.create_folder(f'dossier {i}') for i in range(3)]
+        self.files = [self.create_file(f'fichier {i}.txt') for i in range(5)]
+
+    def listing(self):
+        return FolderFirstListing(
+            FolderRecord.objects.filter(user=self.user).order_by('name'),
+            FileRecord.objects.filter(user=self.user).order_by('name'),
+        )
+
+    def test_pages_cross_from_folders_to_files(self):
+        paginator = Paginator(self.listing(), 2)
+
+        self.assertEqual(paginator.count, 8)
+        self.assertEqual(
+            [[item.name for item in paginator.page(number)] for number in paginator.page_range],
+            [
+                ['dossier 0', 'dossier 1'],
+                ['dossier 2', 'fichier 0.txt'],
+                ['fichier 1.txt', 'fichier 2.txt'],
+                ['fichier 3.txt', 'fichier 4.txt'],
+            ],
+        )
+
+    def test_pages_only_fetch_their_rows(self):
+        listing = self.listing()
+
+        # one COUNT per table
+        with self.assertNumQueries(2):
+            self.assertEqual(len(listing), 8)
+
+        # the boundary page reads both tables
+        with self.assertNumQueries(2):
+            self.assertEqual(len(listing[2:4]), 2)
+
+        with self.assertNumQueries(1):
+            self.assertEqual([item.name for item in listing[5:]], ['fichier 2.txt', 'fichier 3.txt', 'fichier 4.txt'])
+
+    def test_items_by_index(self):
+        listing = self.listing()
+
+        self.assertEqual(listing[2].name, 'dossier 2')
+        self.assertEqual(listing[3].name, 'fichier 0.txt')
+
+        with self.assertRaises(IndexError):
+            listing[8]
+
+    def test_root_view_pages_folders_first(self):
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('my-box'), {'page_size': 2, 'page': 2})
+
+        # in the default order of each table
+        items = [*FolderRecord.objects.filter(user=self.user), *FileRecord.objects.filter(user=self.user)]
+
+        self.assertEqual(list(response.context['files']), items[2:4])
+        self.assertIsInstance(items[2], FolderRecord)
+        self.assertIsInstance(items[3], FileRecord)
+        self.assertEqual(response.context['files'].paginator.num_pages, 4)
+
+class QueryPlanTests(DriveTestCase):
+
+    def test_sqlite_plans(self):
+        self.assertEqual(
+            sqlite_scan('SEARCH drive_filerecord USING INDEX file_live_folder_idx (folder_id=?)', 'drive_filerecord'),
+            'file_live_folder_idx',
+        )
+        self.assertEqual(
+            sqlite_scan('SEARCH drive_filerecord USING COVERING INDEX file_trash_idx (user_id=?)', 'drive_filerecord'),
+            'file_trash_idx',
+        )
+        self.assertIsNone(sqlite_scan('SCAN drive_filerecord\nUSE TEMP B-TREE FOR ORDER BY', 'drive_filerecord'))
+
+    def test_postgresql_plans(self):
+        plan = (
+            'Limit  (cost=0.29..8.31 rows=1 width=8)\n'
+            '  ->  Index Scan Backward using file_live_recent_idx on drive_filerecord  (cost=0.29..8.31 rows=1 width=8)'
+        )
+
+        self.assertEqual(postgresql_scan(plan, 'drive_filerecord'), 'file_live_recent_idx')
+        self.assertIsNone(postgresql_scan('Seq Scan on drive_filerecord  (cost=0.00..1.01 rows=1 width=8)', 'drive_filerecord'))
+
+    def test_seeded_pages_use_an_index(self):
+        call_command('seed_workload', users=2, depth=1, breadth=2, files=2, file_size=64, shares=1, stdout=io.StringIO())
+
+        out = io.StringIO()
+        call_command('check_query_plans', stdout=out)
+
+        self.assertIn('All queries use an index', out.getvalue())
+
+class WorkloadTests(DriveTestCase):
+
+    def seed(self, **options):
+        options = {'users': 2, 'depth': 2, 'breadth': 2, 'files': 3, 'file_size': 64, 'shares': 1, **options}
+        call_command('seed_workload', stdout=io.StringIO(), **options)
+
+    def test_tree_follows_the_options(self):
+        self.seed()
+
+        bench = FolderRecord.objects.filter(user__username='bench-0')
+
+        # 2 folders, then 2 under each
+        self.assertEqual(bench.count(), 6)
+        self.assertEqual(bench.filter(depth=1).count(), 4)
+
+        # files at the root and in every folder
+        self.assertEqual(FileRecord.objects.filter(user__username='bench-0').count(), 21)
+
+        # content is really stored
+        file = FileRecord.objects.filter(user__username='bench-0').first()
+        self.assertEqual(file.file.size, file.size)
+
+        self.assertEqual(ShareRecord.objects.filter(recipient__username__startswith='bench-').count(), 2)
+
+    def test_reset_replaces_a_previous_run(self):
+        self.seed()
+
+        with self.assertRaises(CommandError):
+            self.seed()
+
+        self.seed(reset=True, files=1)
+
+        self.assertEqual(User.objects.filter(username__startswith='bench-').count(), 2)
+        self.assertEqual(FileRecord.objects.filter(user__username='bench-0').count(), 7)
+
+    def test_percentile(self):
+        values = [5, 1, 4, 2, 3, 6, 7, 8, 9, 10]
+
+        self.assertEqual(percentile(values, 50), 5)
+        self.assertEqual(percentile(values, 95), 10)
+        self.assertEqual(percentile([3], 99), 3)
+
+class SearchTests(DriveTestCase):
+
+    def test_accents_and_prefixes_match(self):
+        folder = self.create_folder('Énergie solaire')
+        report = self.create_file('rapport_energie.pdf')
+        self.create_file('facture.pdf', description='électricité')
+
+        for term in ('energie', 'ÉNERG', 'ener'):
+            folders, files = search_records(self.user, term)
+
+            self.assertEqual(list(folders), [folder])
+            self.assertEqual(list(files), [report])
+
+        # substring of a word
+        _, files = search_records(self.user, 'lectri')
+        self.assertEqual([file.name for file in files], ['facture.pdf'])
+
+    def test_other_users_are_not_searched(self):
+        other = User.objects.create_user('bob', password='secret', email='bob@example.com')
+        self.create_file('energie.pdf', user=other)
+
+        folders, files = search_records(self.user, 'energie')
+
+        self.assertFalse(folders.exists())
+        self.assertFalse(files.exists())
+
+    def test_results_are_paginated_in_the_database(self):
+        for i in range(600):
+            self.create_file(f'note {i:03}.txt')
+
+        _, files = search_records(self.user, 'note')
+        page = Paginator(FolderFirstListing(FolderRecord.objects.none(), files), 50).get_page(12)
+
+        # nothing is cut off
+        self.assertEqual(page.paginator.count, 600)
+        self.assertEqual(len(page.object_list), 50)
+
+        with self.assertNumQueries(1):
+            list(files[550:560])
+
+    def test_portable_backend(self):
+        self.create_file('rapport energie.pdf')
+        self.create_file('facture.pdf')
+
+        _, files = BaseSearchBackend().search(self.user, 'ergie')
+
+        self.assertEqual([file.name for file in files], ['rapport energie.pdf'])
+
+    @skipUnless(connection.vendor == 'sqlite', 'sqlite tables')
+    def test_index_setup_can_run_again(self):
+        self.create_file('rapport.pdf')
+
+        # table left by an earlier version of the search
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE VIRTUAL TABLE drive_searchentry_trigram USING fts5(document)")
+
+        create_search_index()
+        create_search_index()
+
+        tables = connection.introspection.table_names()
+
+        self.assertNotIn('drive_searchentry_trigram', tables)
+        self.assertIn(SqliteSearchBackend.fts_table, tables)
+        self.assertIn(SqliteSearchBackend.substring_table, tables)
+
+        # entries are indexed once
+        _, files = search_records(self.user, 'ppor')
+        self.assertEqual([file.name for file in files], ['rapport.pdf'])
+
+    def test_reindex_command(self):
+        self.create_file('rapport.pdf')
+
+        call_command('reindex_search', stdout=io.StringIO())
+
+        _, files = search_records(self.user, 'rapport')
+        self.assertEqual([file.name for file in files], ['rapport.pdf'])
+
+class TreeTests(DriveTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.root = self.create_folder('root')
+        self.child = self.create_folder('child', parent=self.root)
+        self.file = self.create_file('a.txt', folder=self.child)
+
+    def test_soft_delete_and_restore_round_trip(self):
+        self.assertEqual(soft_delete_folder_tree(self.root), 1)
+
+        self.assertTrue(FolderRecord.objects.get(pk=self.child.pk).is_deleted)
+        self.assertTrue(FileRecord.objects.get(pk=self.file.pk).is_deleted)
+
+        root = FolderRecord.objects.get(pk=self.root.pk)
+
+        self.assertEqual(restore_folder_tree(root), 1)
+
+        self.assertFalse(FolderRecord.objects.filter(is_deleted=True).exists())
+        self.assertFalse(FileRecord.objects.get(pk=self.file.pk).is_deleted)
+
+    def test_items_trashed_before_stay_in_the_trash(self):
+        earlier = self.create_file('b.txt', folder=self.child)
+        earlier.is_deleted = True
+        earlier.deleted_at = timezone.now()
+        earlier.save()
+
+        soft_delete_folder_tree(self.root)
+        restore_folder_tree(FolderRecord.objects.get(pk=self.root.pk))
+
+        self.assertTrue(FileRecord.objects.get(pk=earlier.pk).is_deleted)
+        self.assertFalse(FileRecord.objects.get(pk=self.file.pk).is_deleted)
+
+    def test_restoring_a_folder_restores_its_shares(self):
+        folder_share = self.create_share(self.child)
+        file_share = self.create_share(self.file)
+
+        # cached before the delete
+        self.assertIsNotNone(resolve_share_token(file_share.token))
+
+        soft_delete_folder_tree(self.root)
+
+        self.assertIsNone(resolve_share_token(folder_share.token))
+        self.assertIsNone(resolve_share_token(file_share.token))
+
+        restore_folder_tree(FolderRecord.objects.get(pk=self.root.pk))
+
+        self.assertIsNotNone(resolve_share_token(folder_share.token))
+        self.assertIsNotNone(resolve_share_token(file_share.token))
+
+    def test_restoring_a_file_restores_its_shares(self):
+        share = self.create_share(self.file)
+
+        self.file.is_deleted = True
+        self.file.deleted_at = timezone.now()
+        self.file.save()
+
+        self.assertIsNone(resolve_share_token(share.token))
+
+        restore_file(FileRecord.objects.get(pk=self.file.pk))
+
+        self.assertFalse(ShareRecord.objects.get(pk=share.pk).is_deleted)
+        self.assertIsNotNone(resolve_share_token(share.token))
+
+class ShareGrantTests(DriveTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.folder = self.create_folder('projets')
+        self.share = self.create_share(self.folder)
+
+        # cached by a first visit
+        self.assertIsNotNone(resolve_share_token(self.share.token))
+
+    def test_only_the_share_id_is_cached(self):
+        self.assertEqual(cache.get(share_grant_key(self.share.token)), self.share.pk)
+
+        with self.assertNumQueries(1):
+            grant = resolve_share_token(self.share.token)
+
+        self.assertEqual(grant.share, self.share)
+
+    def test_deleting_a_contact_revokes_its_links(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('delete-contact', args=[self.share.contact_id]))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertIsNone(resolve_share_token(self.share.token))
+
+    def test_revocation_is_seen_at_once(self):
+        # changes made by another process, which cannot reach this cache
+        changes = [
+            lambda: ShareRecord.objects.filter(pk=self.share.pk).update(is_deleted=True),
+            lambda: ShareRecord.objects.filter(pk=self.share.pk).update(expires_at=timezone.now()),
+            lambda: ContactDetails.objects.filter(pk=self.share.contact_id).update(is_deleted=True),
+            lambda: FolderRecord.objects.filter(pk=self.folder.pk).update(is_deleted=True),
+        ]
+
+        for i, change in enumerate(changes):
+            with self.subTest(change=i), transaction.atomic():
+                change()
+                self.assertIsNone(resolve_share_token(self.share.token))
+
+                transaction.set_rollback(True)
+
+            # back to a valid link
+            self.assertIsNotNone(resolve_share_token(self.share.token))
+
+class BlobTests(DriveTestCase):
+
+    def test_identical_content_is_stored_once(self):
+        first = self.create_file('a.txt', b'same bytes')
+        second = self.create_file('b.txt', b'same bytes')
+
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertEqual(Blob.objects.get(pk=first.blob_id).ref_count, 2)
+
+    def test_failed_save_does_not_keep_a_reference(self):
+        blob = self.create_file('a.txt', b'same bytes').blob
+
+        with mock.patch('drive.usage.apply_changes', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.create_file('b.txt', b'same bytes')
+
+        self.assertEqual(FileRecord.objects.count(), 1)
+        self.assertEqual(Blob.objects.get(pk=blob.pk).ref_count, 1)
+
+    def test_failed_save_does_not_keep_new_content(self):
+        with mock.patch('drive.usage.apply_changes', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.create_file('a.txt', b'new bytes')
+
+        self.assertFalse(Blob.objects.exists())
+
+        checksum = hashlib.sha256(b'new bytes').hexdigest()
+        stored = [name for _, _, names in os.walk(self.media_root) for name in names]
+
+        self.assertFalse([name for name in stored if name.startswith(checksum)])
+
+class FolderArchiveTests(DriveTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.root = self.create_folder('root')
+        self.child = self.create_folder('child', parent=self.root)
+        self.create_file('a.txt', b'a', folder=self.root)
+        self.file = self.create_file('b.txt', b'b', folder=self.child)
+
+    def version(self):
+        return folder_content_version(FolderRecord.objects.get(pk=self.root.pk))
+
+    def changes_version(self, change):
+        before = self.version()
+        change()
+
+        return self.version() != before
+
+    def test_version_is_stable(self):
+        self.assertEqual(self.version(), self.version())
+
+    def test_version_follows_the_content(self):
+        def rename_file():
+            self.file.name = 'c.txt'
+            self.file.save()
+
+        def rename_subfolder():
+            self.child.name = 'other'
+            self.child.save()
+
+        self.assertTrue(self.changes_version(rename_file))
+        self.assertTrue(self.changes_version(rename_subfolder))
+        self.assertTrue(self.changes_version(lambda: self.create_file('d.txt', b'd', folder=self.child)))
+        self.assertTrue(self.changes_version(lambda: soft_delete_folder_tree(self.child)))
+
+    def test_version_sees_changes_without_cache_invalidation(self):
+        def rename():
+            # as made by another process, whose cache is not this one
+            FileRecord.objects.filter(pk=self.file.pk).update(name='c.txt')
+
+        self.assertTrue(self.changes_version(rename))
+
+    def test_version_reads_the_tree_in_two_queries(self):
+        for i in range(20):
+            self.create_file(f'{i}.txt', folder=self.child)
+
+        root = FolderRecord.objects.get(pk=self.root.pk)
+
+        with self.assertNumQueries(2):
+            folder_content_version(root)
+
+    @override_settings(DRIVE_FOLDER_DOWNLOAD_MAX_SIZE=1, DRIVE_BACKGROUND_WORKERS=0)
+    def test_changed_folder_gets_a_new_archive(self):
+        self.client.force_login(self.user)
+        url = reverse('download-folder', args=[self.root.slug])
+
+        def download():
+            # built in the request, then served
+            self.assertEqual(self.client.get(url).status_code, 302)
+
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+            return zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+        self.assertEqual(sorted(download().namelist()), ['root/a.txt', 'root/child/b.txt'])
+
+        FileRecord.objects.filter(pk=self.file.pk).update(name='c.txt')
+
+        self.assertEqual(sorted(download().namelist()), ['root/a.txt', 'root/child/c.txt'])
+
+        # the archive of the old content is gone
+        self.assertEqual(ArchiveJob.objects.filter(folder=self.root).count(), 1)
+
+    def test_zip_walk_reads_the_tree_in_two_queries(self):
+        grandchild = self.create_folder('grandchild', parent=self.child)
+        self.create_file('c.txt', b'c', folder=grandchild)
+
+        with self.assertNumQueries(2):
+            entries = list(iter_folder_entries(self.root))
+
+        self.assertEqual(
+            sorted(entry.arcname for entry in entries),
+            ['root/a.txt', 'root/child/b.txt', 'root/child/grandchild/c.txt'],
+        )
+
+@override_settings(DRIVE_BACKGROUND_WORKERS=0, DRIVE_THUMBNAIL_WORKERS=0)
+class ThumbnailTests(DriveTestCase):
+
+    def create_image(self, name='photo.png', size=(1200, 600)):
+        output = io.BytesIO()
+        Image.new('RGB', size, (200, 40, 40)).save(output, 'PNG')
+
+        return self.create_file(name, output.getvalue())
+
+    def test_upload_builds_every_size(self):
+        file_record = self.create_image()
+        blob = Blob.objects.get(pk=file_record.blob_id)
+
+        self.assertEqual(blob.thumbnail_status, 'done')
+
+        for size, side in thumbnails.SIZES.items():
+            path = blob.file.storage.path(thumbnails.thumbnail_name(blob.file.name, size))
+
+            with Image.open(path) as image:
+                self.assertEqual(image.format, 'JPEG')
+                # the longest side fits, the ratio is kept
+                self.assertEqual(image.size, (side, side // 2))
+
+    def test_small_images_are_not_enlarged(self):
+        blob = self.create_image(size=(100, 50)).blob
+
+        path = blob.file.storage.path(thumbnails.thumbnail_name(blob.file.name, 'large'))
+
+        with Image.open(path) as image:
+            self.assertEqual(image.size, (100, 50))
+
+    def test_unreadable_image_fails(self):
+        with override_settings(DRIVE_BACKGROUND_WORKERS=1):
+            # queued once the upload commits, built below
+            file_record = self.create_file('broken.png', b'not a png')
+
+        self.assertEqual(Blob.objects.get(pk=file_record.blob_id).thumbnail_status, 'pending')
+
+        self.assertEqual(thumbnails.build_thumbnails(file_record.blob_id, 'image'), 'failed')
+        self.assertEqual(Blob.objects.get(pk=file_record.blob_id).thumbnail_status, 'failed')
+
+    def test_other_content_has_no_thumbnails(self):
+        file_record = self.create_file('notes.txt', b'text')
+
+        self.assertEqual(Blob.objects.get(pk=file_record.blob_id).thumbnail_status, '')
+
+    def test_thumbnail_is_cached_for_good(self):
+        file_record = self.create_image()
+
+        self.client.force_login(self.user)
+
+        url = reverse('file-thumbnail', args=[file_record.slug, 'small'])
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Cache-Control'], 'private, max-age=31536000, immutable')
+        self.assertEqual(response['ETag'], f'"{file_record.blob.checksum}-small"')
+
+        # revalidation without the body
+        response = self.client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+        # unknown size
+        response = self.client.get(reverse('file-thumbnail', args=[file_record.slug, 'huge']))
+        self.assertEqual(response.status_code, 404)
+
+class InboxTests(DriveTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.recipient = User.objects.create_user('bob', password='secret', email='bob@example.com')
+        self.folder = self.create_folder('projets', shared_at=timezone.now())
+
+    def share(self, item):
+        item.shared_at = timezone.now()
+        item.save()
+
+        return self.create_share(item, recipient=self.recipient, expires_at=timezone.now() + timedelta(days=1))
+
+    def inbox(self):
+        self.client.force_login(self.recipient)
+        response = self.client.get(reverse('my-box'), {'dossier': 'partages-avec-moi'})
+
+        return sorted(item.name for item in response.context['files'])
+
+    def test_inbox_lists_items_the_shares_give_access_to(self):
+        self.share(self.create_file('a.txt', folder=self.folder))
+        self.share(self.create_folder('plans'))
+
+        self.assertEqual(self.inbox(), ['a.txt', 'plans'])
+
+    def test_inbox_hides_items_no_longer_reachable(self):
+        self.share(self.create_file('a.txt', folder=self.folder))
+        hidden = self.share(self.create_file('b.txt'))
+
+        # trashed folder
+        trashed = self.create_folder('old')
+        self.share(self.create_file('c.txt', folder=trashed))
+        soft_delete_folder_tree(trashed)
+
+        # deleted contact
+        hidden.contact.is_deleted = True
+        hidden.contact.save()
+
+        self.assertEqual(self.inbox(), ['a.txt'])
+
+    def test_restored_shares_show_again(self):
+        folder = self.create_folder('plans')
+        self.share(folder)
+        self.share(self.create_file('a.txt', folder=folder))
+
+        soft_delete_folder_tree(folder)
+        self.assertEqual(self.inbox(), [])
+
+        restored = FolderRecord.objects.get(pk=folder.pk)
+        restore_folder_tree(restored)
+
+        self.assertEqual(self.inbox(), ['a.txt', 'plans'])
+        self.assertIsNotNone(restored.shared_at)
+
+    def test_restored_file_shows_again(self):
+        file = self.create_file('b.txt')
+        self.share(file)
+
+        # as the delete view does
+        file.is_deleted = True
+        file.deleted_at = timezone.now()
+        file.shared_at = None
+        file.save()
+
+        ShareRecord.objects.filter(file=file).update(is_deleted=True, deleted_at=file.deleted_at)
+        self.assertEqual(self.inbox(), [])
+
+        restored = FileRecord.objects.get(pk=file.pk)
+        restore_file(restored)
+
+        self.assertEqual(self.inbox(), ['b.txt'])
+        self.assertEqual(restored.shared_at, file.deleted_at)
+
+class ListingCacheTests(DriveTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        self.folder = self.create_folder('projets')
+        self.file = self.create_file('a.txt', folder=self.folder)
+
+    def assertBumps(self, scope, change):
+        before = get_version(scope)
+
+        # versions move once the change is committed
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+
+        self.assertGreater(get_version(scope), before)
+
+    def listing(self):
+        files = FileRecord.objects.filter(folder=self.folder, is_deleted=False).order_by('name')
+
+        return folder_listing(FolderRecord.objects.none(), files, folder_scope(self.folder.pk))
+
+    def test_file_changes_bump_its_folder(self):
+        scope = folder_scope(self.folder.pk)
+
+        def rename():
+            self.file.name = 'b.txt'
+            self.file.save()
+
+        def trash():
+            self.file.is_deleted = True
+            self.file.deleted_at = timezone.now()
+            self.file.save()
+
+        self.assertBumps(scope, lambda: self.create_file('c.txt', folder=self.folder))
+        self.assertBumps(scope, rename)
+        self.assertBumps(scope, trash)
+        self.assertBumps(scope, lambda: restore_file(FileRecord.objects.get(pk=self.file.pk)))
+
+    def test_folder_changes_bump_its_parent(self):
+        scope = root_scope(self.user.pk)
+
+        def rename():
+            self.folder.name = 'plans'
+            self.folder.save()
+
+        self.assertBumps(scope, lambda: self.create_folder('plans'))
+        self.assertBumps(scope, rename)
+        self.assertBumps(scope, lambda: soft_delete_folder_tree(self.folder))
+        self.assertBumps(scope, lambda: restore_folder_tree(FolderRecord.objects.get(pk=self.folder.pk)))
+
+    def test_favorite_bumps_the_listing(self):
+        self.client.force_login(self.user)
+        url = reverse('toggle-favorite', args=[self.file.slug])
+
+        self.assertBumps(folder_scope(self.folder.pk), lambda: self.client.get(url))
+        self.assertBumps(root_scope(self.user.pk), lambda: self.client.get(
+            reverse('toggle-favorite', args=[self.folder.slug]), {'type': 'folder'}
+        ))
+
+        self.assertTrue(FileRecord.objects.get(pk=self.file.pk).is_favorite)
+        self.assertTrue(FolderRecord.objects.get(pk=self.folder.pk).is_favorite)
+
+    def test_copy_into_bumps_the_recipient_root(self):
+        recipient = User.objects.create_user('bob', password='secret', email='bob@example.com')
+        job = CopyJob.objects.create(user=recipient, source=self.folder)
+
+        self.assertBumps(root_scope(recipient.pk), lambda: run_copy_job(job.pk))
+
+    def test_pages_are_cached_until_a_change(self):
+        self.assertEqual([item.name for item in self.listing()[0:10]], ['a.txt'])
+
+        # not seen: nothing bumped the version
+        FileRecord.objects.filter(pk=self.file.pk).update(name='b.txt')
+        self.assertEqual([item.name for item in self.listing()[0:10]], ['a.txt'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_file('c.txt', folder=self.folder)
+
+        self.assertEqual([item.name for item in self.listing()[0:10]], ['b.txt', 'c.txt'])
+
+    @override_settings(TESTING=False)
+    def test_process_local_cache_is_not_used(self):
+        self.assertNotIsInstance(self.listing(), CachedFolderListing)
+
+        # files on the disk are seen by every process
+        shared = {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(self.media_root, 'cache'),
+        }
+
+        with override_settings(CACHES={'default': shared}):
+            self.assertIsInstance(self.listing(), CachedFolderListing)
+
+class TrackedFieldsTests(DriveTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        created = self.create_file('a.txt', description='notes')
+        self.share = self.create_share(created)
+        self.file = FileRecord.objects.get(pk=created.pk)
+
+    def writes(self, save):
+        """
+        Run `save` and return the SELECT and UPDATE
+        statements it sent, without the savepoints
+        """
+
+        with CaptureQueriesContext(connection) as queries:
+            save()
+
+        return [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith(('SELECT', 'UPDATE'))
+        ]
+
+    def test_touch_only_writes_its_column(self):
+        self.file.last_accessed_at = timezone.now()
+
+        [update] = self.writes(lambda: self.file.save(update_fields=['last_accessed_at']))
+
+        self.assertTrue(update.startswith('UPDATE "drive_filerecord" SET "last_accessed_at"'))
+        self.assertNotIn('"slug"', update)
+        self.assertNotIn('"name"', update)
+
+    def test_rename_writes_the_new_slug(self):
+        slug = self.file.slug
+        self.file.name = 'b.txt'
+
+        writes = self.writes(lambda: self.file.save(update_fields=['name']))
+
+        # the change is seen without fetching the row
+        self.assertFalse([sql for sql in writes if sql.startswith('SELECT "drive_filerecord"')])
+        self.assertIn('"slug"', writes[0])
+        self.assertNotEqual(FileRecord.objects.get(pk=self.file.pk).slug, slug)
+
+    def test_unchanged_save_issues_no_update(self):
+        slug = self.file.slug
+
+        # nothing to write
+        self.assertEqual(self.writes(lambda: self.file.save(update_fields=[])), [])
+
+        # only the row itself, no cascade on shares or search entries
+        [update] = self.writes(self.file.save)
+
+        self.assertTrue(update.startswith('UPDATE "drive_filerecord"'))
+        self.assertEqual(FileRecord.objects.get(pk=self.file.pk).slug, slug)
+        self.assertFalse(ShareRecord.objects.get(pk=self.share.pk).is_deleted)
+
+    def test_refresh_from_db_takes_a_new_snapshot(self):
+        FileRecord.objects.filter(pk=self.file.pk).update(name='b.txt')
+
+        self.file.refresh_from_db()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.file.get_changed_fields(), set())
+
+        self.file.name = 'c.txt'
+        self.assertEqual(self.file.get_changed_fields(), {'name'})
+
+    def test_deferred_fields_are_snapshot_when_loaded(self):
+        file = FileRecord.objects.only('id', 'user_id', 'name').get(pk=self.file.pk)
+
+        # loading a deferred field snapshots it, and only it
+        file.description = 'brouillon'
+        file.folder_id
+
+        with self.assertNumQueries(1):
+            # description was never loaded
+            self.assertEqual(file.get_changed_fields(), {'description'})
+
+        with self.assertNumQueries(0):
+            self.assertEqual(file.get_changed_fields(), {'description'})
+
+@override_settings(DRIVE_ACCESS_FLUSH_INTERVAL=60)
+class AccessLogTests(DriveTestCase):
+
+    def setUp(self):
+        super().setUp()
+
+        # flushed by the tests, not by the background thread
+        patcher = mock.patch('drive.access_log._start_flusher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        access_log._pending.clear()
+        self.addCleanup(access_log._pending.clear)
+
+        self.file = self.create_file('a.txt')
+        self.share = self.create_share(self.file)
+        self.now = timezone.now()
+
+    def accessed_at(self, instance):
+        return type(instance).objects.values_list('last_accessed_at', flat=True).get(pk=instance.pk)
+
+    def test_accesses_are_buffered(self):
+        access_log.record_access(self.share, self.now)
+
+        self.assertIsNone(self.accessed_at(self.share))
+        self.assertEqual(access_log.flush(), 1)
+        self.assertEqual(self.accessed_at(self.share), self.now)
+
+        # nothing left to write
+        self.assertEqual(access_log.flush(), 0)
+
+    def test_repeated_accesses_are_coalesced(self):
+        later = self.now + timedelta(minutes=1)
+
+        access_log.record_access(self.file, later)
+        access_log.record_access(self.file, self.now)
+        access_log.record_access(self.share, self.now)
+
+        # one UPDATE per model
+        with self.assertNumQueries(2):
+            self.assertEqual(access_log.flush(), 2)
+
+        self.assertEqual(self.accessed_at(self.file), later)
+        self.assertEqual(self.accessed_at(self.share), self.now)
+
+    def test_failed_flush_keeps_the_rows(self):
+        earlier = self.now - timedelta(minutes=1)
+
+        access_log.record_access(self.file, self.now)
+        access_log.record_access(self.share, self.now)
+
+        def update_and_fail(*args, **kwargs):
+            # a request recorded before comes in meanwhile
+            access_log.record_access(self.share, earlier)
+            raise DatabaseError('database is locked')
+
+        with mock.patch('django.db.models.QuerySet.update', side_effect=update_and_fail):
+            with self.assertRaises(DatabaseError):
+                access_log.flush()
+
+        # the last access of each row is kept
+        self.assertEqual(access_log._pending, {
+            FileRecord: {self.file.pk: self.now},
+            ShareRecord: {self.share.pk: self.now},
+        })
+
+        self.assertEqual(access_log.flush(), 2)
+        self.assertEqual(self.accessed_at(self.share), self.now)
+
+    @override_settings(DRIVE_ACCESS_FLUSH_INTERVAL=0)
+    def test_write_through_without_buffering(self):
+        access_log.record_access(self.share, self.now)
+
+        self.assertEqual(access_log._pending, {})
+        self.assertEqual(self.accessed_at(self.share), self.now)
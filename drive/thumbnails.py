@@ -0,0 +1,153 @@
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.db.models.fields.files import FieldFile
+from .models import Blob, FileRecord
+from .cache import bump_listings, listing_scope
+from .delivery import serve_file
+from . import imaging
+import multiprocessing
+import threading
+import logging
+import shutil
+import os
+
+logger = logging.getLogger(__name__)
+
+# name → longest side in pixels
+SIZES = {
+    'small': 64,
+    'medium': 256,
+    'large': 1024,
+}
+
+# svg is drawn by the browser, nothing to render
+IMAGE_TYPES = ['image/jpeg', 'image/png', 'image/gif', 'image/bmp', 'image/webp', 'image/tiff']
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            # spawned processes do not inherit the threads and
+            # database connections of the web worker
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.DRIVE_THUMBNAIL_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+
+    return _pool
+
+def get_thumbnail_kind(mime_type):
+    """
+    Renderer able to make thumbnails of this
+    content with what is installed, or None
+    """
+
+    if mime_type in IMAGE_TYPES and imaging.Image is not None:
+        return 'image'
+
+    if mime_type == 'application/pdf' and shutil.which('pdftoppm'):
+        return 'pdf'
+
+    return None
+
+def thumbnail_name(blob_name, size):
+    """
+    Thumbnails are stored next to their blob:
+    blobs/ab/cd/<checksum>.small.jpg
+    """
+
+    return f'{os.path.splitext(blob_name)[0]}.{size}.jpg'
+
+def queue_thumbnails(blob, mime_type):
+    """
+    Render the thumbnails of a new blob in the background,
+    once: later files with the same content reuse them
+    """
+
+    if not blob or blob.thumbnail_status:
+        return
+
+    kind = get_thumbnail_kind(mime_type)
+
+    if not kind:
+        return
+
+    # only the first upload of the content queues the job
+    queued = Blob.objects.filter(pk=blob.pk, thumbnail_status='').update(thumbnail_status='pending')
+
+    blob.thumbnail_status = 'pending'
+
+    if queued:
+        from .workers import run_in_background
+        run_in_background(build_thumbnails, blob.pk, kind)
+
+def build_thumbnails(blob_id, kind):
+    """
+    Render all the sizes of a blob in the process pool,
+    the calling thread only waits for the result
+    """
+
+    blob = Blob.objects.get(pk=blob_id)
+    storage = Blob._meta.get_field('file').storage
+
+    outputs = [
+        (side, storage.path(thumbnail_name(blob.file.name, size)))
+        for size, side in SIZES.items()
+    ]
+
+    try:
+        if settings.DRIVE_THUMBNAIL_WORKERS > 0:
+            _get_pool().submit(
+                imaging.render, kind, blob.file.path, outputs
+            ).result(timeout=settings.DRIVE_THUMBNAIL_TIMEOUT)
+        else:
+            imaging.render(kind, blob.file.path, outputs)
+
+    except Exception as e:
+        logger.warning(f'thumbnails of blob {blob_id} failed: {e!r}')
+
+        status = 'failed'
+
+    else:
+        status = 'done'
+
+    Blob.objects.filter(pk=blob_id).update(thumbnail_status=status)
+
+    # cached listings still show the icon
+    bump_listings(
+        listing_scope(user_id, folder_id)
+        for user_id, folder_id in FileRecord.objects.filter(blob_id=blob_id).values_list('user_id', 'folder_id')
+    )
+
+    return status
+
+def delete_thumbnails(storage, name):
+    """
+    Remove the thumbnails stored next to a blob file
+    """
+
+    for size in SIZES:
+        storage.delete(thumbnail_name(name, size))
+
+def thumbnail_response(request, file_record, size):
+    """
+    Serve a thumbnail. Its url carries the checksum
+    of the content, so browsers keep it for a year
+    """
+
+    blob = file_record.blob
+    field = Blob._meta.get_field('file')
+
+    return serve_file(
+        request,
+        FieldFile(blob, field, thumbnail_name(blob.file.name, size)),
+        name=f'{os.path.splitext(file_record.name)[0]}.jpg',
+        content_type='image/jpeg',
+        etag=f'"{blob.checksum}-{size}"',
+        last_modified=int(blob.created_at.timestamp()),
+        cache_control='private, max-age=31536000, immutable',
+    )
@@ -0,0 +1,188 @@
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import Q
+from .models import FileRecord, FolderRecord, ShareRecord
+from .usage import move_files
+from .cache import bump_folders, bump_listings, listing_scope
+import logging
+
+logger = logging.getLogger(__name__)
+
+def soft_delete_folder_tree(folder):
+    """
+    Move a folder, its subfolders, files and shares to the trash
+    with one UPDATE per table. Everything gets the same
+    deleted_at so the tree can be restored as a whole.
+    """
+
+    now = timezone.now()
+
+    with transaction.atomic():
+        folder_ids = list(folder.get_descendants().filter(
+            is_deleted=False
+        ).values_list('id', flat=True))
+
+        if not folder_ids:
+            return 0
+
+        files = FileRecord.objects.filter(
+            folder_id__in=folder_ids,
+            is_deleted=False,
+        )
+
+        move_files(files, to_trash=True)
+
+        file_count = files.update(is_deleted=True, deleted_at=now, shared_at=None)
+
+        ShareRecord.objects.filter(
+            Q(folder_id__in=folder_ids) | Q(file__folder_id__in=folder_ids),
+            is_deleted=False,
+        ).update(is_deleted=True, deleted_at=now)
+
+        FolderRecord.objects.filter(
+            id__in=folder_ids
+        ).update(is_deleted=True, deleted_at=now, shared_at=None)
+
+        bump_folders(folder_ids)
+        bump_listings([listing_scope(folder.user_id, folder.parent_id)])
+
+    logger.info(f'{len(folder_ids)} folders and {file_count} files moved to trash')
+
+    folder.is_deleted = True
+    folder.deleted_at = now
+    folder.shared_at = None
+
+    return file_count
+
+def _restore_ancestors(folder_ids):
+    """
+    Restore the deleted parents of a restored item
+    """
+
+    FolderRecord.objects.filter(
+        id__in=folder_ids,
+        is_deleted=True,
+    ).update(is_deleted=False, deleted_at=None)
+
+def _restore_shares(shares, deleted_at):
+    """
+    Bring back the shares trashed with a restored item,
+    shares deleted before it stay deleted. The items are
+    shared again so they show in the recipients inbox.
+    """
+
+    shares = shares.filter(is_deleted=True, contact__is_deleted=False)
+
+    if deleted_at:
+        shares = shares.filter(deleted_at__gte=deleted_at)
+
+    share_ids = list(shares.values_list('id', flat=True))
+
+    if not share_ids:
+        return 0
+
+    shares = ShareRecord.objects.filter(id__in=share_ids)
+
+    # trashing cleared shared_at, the item was shared until then
+    shared_at = deleted_at or timezone.now()
+
+    FolderRecord.objects.filter(
+        id__in=shares.values('folder_id'),
+        shared_at__isnull=True,
+    ).update(shared_at=shared_at)
+
+    FileRecord.objects.filter(
+        id__in=shares.values('file_id'),
+        shared_at__isnull=True,
+    ).update(shared_at=shared_at)
+
+    return shares.update(is_deleted=False, deleted_at=None)
+
+def restore_folder_tree(folder):
+    """
+    Restore a trashed folder with everything that was trashed
+    with it, and its parent folders. Items that were already
+    in the trash before the folder was deleted stay there.
+    """
+
+    deleted_at = folder.deleted_at
+
+    with transaction.atomic():
+        subtree = folder.get_descendants().filter(is_deleted=True)
+
+        if deleted_at:
+            subtree = subtree.filter(deleted_at__gte=deleted_at)
+
+        folder_ids = list(subtree.values_list('id', flat=True))
+
+        files = FileRecord.objects.filter(
+            folder_id__in=folder_ids,
+            is_deleted=True,
+            is_archived=False,
+        )
+
+        if deleted_at:
+            files = files.filter(deleted_at__gte=deleted_at)
+
+        restored_file_ids = list(files.values_list('id', flat=True))
+
+        move_files(files, to_trash=False)
+
+        file_count = files.update(is_deleted=False, deleted_at=None)
+
+        FolderRecord.objects.filter(
+            id__in=folder_ids
+        ).update(is_deleted=False, deleted_at=None)
+
+        # share links of the tree work again
+        _restore_shares(
+            ShareRecord.objects.filter(Q(folder_id__in=folder_ids) | Q(file_id__in=restored_file_ids)),
+            deleted_at,
+        )
+
+        ancestor_ids = folder.get_ancestor_ids()
+
+        _restore_ancestors(ancestor_ids)
+
+        # restored parents reappear up to the root
+        bump_folders(folder_ids + ancestor_ids, [folder.user_id])
+
+    logger.info(f'{len(folder_ids)} folders and {file_count} files restored')
+
+    folder.is_deleted = False
+    folder.deleted_at = None
+
+    # shared again if its shares were restored
+    folder.refresh_from_db(fields=['shared_at'])
+
+    return file_count
+
+def restore_file(file):
+    """
+    Restore a trashed file and its parent folders
+    """
+
+    deleted_at = file.deleted_at
+
+    with transaction.atomic():
+        files = FileRecord.objects.filter(pk=file.pk)
+
+        move_files(files, to_trash=False)
+
+        files.update(is_deleted=False, deleted_at=None)
+
+        if _restore_shares(file.shares.all(), deleted_at) and not file.shared_at:
+            file.shared_at = deleted_at or timezone.now()
+
+        folder_ids = []
+
+        if file.folder_id:
+            folder_ids = file.folder.get_ancestor_ids() + [file.folder_id]
+            _restore_ancestors(folder_ids)
+
+        bump_folders(folder_ids, [file.user_id])
+
+    file.is_deleted = False
+    file.deleted_at = None
+
+    file._snapshot_tracked_fields()
@@ -0,0 +1,172 @@
+from django.db import transaction
+from django.utils import timezone
+from django.conf import settings
+from datetime import timedelta
+from .models import FileRecord, UploadSession, user_hashed_upload_to
+from .blobs import adopt_blob
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# bytes read from the request body at a time
+CHUNK_SIZE = 1024 * 1024
+
+def _storage():
+    return FileRecord._meta.get_field('file').storage
+
+def merge_range(ranges, start, end):
+    """
+    Add the [start, end) range to a list of
+    sorted ranges, merging the ones that touch
+    """
+
+    merged = []
+
+    for range_start, range_end in sorted([*ranges, [start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+
+    return merged
+
+def contiguous_offset(ranges):
+    """
+    Number of bytes received without gap from the start
+    """
+
+    if ranges and ranges[0][0] == 0:
+        return ranges[0][1]
+
+    return 0
+
+def create_upload_session(user, name, size, folder=None):
+    """
+    Start a resumable upload. The final file is created
+    at its full size so chunks can be written in any order.
+    """
+
+    session = UploadSession(
+        user=user,
+        folder=folder,
+        name=name,
+        size=size,
+        expires_at=timezone.now() + timedelta(hours=settings.DRIVE_UPLOAD_SESSION_TTL),
+    )
+    session.path = user_hashed_upload_to(session, name)
+
+    path = _storage().path(session.path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, 'wb') as f:
+        f.truncate(size)
+
+    session.save()
+
+    return session
+
+def write_chunk(session, offset, stream, length):
+    """
+    Write `length` bytes of `stream` at `offset`, straight
+    into the final file, and record the received range.
+    Several chunks of the same upload can run in parallel.
+    Returns the contiguous offset.
+    """
+
+    if offset < 0 or length < 0 or offset + length > session.size:
+        raise ValueError('Chunk out of the upload bounds')
+
+    fd = os.open(_storage().path(session.path), os.O_WRONLY)
+    written = 0
+
+    try:
+        while written < length:
+            data = stream.read(min(CHUNK_SIZE, length - written))
+
+            if not data:
+                break
+
+            os.pwrite(fd, data, offset + written)
+            written += len(data)
+    finally:
+        os.close(fd)
+
+    if not written:
+        return session.offset
+
+    with transaction.atomic():
+        # lock the ledger against the other chunks of the upload
+        locked = UploadSession.objects.select_for_update().get(pk=session.pk)
+        locked.received = merge_range(locked.received, offset, offset + written)
+        locked.offset = contiguous_offset(locked.received)
+        locked.save(update_fields=['received', 'offset'])
+
+    session.received = locked.received
+    session.offset = locked.offset
+
+    return session.offset
+
+def finalize_upload(session):
+    """
+    Turn a complete upload into a FileRecord
+    """
+
+    if not session.is_complete:
+        raise ValueError('Upload is not complete')
+
+    if session.file_id:
+        return session.file
+
+    with transaction.atomic():
+        file_record = FileRecord(
+            user=session.user,
+            folder=session.folder,
+            name=session.name,
+            file_uuid=session.file_uuid,
+        )
+
+        # the bytes are already in place
+        file_record.file.name = session.path
+        file_record.capture_file_metadata()
+
+        # identical content is only stored once
+        file_record.blob = adopt_blob(session.path, file_record.checksum, file_record.size)
+        file_record.file = file_record.blob.file.name
+        file_record.save()
+
+        session.file = file_record
+        session.completed_at = timezone.now()
+        session.save(update_fields=['file', 'completed_at'])
+
+    logger.info(f'upload {session.upload_uuid} saved as file {file_record.pk}')
+
+    return file_record
+
+def discard_upload(session):
+    """
+    Delete an unfinished upload and its partial file
+    """
+
+    if session.path and not session.file_id:
+        _storage().delete(session.path)
+
+    session.delete()
+
+def purge_expired_uploads():
+    """
+    Delete the unfinished uploads past their expiry
+    """
+
+    sessions = UploadSession.objects.filter(
+        file__isnull=True,
+        expires_at__lte=timezone.now(),
+    )
+
+    count = 0
+
+    for session in sessions.iterator():
+        discard_upload(session)
+        count += 1
+
+    return count
@@ -8,10 +8,13 @@ urlpatterns = [
     path('corbeille', views.trash_bin_view, name='my-trash'),
     path('corbeille/<slug:slug>/restore', views.restore_deleted_file_view, name='restore-deleted-file'),
     path('corbeille/<slug:slug>/archive', views.archive_file_view, name='archive-deleted-file'),
+    path('corbeille/dossier/<slug:slug>/restore', views.restore_deleted_folder_view, name='restore-deleted-folder'),
     path('nouveau-dossier', views.create_folder_view, name='new-folder'),
     path('dossier/<slug:slug>/supprimer', views.delete_folder_view, name='delete-folder'),
     path('dossier/<slug:slug>/partager', views.share_folder_view, name='share-folder'),
     path('dossier/<slug:slug>/download', views.download_folder_view, name='download-folder'),
+    path('archives/<uuid:job_uuid>', views.archive_job_view, name='archive-job'),
+    path('archives/<uuid:job_uuid>/download', views.download_archive_view, name='download-archive'),
     path('dossier/<slug:slug>/rename', views.rename_folder_view, name='rename-folder'),
     
     # file
@@ -21,8 +24,13 @@ urlpatterns = [
     path('fichier/<slug:slug>/view', views.view_file_content_view, name='view-file'),
     path('fichier/<slug:slug>/supprimer', views.delete_file_view, name='delete-file'),
     path('fichier/<slug:slug>/download', views.download_file_view, name='download-file'),
+    path('fichier/<slug:slug>/apercu/<str:size>', views.file_thumbnail_view, name='file-thumbnail'),
     path('fichier/importer', views.upload_files_view, name='upload-files'),
+    path('fichier/uploads', views.create_upload_view, name='create-upload'),
+    path('fichier/uploads/<uuid:upload_uuid>', views.upload_session_view, name='upload-session'),
+    path('fichier/uploads/<uuid:upload_uuid>/finalize', views.finalize_upload_view, name='finalize-upload'),
     path('favoris/<slug:slug>', views.toggle_favorite_view, name='toggle-favorite'),
+    path('copies/<uuid:job_uuid>', views.copy_job_view, name='copy-job'),
     
     # contacts
     path('contacts', views.all_contacts_view, name='my-contacts'),
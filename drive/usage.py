@@ -0,0 +1,179 @@
+from django.db import transaction, IntegrityError
+from django.db.models import Sum, Count, Q
+from .models import FileRecord, StorageUsage, get_type_group
+import logging
+
+logger = logging.getLogger(__name__)
+
+# A change is (size, before, after) where before and after
+# are file_state() values. Changes are applied right BEFORE
+# the rows are written, in the same transaction: a usage row
+# created on the way is computed from the records as they
+# were, and the change is then added on top of it.
+
+def file_state(name, is_deleted, is_archived):
+    """
+    How a file counts in the usage: None when
+    it does not, else (type group, in the trash)
+    """
+
+    if is_archived:
+        return None
+
+    return (get_type_group(name), bool(is_deleted))
+
+def record_state(file_record):
+    return file_state(file_record.name, file_record.is_deleted, file_record.is_archived)
+
+def compute_usage(user_id):
+    """
+    Usage of a user summed over the file
+    records, for new rows and reconciliation
+    """
+
+    files = FileRecord.objects.filter(user_id=user_id, is_archived=False)
+
+    totals = files.aggregate(
+        total_bytes=Sum('size'),
+        file_count=Count('id'),
+        trashed_bytes=Sum('size', filter=Q(is_deleted=True)),
+        trashed_count=Count('id', filter=Q(is_deleted=True)),
+    )
+
+    bytes_by_type = {}
+
+    for name, size in files.values_list('name', 'size').iterator():
+        group = get_type_group(name)
+        bytes_by_type[group] = bytes_by_type.get(group, 0) + size
+
+    return {
+        'total_bytes': totals['total_bytes'] or 0,
+        'file_count': totals['file_count'],
+        'trashed_bytes': totals['trashed_bytes'] or 0,
+        'trashed_count': totals['trashed_count'],
+        'bytes_by_type': {group: size for group, size in bytes_by_type.items() if size},
+    }
+
+def _get_locked_usage(user_id):
+    """
+    Usage row of the user, locked for the transaction
+    """
+
+    usage = StorageUsage.objects.select_for_update().filter(user_id=user_id).first()
+
+    if usage:
+        return usage
+
+    try:
+        with transaction.atomic():
+            return StorageUsage.objects.create(user_id=user_id, **compute_usage(user_id))
+    except IntegrityError:
+        # created by a concurrent request
+        return StorageUsage.objects.select_for_update().get(user_id=user_id)
+
+def get_usage(user):
+    """
+    Usage of a user, created from the records the first time
+    """
+
+    usage = StorageUsage.objects.filter(user=user).first()
+
+    if usage:
+        return usage
+
+    with transaction.atomic():
+        return _get_locked_usage(user.pk)
+
+def apply_changes(user_id, changes):
+    """
+    Apply a list of (size, before, after) changes to the usage
+    """
+
+    changes = [change for change in changes if change[1] != change[2]]
+
+    if not changes:
+        return
+
+    with transaction.atomic():
+        usage = _get_locked_usage(user_id)
+        bytes_by_type = dict(usage.bytes_by_type)
+
+        for size, before, after in changes:
+            for state, sign in ((before, -1), (after, 1)):
+                if state is None:
+                    continue
+
+                group, trashed = state
+
+                usage.total_bytes += sign * size
+                usage.file_count += sign
+                bytes_by_type[group] = bytes_by_type.get(group, 0) + sign * size
+
+                if trashed:
+                    usage.trashed_bytes += sign * size
+                    usage.trashed_count += sign
+
+        if min(usage.total_bytes, usage.file_count, usage.trashed_bytes, usage.trashed_count) < 0:
+            logger.warning(f'storage usage of user {user_id} went negative, reconcile it')
+
+            usage.total_bytes = max(usage.total_bytes, 0)
+            usage.file_count = max(usage.file_count, 0)
+            usage.trashed_bytes = max(usage.trashed_bytes, 0)
+            usage.trashed_count = max(usage.trashed_count, 0)
+
+        usage.bytes_by_type = {group: size for group, size in bytes_by_type.items() if size > 0}
+        usage.save()
+
+def _apply_by_user(rows, after):
+    """
+    Apply to (user_id, name, size, is_deleted, is_archived)
+    rows a change given by after(name, is_deleted, is_archived)
+    """
+
+    changes = {}
+
+    for user_id, name, size, is_deleted, is_archived in rows:
+        changes.setdefault(user_id, []).append((
+            size,
+            file_state(name, is_deleted, is_archived),
+            after(name, is_deleted, is_archived),
+        ))
+
+    for user_id, user_changes in changes.items():
+        apply_changes(user_id, user_changes)
+
+def _rows(files):
+    return files.values_list('user_id', 'name', 'size', 'is_deleted', 'is_archived')
+
+def add_files(file_records):
+    """
+    Count new records, before they are bulk inserted
+    """
+
+    changes = {}
+
+    for file_record in file_records:
+        changes.setdefault(file_record.user_id, []).append(
+            (file_record.size, None, record_state(file_record))
+        )
+
+    for user_id, user_changes in changes.items():
+        apply_changes(user_id, user_changes)
+
+def remove_files(files):
+    """
+    Uncount the records of a queryset, before it is deleted
+    """
+
+    _apply_by_user(_rows(files), lambda name, is_deleted, is_archived: None)
+
+def move_files(files, to_trash):
+    """
+    Move the records of a queryset in or out of the
+    trash in the usage, before it is updated
+    """
+
+    _apply_by_user(
+        _rows(files),
+        lambda name, is_deleted, is_archived: file_state(name, to_trash, is_archived),
+    )
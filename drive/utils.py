@@ -1,5 +1,6 @@
 import re
 import os
+import mimetypes
 import unicodedata
 
 FORBIDDEN_EXTENSIONS = {
@@ -89,3 +90,19 @@ def is_extension_safe(file):
     if not ext:
         return False
     return ext.lower() not in FORBIDDEN_EXTENSIONS
+
+
+def guess_mime_type(name):
+    """
+    Guess the content type of a file from its name
+    """
+
+    mime_type, _ = mimetypes.guess_type(name)
+
+    if not mime_type and name.lower().endswith('.pdf'):
+        mime_type = 'application/pdf'
+
+    elif not mime_type:
+        mime_type = 'application/octet-stream'
+
+    return mime_type
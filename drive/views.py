@@ -4,13 +4,30 @@ from .models import (
     ShareRecord, 
     ContactDetails, 
     ContactGroup,
-    UserNotification
+    UserNotification,
+    UploadSession,
+    CopyJob,
+    ArchiveJob
 )
 from django.views.decorators.clickjacking import xframe_options_exempt
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
 from .utils import is_safe_filename, is_safe_foldername, is_extension_safe
-from django.http import FileResponse, HttpResponse
+from .zipstream import folder_zip_response
+from .archives import folder_content_version, get_archive, request_archive, archive_response
+from .access import annotate_access, annotate_shared_state, is_reachable_by_link
+from .listing import FolderFirstListing
+from .cache import folder_listing, listing_scope
+from . import queries
+from .search import search_records
+from .tree import soft_delete_folder_tree, restore_folder_tree, restore_file
+from .access_log import record_access
+from .delivery import file_response, streaming_view
+from .uploads import create_upload_session, write_chunk, finalize_upload, discard_upload
+from .quotas import reserve_upload_slots, check_storage_quota
+from .thumbnails import SIZES as THUMBNAIL_SIZES, thumbnail_response
+from django.http import HttpResponse, JsonResponse
+from django.conf import settings
 from django.shortcuts import render, redirect
 from django.contrib.auth.models import User
 from django.core.paginator import Paginator
@@ -18,13 +35,9 @@ from django.contrib import messages
 from core.utils import is_valid_int
 from django.utils import timezone
 from django.urls import reverse
-from datetime import timedelta
-from django.db.models import Q
-import mimetypes
+from django.db.models import Q, QuerySet
 import logging
-import zipfile
 import os
-import io
 
 logger = logging.getLogger(__name__)
 
@@ -34,48 +47,6 @@ MAX_TOTAL_UPLOAD_SIZE = 20 * 1024 * 1024 # 20MB
 
 MAX_FILES_COUNT_PER_REQUEST = 20
 
-MAX_FILES_COUNT_PER_DAY = 80 # 80 files per 24h
-
-MAX_FILES_COUNT_PER_HOUR = 50 # 50 files per 1h
-
-def delete_folder_and_contents(folder):
-    """
-    Delete a folder and its content
-    """
-
-    if not folder.is_deleted:
-    # Delete all files in this folder
-        for file in folder.files.all():
-
-            if not file.is_deleted:
-                file.is_deleted = True
-                file.deleted_at = timezone.now()
-                file.shared_at = None
-                file.save()
-
-        # delete all subfolders
-        for subfolder in folder.subfolders.all():
-            delete_folder_and_contents(subfolder)
-
-        # soft delete the folder
-        folder.is_deleted = True
-        folder.deleted_at = timezone.now()
-        folder.shared_at = None
-        folder.save()
-
-def add_folder_to_zip(zip_file, folder, base_path):
-    # Add files in this folder
-    for file_record in folder.files.filter(is_deleted=False):
-        if file_record.file:
-            file_path = file_record.file.path
-            arcname = os.path.join(base_path, file_record.name)
-            zip_file.write(file_path, arcname=arcname)
-
-    # Recurse into subfolders
-    for subfolder in folder.subfolders.filter(is_deleted=False):
-        sub_path = os.path.join(base_path, subfolder.name)
-        add_folder_to_zip(zip_file, subfolder, sub_path)
-
 @require_http_methods(['GET', 'POST'])
 @login_required
 def my_drive_view(request):
@@ -103,25 +74,15 @@ def my_drive_view(request):
     search_term = None
     files=list()
     folders=list()
+    # folder and root listings are cached
+    scope = None
 
     if request.method == 'POST':
         # search for files and folders
         search_term = request.POST.get('search_term')
 
         if search_term:
-            files = FileRecord.objects.filter(
-                Q(name__icontains=search_term) |
-                Q(description__icontains=search_term),
-                user=request.user,
-                is_deleted=False
-            )
-            
-            folders = FolderRecord.objects.filter(
-                Q(name__icontains=search_term) |
-                Q(description__icontains=search_term),
-                user=request.user,
-                is_deleted=False
-            )
+            folders, files = search_records(request.user, search_term)
 
     else:
 
@@ -131,10 +92,7 @@ def my_drive_view(request):
             # recent files
             logger.info(f'fetching {folder_slug}...')
 
-            files = FileRecord.objects.filter(
-                user=request.user,
-                is_deleted=False,
-            ).order_by('-last_accessed_at')
+            files = queries.recent_files(request.user)
 
             # always return empty result
             folders = FolderRecord.objects.none()
@@ -143,18 +101,10 @@ def my_drive_view(request):
             # favorite folders
             logger.info(f'fetching {folder_slug}...')
 
-            files = FileRecord.objects.filter(
-                user=request.user,
-                is_deleted=False,
-                is_favorite=True,
-            )
+            files = queries.favorite_files(request.user)
 
             # favorite folders
-            folders = FolderRecord.objects.filter(
-                is_deleted=False,
-                user=request.user,
-                is_favorite=True,
-            )
+            folders = queries.favorite_folders(request.user)
 
         elif folder_slug == 'partages':
             # shared folders
@@ -174,31 +124,37 @@ def my_drive_view(request):
                 folder__user=request.user,
             )
 
-            files = [share.file for share in shared_files]
-            folders = [share.folder for share in shared_folder]
+            files = [share.file for share in shared_files.select_related('file__blob')]
+            folders = [share.folder for share in shared_folder.select_related('folder')]
 
         elif folder_slug == 'partages-avec-moi':
             # files shared with me
             logger.info(f'fetching {folder_slug}...')
 
-            shared_files = ShareRecord.objects.filter(
-                recipient=request.user,
+            shared_files = queries.inbox_shares(request.user).filter(
                 file__isnull=False,             
                 file__is_deleted=False,    
-                is_deleted=False,
-                expires_at__gt=timezone.now()
             ).exclude(file__user=request.user)
             
-            shared_folder = ShareRecord.objects.filter(
-                recipient=request.user,
+            shared_folder = queries.inbox_shares(request.user).filter(
                 folder__isnull=False,
                 folder__is_deleted=False,    
-                is_deleted=False,
-                expires_at__gt=timezone.now()
             ).exclude(file__user=request.user)
 
-            files = [share.file for share in shared_files if share.file.is_shared]
-            folders = [share.folder for share in shared_folder if share.folder.is_shared]
+            files = annotate_shared_state(
+                share.file for share in shared_files.select_related('file__folder', 'file__blob')
+            )
+            folders = annotate_shared_state(
+                share.folder for share in shared_folder.select_related('folder')
+            )
+
+            # the share must still give access: its contact is
+            # not deleted and the item is not in a trashed folder
+            files = annotate_access(request.user, files)
+            folders = annotate_access(request.user, folders)
+
+            files = [file for file in files if file.is_shared and file.access]
+            folders = [folder for folder in folders if folder.is_shared and folder.access]
 
         elif folder_slug:
             logger.info('Finding folder by slog...')
@@ -215,28 +171,31 @@ def my_drive_view(request):
             
             logger.info(f'fetching folder {folder_slug} content...')
 
-            files = folder.files.all().filter(is_deleted=False)
+            files = queries.folder_files(folder)
             
-            folders = folder.subfolders.all().filter(is_deleted=False)
+            folders = queries.folder_subfolders(folder)
+
+            scope = listing_scope(request.user.pk, folder.pk)
 
         else:
-            logger.info(f'fetching root folders and files...')
+            logger.info('fetching root folders and files...')
 
             # root files
-            files = FileRecord.objects.filter(
-                user=request.user,
-                is_deleted=False,
-                folder=None
-            )
+            files = queries.root_files(request.user)
 
             # root folders
-            folders = FolderRecord.objects.filter(
-                is_deleted=False,
-                user=request.user,
-                parent=None
-            )
+            folders = queries.root_folders(request.user)
+
+            scope = listing_scope(request.user.pk)
                             
-    items = list(folders) + list(files)
+    if isinstance(files, QuerySet):
+        # thumbnails need the blob of each file
+        files = files.select_related('blob')
+
+    if scope:
+        items = folder_listing(folders, files, scope)
+    else:
+        items = FolderFirstListing(folders, files)
         
     paginator = Paginator(items, page_size) 
     page_obj = paginator.get_page(page)
@@ -247,7 +206,8 @@ def my_drive_view(request):
         'folder': folder,
         'folder_slug': folder_slug,
         'page_data': page_obj,
-        'recent_folders': folders[:10],
+        # folders come first in the listing
+        'recent_folders': items[:min(10, items.folder_count)],
         'search_term': search_term
     })
 
@@ -381,6 +341,7 @@ def rename_folder_view(request, slug):
 @require_http_methods(['GET'])
 @xframe_options_exempt
 @login_required
+@streaming_view
 def view_file_content_view(request, slug):
     """
     View file content
@@ -402,26 +363,37 @@ def view_file_content_view(request, slug):
         
         return redirect('my-box')
 
-    # Determine content type
-    mime_type, _ = mimetypes.guess_type(file_record.name)
-    if not mime_type and file_record.name.lower().endswith(".pdf"):
-        mime_type = "application/pdf"
-    elif not mime_type:
-        mime_type = "application/octet-stream"
-
-    response = FileResponse(file_record.file.open('rb'), content_type=mime_type)
+    response = file_response(request, file_record)
     
     # update metadata
-    file_record.last_accessed_at = timezone.now()
-    file_record.save()
+    record_access(file_record)
 
-    # Set inline disposition
-    response['Content-Disposition'] = f'inline; filename="{file_record.name}"'
     response["X-Frame-Options"] = "SAMEORIGIN"
     return response
 
 @require_http_methods(['GET'])
 @login_required
+def file_thumbnail_view(request, slug, size):
+    """
+    Thumbnail of an image or of the first page of a pdf
+    """
+
+    file_record = FileRecord.objects.filter(
+        slug=slug,
+        is_deleted=False,
+    ).select_related('blob').first()
+
+    if not file_record or size not in THUMBNAIL_SIZES or not file_record.has_thumbnail:
+        return HttpResponse(status=404)
+
+    if file_record.user_id != request.user.id and not file_record.is_accessible_by_user(request.user):
+        return HttpResponse(status=404)
+
+    return thumbnail_response(request, file_record, size)
+
+@require_http_methods(['GET'])
+@login_required
+@streaming_view
 def download_file_view(request, slug):
     """
     Download file
@@ -445,10 +417,9 @@ def download_file_view(request, slug):
         return redirect('my-box')
     
     # update meta
-    file_record.last_accessed_at = timezone.now()
-    file_record.save()
+    record_access(file_record)
 
-    return FileResponse(file_record.file.open('rb'), as_attachment=True, filename=file_record.name)
+    return file_response(request, file_record, as_attachment=True)
 
 @require_http_methods(['GET'])
 @login_required
@@ -474,15 +445,8 @@ def delete_folder_view(request, slug):
         
         return redirect('my-box')
     
-    # soft delete non-empty folders
-    delete_folder_and_contents(folder)
-
-    # delete direct shares
-    for share in folder.shares.all():
-        if not share.is_deleted:
-            share.is_deleted = True
-            share.deleted_at = timezone.now()
-            share.save()
+    # soft delete the folder, its content and shares
+    soft_delete_folder_tree(folder)
     
     messages.success(request, 'Dossier supprimeé')
 
@@ -576,7 +540,7 @@ def share_folder_view(request, slug):
     folders = folder.subfolders.all().filter(is_deleted=False)
     files = folder.files.all().filter(is_deleted=False)
     
-    items = list(folders) + list(files)
+    items = FolderFirstListing(folders, files)
         
     paginator = Paginator(items, 20) 
     page_obj = paginator.get_page(1)
@@ -600,6 +564,7 @@ def share_folder_view(request, slug):
 
 @require_http_methods(['GET'])
 @login_required
+@streaming_view
 def download_folder_view(request, slug):
     """
     Download folder
@@ -622,29 +587,20 @@ def download_folder_view(request, slug):
         
         return redirect('my-box')
     
-    if folder.is_over_30mb():
-        # check folder size before download 
-        # if it is too large, create background 
-        # and redirect user to waiting page
-        
-        messages.warning(request, 'Dossier trop large')
+    if not folder.is_over_download_limit():
+        return folder_zip_response(folder, request)
 
-        if parent_slug:
-            url = reverse('my-box')
-            return redirect(f"{url}?dossier={parent_slug}")
+    version = folder_content_version(folder)
+    archive = get_archive(folder, version)
 
-        return redirect('my-box')
-    
-    zip_buffer = io.BytesIO()
-    
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-        add_folder_to_zip(zip_file, folder, base_path=folder.name)
-
-    zip_buffer.seek(0)
+    if archive and archive.status == 'done':
+        # unchanged since the last archive
+        return archive_response(request, archive)
 
-    response = HttpResponse(zip_buffer, content_type='application/zip')
-    response['Content-Disposition'] = f'attachment; filename="{folder.name}.zip"'
-    return response
+    # too large to stream within the request,
+    # build it in background and show a waiting page
+    archive = request_archive(folder, version)
+    return redirect('archive-job', archive.job_uuid)
 
 @require_http_methods(['GET', 'POST'])
 @login_required
@@ -825,20 +781,6 @@ def upload_files_view(request):
     files = request.FILES.getlist('file')
     
     user = request.user
-    now = timezone.now()
-
-    one_hour_ago = now - timedelta(hours=1)
-    one_day_ago = now - timedelta(days=1)
-
-    last_hour_count = FileRecord.objects.filter(
-        user=user,
-        created_at__gte=one_hour_ago
-    ).count()
-
-    last_day_count = FileRecord.objects.filter(
-        user=user,
-        created_at__gte=one_day_ago
-    ).count()
 
     return_url = 'my-box'
 
@@ -846,16 +788,6 @@ def upload_files_view(request):
         return_url = reverse('my-box')
         return_url =f"{return_url}?dossier={parent_slug}"
 
-    if last_hour_count + len(files) > MAX_FILES_COUNT_PER_HOUR:
-        # too many upload per hour
-        messages.warning(request, f"Limite atteinte : {MAX_FILES_COUNT_PER_HOUR} fichiers maximum par heure")
-        return redirect(return_url)
-    
-    if last_day_count + len(files) > MAX_FILES_COUNT_PER_DAY:
-        # too many upload per day
-        messages.warning(request, F"Limite atteinte : {MAX_FILES_COUNT_PER_DAY} fichiers maximum par heure")
-        return redirect(return_url)
-    
     # Count files
     num_files = len(files)
 
@@ -890,6 +822,19 @@ def upload_files_view(request):
             logger.warning(file.name)
             return redirect(return_url)
 
+    quota_message = check_storage_quota(user, total_size)
+
+    if quota_message:
+        messages.warning(request, quota_message)
+        return redirect(return_url)
+
+    # hourly and daily limits of the plan, taken atomically
+    limit_message = reserve_upload_slots(user, num_files)
+
+    if limit_message:
+        messages.warning(request, limit_message)
+        return redirect(return_url)
+
     for uploaded_file in files:
         FileRecord.objects.create(
             user=user,
@@ -901,6 +846,222 @@ def upload_files_view(request):
     messages.success(request, 'Fichers sauvegardés')
     return redirect(return_url)
 
+def _upload_session_data(session):
+    return {
+        'upload': str(session.upload_uuid),
+        'name': session.name,
+        'size': session.size,
+        'offset': session.offset,
+        'received': session.received,
+        'url': reverse('upload-session', args=[session.upload_uuid]),
+        'finalize_url': reverse('finalize-upload', args=[session.upload_uuid]),
+    }
+
+def _get_upload_session(request, upload_uuid):
+    return UploadSession.objects.filter(
+        upload_uuid=upload_uuid,
+        user=request.user,
+        expires_at__gt=timezone.now(),
+    ).first()
+
+@require_http_methods(['POST'])
+@login_required
+def create_upload_view(request):
+    """
+    Start a resumable upload
+    """
+
+    parent_slug = request.GET.get('dossier')
+    folder = None
+    
+    if parent_slug:
+        folder = FolderRecord.objects.filter(
+            slug=parent_slug,
+            user=request.user,
+            is_deleted=False,
+        ).first()
+        
+        if not folder:
+            return JsonResponse({'error': 'Dossier introuvable'}, status=404)
+
+    name = request.POST.get('name', '')
+    size = request.POST.get('size', '')
+
+    if not is_safe_filename(name):
+        logger.warning(name)
+        return JsonResponse({'error': 'Nom de fichier invalide detecté'}, status=400)
+
+    if not is_extension_safe(UploadSession(name=name)):
+        logger.warning(name)
+        return JsonResponse({'error': 'Fichier incompatibles detecté'}, status=400)
+
+    if not is_valid_int(size) or int(size) < 0:
+        return JsonResponse({'error': 'Taille de fichier invalide'}, status=400)
+
+    size = int(size)
+
+    if size > settings.DRIVE_UPLOAD_MAX_SIZE:
+        return JsonResponse({'error': 'Fichier trop large detecté'}, status=413)
+
+    quota_message = check_storage_quota(request.user, size)
+
+    if quota_message:
+        return JsonResponse({'error': quota_message}, status=413)
+
+    limit_message = reserve_upload_slots(request.user, 1)
+
+    if limit_message:
+        return JsonResponse({'error': limit_message}, status=429)
+
+    session = create_upload_session(request.user, name, size, folder)
+
+    response = JsonResponse(_upload_session_data(session), status=201)
+    response['Location'] = reverse('upload-session', args=[session.upload_uuid])
+    return response
+
+@require_http_methods(['HEAD', 'GET', 'PATCH', 'PUT', 'DELETE'])
+@login_required
+def upload_session_view(request, upload_uuid):
+    """
+    Query the offset of an upload, send a chunk
+    at the `Upload-Offset` header, or cancel it
+    """
+
+    session = _get_upload_session(request, upload_uuid)
+
+    if not session or session.file_id:
+        return JsonResponse({'error': 'Téléversement introuvable'}, status=404)
+
+    if request.method == 'DELETE':
+        discard_upload(session)
+        return HttpResponse(status=204)
+
+    if request.method in ('PATCH', 'PUT'):
+        offset = request.headers.get('Upload-Offset', '')
+        length = request.headers.get('Content-Length', '')
+
+        if not is_valid_int(offset) or not is_valid_int(length):
+            return JsonResponse({'error': 'Upload-Offset et Content-Length requis'}, status=400)
+
+        offset = int(offset)
+        length = int(length)
+
+        if length > settings.DRIVE_UPLOAD_CHUNK_MAX_SIZE:
+            return JsonResponse({'error': 'Morceau trop large'}, status=413)
+
+        try:
+            # the body is streamed to the disk, never held in memory
+            write_chunk(session, offset, request, length)
+        except ValueError:
+            return JsonResponse({'error': 'Morceau hors limites'}, status=416)
+
+        response = HttpResponse(status=204)
+
+    else:
+        response = JsonResponse(_upload_session_data(session))
+
+    response['Upload-Offset'] = session.offset
+    response['Upload-Length'] = session.size
+    response['Cache-Control'] = 'no-store'
+    return response
+
+@require_http_methods(['POST'])
+@login_required
+def finalize_upload_view(request, upload_uuid):
+    """
+    Save a complete upload as a file
+    """
+
+    session = _get_upload_session(request, upload_uuid)
+
+    if not session:
+        return JsonResponse({'error': 'Téléversement introuvable'}, status=404)
+
+    if not session.is_complete:
+        return JsonResponse(_upload_session_data(session), status=409)
+
+    if not session.file_id:
+        # other uploads may have filled the quota meanwhile
+        quota_message = check_storage_quota(request.user, session.size)
+
+        if quota_message:
+            return JsonResponse({'error': quota_message}, status=413)
+
+    file_record = finalize_upload(session)
+
+    return JsonResponse({
+        'slug': file_record.slug,
+        'url': reverse('file-details', args=[file_record.slug]),
+    }, status=201)
+
+@require_http_methods(['GET'])
+@login_required
+def copy_job_view(request, job_uuid):
+    """
+    Progress of a folder copy
+    """
+
+    job = CopyJob.objects.filter(
+        job_uuid=job_uuid,
+        user=request.user,
+    ).select_related('source', 'target').first()
+
+    if not job:
+        messages.warning(request, 'Copie introuvable')
+        return redirect('my-box')
+
+    return render(request, 'drive/copy-job.html', {'job': job})
+
+def _get_archive_job(request, job_uuid):
+    """
+    Archive job of a folder the user owns
+    or can still reach by a share link
+    """
+
+    job = ArchiveJob.objects.filter(
+        job_uuid=job_uuid,
+        folder__is_deleted=False,
+    ).select_related('folder').first()
+
+    if not job:
+        return None
+
+    if job.folder.user_id != request.user.pk and not is_reachable_by_link(job.folder):
+        return None
+
+    return job
+
+@require_http_methods(['GET'])
+@login_required
+def archive_job_view(request, job_uuid):
+    """
+    Waiting page of a folder archive
+    """
+
+    job = _get_archive_job(request, job_uuid)
+
+    if not job:
+        messages.warning(request, 'Archive introuvable')
+        return redirect('my-box')
+
+    return render(request, 'drive/archive-job.html', {'job': job})
+
+@require_http_methods(['GET'])
+@login_required
+@streaming_view
+def download_archive_view(request, job_uuid):
+    """
+    Download a folder archive
+    """
+
+    job = _get_archive_job(request, job_uuid)
+
+    if not job or job.status != 'done':
+        messages.warning(request, 'Archive introuvable')
+        return redirect('my-box')
+
+    return archive_response(request, job)
+
 @require_http_methods(['GET'])
 @login_required
 def trash_bin_view(request):
@@ -908,14 +1069,16 @@ def trash_bin_view(request):
     View deleted files
     """
     
-    files = FileRecord.objects.filter(
-        user=request.user,
-        is_deleted=True,
-        is_archived=False,
-    ).order_by('-deleted_at')
+    files = queries.trashed_files(request.user)
+
+    # only the top of each deleted tree
+    folders = queries.trashed_folders(request.user).filter(
+        Q(parent=None) | Q(parent__is_deleted=False),
+    )
     
     return render(request, 'drive/trash-bin.html', {
-        'files': files[:100]
+        'files': files[:100],
+        'folders': folders[:100]
     })
     
 @require_http_methods(['POST'])
@@ -936,24 +1099,34 @@ def restore_deleted_file_view(request, slug):
         messages.warning(request, 'Fichier introuvable')
         return redirect('my-trash')
     
-    # restore file
-    file.is_deleted = False
-    file.deleted_at = None
-    file.shared_at = None
+    # restore file and all parent folders
+    restore_file(file)
     
-    file.save()
+    messages.success(request, 'Fichier restoré')
+
+    return redirect('my-trash')
+
+@require_http_methods(['POST'])
+@login_required
+def restore_deleted_folder_view(request, slug):
+    """
+    Restore deleted folder and its content
+    """
     
-    # restore all parent folders
-    folder = file.folder
-    while folder:
-        if folder.is_deleted:
-            folder.is_deleted = False
-            folder.deleted_at = None
-            folder.shared_at = None
-            folder.save()
-        folder = folder.parent
+    folder = FolderRecord.objects.filter(
+        slug=slug,
+        user=request.user,
+        is_deleted=True,
+    ).first()
     
-    messages.success(request, 'Fichier restoré')
+    if not folder:
+        messages.warning(request, 'Dossier introuvable')
+        return redirect('my-trash')
+    
+    # restore folder tree and all parent folders
+    restore_folder_tree(folder)
+    
+    messages.success(request, 'Dossier restoré')
 
     return redirect('my-trash')
 
@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.db import transaction, connections
+from django.conf import settings
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.DRIVE_BACKGROUND_WORKERS,
+                thread_name_prefix='drive-job',
+            )
+
+    return _executor
+
+def _run(func, args):
+    try:
+        func(*args)
+    except Exception as e:
+        logger.error(f'background job {func.__name__} failed: {e}')
+    finally:
+        # the thread owns its own connections
+        connections.close_all()
+
+def run_in_background(func, *args):
+    """
+    Run `func` on the worker threads of the process once
+    the current transaction has committed, or right away
+    in the request when background workers are disabled
+    """
+
+    if settings.DRIVE_BACKGROUND_WORKERS <= 0:
+        func(*args)
+        return
+
+    transaction.on_commit(lambda: _get_executor().submit(_run, func, args))
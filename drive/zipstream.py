@@ -0,0 +1,186 @@
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from .delivery import is_async_request, iterate_in_thread
+from .models import FileRecord
+import zipfile
+import os
+
+CHUNK_SIZE = 64 * 1024 # 64KB
+
+# extensions whose content is already compressed,
+# deflating them again only burns CPU
+STORED_EXTENSIONS = {
+    'jpg', 'jpeg', 'png', 'gif', 'webp',
+    'mp3', 'aac', 'ogg', 'flac', 'm4a',
+    'mp4', 'webm', 'mov', 'avi', 'mkv', 'wmv', 'flv',
+    'zip', 'rar', '7z', 'gz',
+    'docx', 'xlsx', 'pptx', 'odt', 'ods', 'odp',
+}
+
+class _ChunkSink:
+    """
+    Write-only file object collecting the
+    bytes produced by zipfile until they are drained
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+class ZipEntry:
+    """
+    A single file to add to a streamed archive
+    """
+
+    def __init__(self, arcname, path, size=None, modified_at=None, compress_type=None):
+        self.arcname = arcname
+        self.path = path
+        self.size = size
+        self.modified_at = modified_at
+        self.compress_type = compress_type
+
+    def get_compress_type(self):
+        if self.compress_type is not None:
+            return self.compress_type
+
+        ext = os.path.splitext(self.arcname)[1].lower().lstrip('.')
+
+        if ext in STORED_EXTENSIONS:
+            return zipfile.ZIP_STORED
+
+        return zipfile.ZIP_DEFLATED
+
+    def get_zip_info(self):
+        modified_at = self.modified_at or timezone.now()
+
+        # zip dates cannot go below 1980
+        date_time = max(modified_at.timetuple()[:6], (1980, 1, 1, 0, 0, 0))
+
+        zip_info = zipfile.ZipInfo(self.arcname, date_time=date_time)
+        zip_info.compress_type = self.get_compress_type()
+        zip_info.external_attr = 0o644 << 16
+
+        if self.size is not None:
+            zip_info.file_size = self.size
+
+        return zip_info
+
+def stream_zip(entries, chunk_size=CHUNK_SIZE):
+    """
+    Yield a zip archive chunk by chunk.
+    Only one chunk of one entry is held in memory
+    at a time, whatever the size of the archive.
+    """
+
+    sink = _ChunkSink()
+
+    # the sink is not seekable, so zipfile writes data
+    # descriptors after each entry and switches to ZIP64
+    # records on its own when offsets or counts need it
+    with zipfile.ZipFile(sink, mode='w', allowZip64=True) as zip_file:
+
+        for entry in entries:
+
+            if not os.path.exists(entry.path):
+                continue
+
+            zip_info = entry.get_zip_info()
+
+            # an unknown size forces ZIP64 local headers
+            force_zip64 = entry.size is None
+
+            with open(entry.path, 'rb') as src, zip_file.open(zip_info, mode='w', force_zip64=force_zip64) as dest:
+                while True:
+                    data = src.read(chunk_size)
+                    if not data:
+                        break
+
+                    dest.write(data)
+
+                    buffered = sink.drain()
+                    if buffered:
+                        yield buffered
+
+            buffered = sink.drain()
+            if buffered:
+                yield buffered
+
+    # central directory
+    buffered = sink.drain()
+    if buffered:
+        yield buffered
+
+def _live_tree(folder):
+    """
+    Archive paths of the folders of the tree outside of
+    the trash, and the files they contain, in two queries
+    """
+
+    folders = folder.get_descendants().filter(
+        is_deleted=False
+    ).only('id', 'name', 'parent_id', 'depth').order_by('depth', 'id')
+
+    paths = {}
+
+    for child in folders:
+        if child.pk == folder.pk:
+            paths[child.pk] = folder.name
+        elif child.parent_id in paths:
+            paths[child.pk] = os.path.join(paths[child.parent_id], child.name)
+
+    files = [
+        file_record for file_record in FileRecord.objects.filter(
+            folder__tree_path__startswith=folder.ensure_tree_path(),
+            is_deleted=False,
+        ).exclude(file='').only(
+            'id', 'name', 'file', 'size', 'folder_id', 'last_updated_at'
+        ).order_by('id')
+        if file_record.folder_id in paths
+    ]
+
+    return paths, files
+
+def iter_folder_entries(folder):
+    """
+    Zip entries of every active file of a folder
+    tree, read in two queries whatever its depth
+    """
+
+    paths, files = _live_tree(folder)
+
+    for file_record in files:
+        yield ZipEntry(
+            arcname=os.path.join(paths[file_record.folder_id], file_record.name),
+            path=file_record.file.path,
+            size=file_record.size,
+            modified_at=file_record.last_updated_at,
+        )
+
+def folder_zip_response(folder, request=None):
+    """
+    Stream a folder as a zip attachment
+    """
+
+    entries = iter_folder_entries(folder)
+
+    if request is not None and is_async_request(request):
+        # the tree is read now, the threads
+        # compressing the body never query
+        body = iterate_in_thread(stream_zip(list(entries)))
+    else:
+        body = stream_zip(entries)
+
+    response = StreamingHttpResponse(body, content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{folder.name}.zip"'
+    return response
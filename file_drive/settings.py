@@ -50,6 +50,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "whitenoise.middleware.WhiteNoiseMiddleware",  # must be near the top
+    'core.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,6 +79,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'file_drive.wsgi.application'
 
+# server interface, 'wsgi' or 'asgi': set by file_drive/asgi.py,
+# download views are only made async under an event loop
+SERVER_INTERFACE = config('SERVER_INTERFACE', default='wsgi')
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -95,6 +100,30 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# running the test suite
+TESTING = sys.argv[1:2] == ['test']
+
+# The cache must be shared by every process so invalidations
+# reach all the workers and management commands. In production
+# set CACHE_BACKEND and CACHE_LOCATION to e.g.
+#   django.core.cache.backends.redis.RedisCache, redis://redis:6379/1
+#   django.core.cache.backends.db.DatabaseCache, drive_cache
+#   (the table is created by manage.py createcachetable)
+# Without one nothing is cached: local memory is private to a
+# process and only used by the tests.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='') or (
+            'django.core.cache.backends.locmem.LocMemCache' if TESTING
+            else 'django.core.cache.backends.dummy.DummyCache'
+        ),
+        'LOCATION': config('CACHE_LOCATION', default='file-drive'),
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -113,6 +142,9 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# level of the project loggers, DEBUG is very verbose
+LOG_LEVEL = config('DJANGO_LOGLEVEL', default='INFO')
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -124,7 +156,7 @@ LOGGING = {
     },
     'root': {
         'handlers': ['console'],
-        'level': 'DEBUG',  # Or 'INFO', 'WARNING'
+        'level': LOG_LEVEL,
     },
     'loggers': {
         'django': {
@@ -134,27 +166,27 @@ LOGGING = {
         },
         '__main__': {
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
         },
         # Add your module-specific logger here
         'core': {
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'propagate': False,
         },
         'users': {
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'propagate': False,
         },
         'drive': {
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'propagate': False,
         },
         'share': {
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': LOG_LEVEL,
             'propagate': False,
         },
     }
@@ -191,3 +223,95 @@ USE_TZ = False
 
 LOGIN_URL = '/comptes/sso/connexion'
 
+# SSO
+
+# seconds to connect to the SSO and to wait for its answer, a
+# validation is tried 1 + SSO_RETRIES times at most
+SSO_CONNECT_TIMEOUT = config('APP_SSO_CONNECT_TIMEOUT', default=3, cast=float)
+SSO_READ_TIMEOUT = config('APP_SSO_READ_TIMEOUT', default=5, cast=float)
+SSO_RETRIES = config('APP_SSO_RETRIES', default=2, cast=int)
+SSO_RETRY_BACKOFF = config('APP_SSO_RETRY_BACKOFF', default=0.2, cast=float)
+
+# keep-alive connections to the SSO per process
+SSO_POOL_SIZE = config('APP_SSO_POOL_SIZE', default=10, cast=int)
+
+# failures in a row after which logins fail right away,
+# and seconds before the SSO is tried again
+SSO_BREAKER_FAILURES = config('APP_SSO_BREAKER_FAILURES', default=5, cast=int)
+SSO_BREAKER_RESET_AFTER = config('APP_SSO_BREAKER_RESET_AFTER', default=30, cast=int)
+
+# Drive
+
+# folders above this size are refused for zip download
+DRIVE_FOLDER_DOWNLOAD_MAX_SIZE = config('DRIVE_FOLDER_DOWNLOAD_MAX_SIZE', default=1024 * 1024 * 1024, cast=int) # 1GB
+
+# search backend class, picked from the database vendor when empty
+DRIVE_SEARCH_BACKEND = config('DRIVE_SEARCH_BACKEND', default='')
+
+# access timestamps are buffered and written every N seconds,
+# recent files ordering may lag by that much (0 writes through)
+DRIVE_ACCESS_FLUSH_INTERVAL = config('DRIVE_ACCESS_FLUSH_INTERVAL', default=10, cast=int)
+
+# how files are sent once a view has authorized them:
+# python streams from the worker, nginx uses X-Accel-Redirect
+# and apache uses X-Sendfile (mod_xsendfile)
+DRIVE_FILE_DELIVERY = config('DRIVE_FILE_DELIVERY', default='python')
+
+# nginx internal location serving MEDIA_ROOT, e.g.
+# location /protected/ { internal; alias /app/; }
+DRIVE_FILE_DELIVERY_PREFIX = config('DRIVE_FILE_DELIVERY_PREFIX', default='/protected/')
+
+# resumable uploads: largest file, largest chunk per
+# request and hours before an unfinished upload expires
+DRIVE_UPLOAD_MAX_SIZE = config('DRIVE_UPLOAD_MAX_SIZE', default=2 * 1024 * 1024 * 1024, cast=int) # 2GB
+DRIVE_UPLOAD_CHUNK_MAX_SIZE = config('DRIVE_UPLOAD_CHUNK_MAX_SIZE', default=16 * 1024 * 1024, cast=int) # 16MB
+DRIVE_UPLOAD_SESSION_TTL = config('DRIVE_UPLOAD_SESSION_TTL', default=24, cast=int)
+
+# threads running folder copies and archives in each
+# web process (0 runs them inside the request)
+DRIVE_BACKGROUND_WORKERS = config('DRIVE_BACKGROUND_WORKERS', default=2, cast=int)
+
+# upload limits and storage quota (bytes) per plan,
+# the plan of a user is UserProfile.plan
+DRIVE_DEFAULT_PLAN = 'free'
+
+DRIVE_PLANS = {
+    'free': {
+        'files_per_hour': config('DRIVE_FREE_FILES_PER_HOUR', default=50, cast=int),
+        'files_per_day': config('DRIVE_FREE_FILES_PER_DAY', default=80, cast=int),
+        'storage': config('DRIVE_FREE_STORAGE', default=5 * 1024 ** 3, cast=int),
+    },
+    'pro': {
+        'files_per_hour': config('DRIVE_PRO_FILES_PER_HOUR', default=500, cast=int),
+        'files_per_day': config('DRIVE_PRO_FILES_PER_DAY', default=2000, cast=int),
+        'storage': config('DRIVE_PRO_STORAGE', default=100 * 1024 ** 3, cast=int),
+    },
+}
+
+# processes rendering thumbnails (0 renders them in
+# the background thread), and the time allowed per file
+DRIVE_THUMBNAIL_WORKERS = config('DRIVE_THUMBNAIL_WORKERS', default=2, cast=int)
+DRIVE_THUMBNAIL_TIMEOUT = config('DRIVE_THUMBNAIL_TIMEOUT', default=60, cast=int)
+
+# seconds a page of a folder listing stays cached, pages
+# are dropped as soon as the folder changes (0 disables it,
+# as does a cache that is not shared, see CACHES)
+DRIVE_LISTING_CACHE_TIMEOUT = config('DRIVE_LISTING_CACHE_TIMEOUT', default=3600, cast=int)
+
+# seconds the share of a link token stays cached, only its
+# id: the share is always read again (0 disables it)
+DRIVE_SHARE_GRANT_CACHE_TIMEOUT = config('DRIVE_SHARE_GRANT_CACHE_TIMEOUT', default=300, cast=int)
+
+# Metrics
+
+# add a Server-Timing header with db and app time to responses
+METRICS_SERVER_TIMING = config('METRICS_SERVER_TIMING', default=True, cast=bool)
+
+# directory shared by the gunicorn workers so the metrics
+# endpoint reports all of them, empty for this process only
+METRICS_DIR = config('METRICS_DIR', default='')
+METRICS_DUMP_INTERVAL = config('METRICS_DUMP_INTERVAL', default=15, cast=int)
+
+# lets a Prometheus scraper read the metrics without
+# a staff session: Authorization: Bearer <token>
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
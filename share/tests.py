@@ -1,3 +1,36 @@
 from django.test import TestCase
+from django.contrib.auth.models import User
+from django.utils import timezone
+from django.urls import reverse
+from drive.access import resolve_share_token
+from drive.models import ContactDetails, FolderRecord, ShareRecord
+from datetime import timedelta
 
-# Create your tests here.
+class DeleteSharedItemTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='secret', email='alice@example.com')
+        contact = ContactDetails.objects.create(
+            first_name='Bob', last_name='Martin', email='bob@example.com', user=self.user
+        )
+        folder = FolderRecord.objects.create(name='projets', user=self.user)
+        self.share = ShareRecord.objects.create(contact=contact, folder=folder)
+
+    def test_delete_only_writes_its_columns(self):
+        # cached by a first visit
+        self.assertIsNotNone(resolve_share_token(self.share.token))
+
+        # changed meanwhile by another request
+        accessed_at = timezone.now() - timedelta(minutes=1)
+        ShareRecord.objects.filter(pk=self.share.pk).update(last_accessed_at=accessed_at)
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('delete-shared-item', args=[self.share.token]))
+
+        self.assertEqual(response.status_code, 302)
+
+        share = ShareRecord.objects.get(pk=self.share.pk)
+
+        self.assertTrue(share.is_deleted)
+        self.assertEqual(share.last_accessed_at, accessed_at)
+        self.assertIsNone(resolve_share_token(self.share.token))
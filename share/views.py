@@ -1,5 +1,4 @@
 from drive.models import (
-    ShareRecord,
     FileRecord,
     FolderRecord
 )
@@ -8,32 +7,56 @@ from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect
 from django.core.paginator import Paginator
-from django.http import FileResponse, HttpResponse
 from django.contrib import messages
 from core.utils import is_valid_int
 from django.utils import timezone
 from django.urls import reverse
-from django.db.models import Q
+from drive.zipstream import folder_zip_response
+from drive.archives import folder_content_version, get_archive, request_archive, archive_response
+from drive.delivery import file_response, streaming_view
+from drive.cache import folder_listing, listing_scope
+from drive import queries
+from drive.access import resolve_share_token, find_legacy_share
+from drive.access_log import record_access
+from drive.copying import start_copy_job
 import logging
-import mimetypes
-import zipfile
-import os
-import io
 
 logger = logging.getLogger(__name__)
 
-def add_folder_to_zip(zip_file, folder, base_path):
-    # Add files in this folder
-    for file_record in folder.files.filter(is_deleted=False):
-        if file_record.file:
-            file_path = file_record.file.path
-            arcname = os.path.join(base_path, file_record.name)
-            zip_file.write(file_path, arcname=arcname)
+def get_share(request, token, kind=None):
+    """
+    Resolve the token of a share link. Old links made with
+    slugs are redirected to the same page with the token.
+    Returns the share and the response to send instead,
+    both None when the link gives no access.
+    """
+
+    grant = resolve_share_token(token, kind)
+
+    if grant:
+        return grant.share, None
+
+    share = find_legacy_share(token, kind)
+
+    if not share:
+        return None, None
+
+    if not share.token:
+        # not backfilled yet
+        share.save(update_fields=['token'])
+
+    if request.method != 'GET':
+        return share, None
 
-    # Recurse into subfolders
-    for subfolder in folder.subfolders.filter(is_deleted=False):
-        sub_path = os.path.join(base_path, subfolder.name)
-        add_folder_to_zip(zip_file, subfolder, sub_path)
+    logger.info('redirecting old share link to its token...')
+
+    url = reverse(request.resolver_match.url_name, args=[share.token])
+    query = request.META.get('QUERY_STRING')
+
+    if query:
+        url = f'{url}?{query}'
+
+    return None, redirect(url, permanent=True)
 
 # Create your views here
 @require_http_methods(['GET'])
@@ -43,16 +66,10 @@ def shared_file_details(request, slug):
     Get share file details
     """
     
-    share = ShareRecord.objects.filter(
-        is_deleted=False,
-        #recipient=request.user,
-        file__isnull=False,
-        file__is_deleted=False,
-        contact__is_deleted=False,
-    ).filter(
-        Q(slug=slug) |
-        Q(file__slug=slug) 
-    ).first()
+    share, response = get_share(request, slug, 'file')
+
+    if response:
+        return response
 
     if not share:
         logger.warning('file share not found')
@@ -83,16 +100,10 @@ def shared_folder_details(request, slug):
     if page_size > 50:
         page_size = 50
     
-    share = ShareRecord.objects.filter(
-        is_deleted=False,
-        #recipient=request.user,
-        folder__isnull=False,
-        folder__is_deleted=False,
-        contact__is_deleted=False,
-    ).filter(
-        Q(slug=slug) |
-        Q(folder__slug=slug) 
-    ) .first()
+    share, response = get_share(request, slug, 'folder')
+
+    if response:
+        return response
 
     if not share:
         messages.warning(request, 'Dossier introuvable')
@@ -115,9 +126,9 @@ def shared_folder_details(request, slug):
         
         if not folder:
             logger.warning('unable to find selected folder ' + folder_slug)
-            return redirect('shared-folder-details', slug)
+            return redirect('shared-folder-details', share.token)
         
-        folder_parents = folder.get_parents_until_slug(slug)
+        folder_parents = folder.get_parents_until_slug(share.folder.slug)
         
     if file_slug and share.folder.contains_file_with_slug(file_slug):
         logger.info('finding file of shared folder...')
@@ -128,23 +139,20 @@ def shared_folder_details(request, slug):
         
         if not file:
             logger.warning('unable to find selected file ' + file_slug)
-            return redirect('shared-folder-details', slug)
+            return redirect('shared-folder-details', share.token)
         
-    folders = list()
-    files = list()
-    
     if not folder:
         logger.info('Getting content of shared folder...')
-        folders = share.folder.subfolders.all().filter(is_deleted=False)
-        files = share.folder.files.all().filter(is_deleted=False)
         folder = share.folder
         
     else:   
         logger.info('Getting content of selected folder...')
-        folders = folder.subfolders.all().filter(is_deleted=False)
-        files = folder.files.all().filter(is_deleted=False)
-        
-    items = list(folders) + list(files)
+
+    folders = queries.folder_subfolders(folder)
+    files = queries.folder_files(folder).select_related('blob')
+
+    # same pages as the owner's listing, shared by all the recipients
+    items = folder_listing(folders, files, listing_scope(folder.user_id, folder.pk))
         
     paginator = Paginator(items, page_size) 
     page_obj = paginator.get_page(page)
@@ -164,15 +172,10 @@ def shared_item_details(request, slug):
     Get share item and redirect to appropriate view
     """
     
-    share = ShareRecord.objects.filter(
-        is_deleted=False,
-        contact__is_deleted=False,
-        #recipient=request.user,
-    ).filter(
-        Q(slug=slug) |
-        Q(folder__slug=slug, folder__is_deleted=False) |
-        Q(file__slug=slug, file__is_deleted=False)
-    ).first()
+    share, response = get_share(request, slug)
+
+    if response:
+        return response
 
     if not share:
         messages.warning(request, 'Lien introuvable')
@@ -180,28 +183,24 @@ def shared_item_details(request, slug):
     
     if share.file:
         logger.warning('redirecting to shared file page...')
-        return redirect('shared-file-details', share.slug)
+        return redirect('shared-file-details', share.token)
     
     logger.warning('redirecting to shared folder page...')
-    return redirect('shared-folder-details', share.slug)
+    return redirect('shared-folder-details', share.token)
 
 @require_http_methods(['GET'])
 @xframe_options_exempt
 @login_required
+@streaming_view
 def view_shared_file_content_view(request, slug):
     """
     View file content
     """
     
-    share = ShareRecord.objects.filter(
-        is_deleted=False,
-        contact__is_deleted=False,
-        #recipient=request.user,
-    ).filter(
-        Q(slug=slug) |
-        Q(folder__slug=slug, folder__is_deleted=False) |
-        Q(file__slug=slug, file__is_deleted=False)
-    ).first()
+    share, response = get_share(request, slug)
+
+    if response:
+        return response
     
     if not share:
         messages.warning(request, 'Lien introuvable')
@@ -218,40 +217,28 @@ def view_shared_file_content_view(request, slug):
 
     if not file:
         messages.warning(request, 'Fichier introuvable')
-        return redirect('shared-folder-details', share.slug)
+        return redirect('shared-folder-details', share.token)
     
-    # Determine content type
-    mime_type, _ = mimetypes.guess_type(file.name)
-    if not mime_type:
-        mime_type = 'application/octet-stream'
-
-    response = FileResponse(file.file.open('rb'), content_type=mime_type)
+    response = file_response(request, file)
     
     # update metadata
-    share.last_accessed_at = timezone.now()
-    share.save()
+    record_access(share)
 
-    # Set inline disposition
-    response['Content-Disposition'] = f'inline; filename="{file.name}"'
     response["X-Frame-Options"] = "SAMEORIGIN"
     return response
 
 @require_http_methods(['GET'])
 @login_required
+@streaming_view
 def download_shared_file_view(request, slug):
     """
     Download shared file
     """
     
-    share = ShareRecord.objects.filter(
-        is_deleted=False,
-        contact__is_deleted=False,
-        #recipient=request.user,
-    ).filter(
-        Q(slug=slug) |
-        Q(folder__slug=slug, folder__is_deleted=False) |
-        Q(file__slug=slug, file__is_deleted=False)
-    ).first()
+    share, response = get_share(request, slug)
+
+    if response:
+        return response
         
     if not share:
         messages.warning(request, 'Lien introuvable')
@@ -271,12 +258,11 @@ def download_shared_file_view(request, slug):
 
     if not file or not file.file:
         messages.warning(request, 'Fichier introuvable')
-        return redirect('shared-folder-details', share.slug)
+        return redirect('shared-folder-details', share.token)
     
-    share.last_accessed_at = timezone.now()
-    share.save()
+    record_access(share)
 
-    return FileResponse(file.file.open('rb'), as_attachment=True, filename=file.name)
+    return file_response(request, file, as_attachment=True)
 
 @require_http_methods(['GET'])
 @login_required
@@ -285,15 +271,10 @@ def delete_shared_item_view(request, slug):
     Delete shared file or folder
     """
 
-    share = ShareRecord.objects.filter(
-        is_deleted=False,
-        contact__is_deleted=False,
-        #recipient=request.user,
-    ).filter(
-        Q(slug=slug) |
-        Q(folder__slug=slug, folder__is_deleted=False) |
-        Q(file__slug=slug, file__is_deleted=False)
-    ).first()
+    share, response = get_share(request, slug)
+
+    if response:
+        return response
         
     if not share:
         messages.warning(request, 'Lien introuvable')
@@ -302,7 +283,8 @@ def delete_shared_item_view(request, slug):
     share.is_deleted = True
     share.deleted_at = timezone.now()
     share.expires_at = timezone.now()
-    share.save()
+
+    share.save(update_fields=['is_deleted', 'deleted_at', 'expires_at'])
     
     messages.success(request, 'Partage supprimé')
     
@@ -315,15 +297,10 @@ def copy_shared_file_view(request, slug):
     Copy shared file
     """
     
-    share = ShareRecord.objects.filter(
-        is_deleted=False,
-        contact__is_deleted=False,
-        #recipient=request.user,
-        file__isnull=False
-    ).filter(
-        Q(slug=slug) |
-        Q(file__slug=slug, file__is_deleted=False)
-    ).first()
+    share, response = get_share(request, slug, 'file')
+
+    if response:
+        return response
         
     if not share:
         messages.warning(request, 'Lien introuvable')
@@ -343,7 +320,7 @@ def copy_shared_file_view(request, slug):
 
     if not file or not file.file:
         messages.warning(request, 'Fichier introuvable')
-        return redirect('shared-folder-details', share.slug)
+        return redirect('shared-folder-details', share.token)
     
     # copy file
     new_record = file.copy_file_to_user(request.user)
@@ -361,15 +338,10 @@ def copy_shared_folder_view(request, slug):
     Copy shared folder
     """
     
-    share = ShareRecord.objects.filter(
-        is_deleted=False,
-        contact__is_deleted=False,
-        #recipient=request.user,
-        folder__isnull=False
-    ).filter(
-        Q(slug=slug) |
-        Q(folder__slug=slug, folder__is_deleted=False)
-    ).first()
+    share, response = get_share(request, slug, 'folder')
+
+    if response:
+        return response
         
     if not share:
         messages.warning(request, 'Lien introuvable')
@@ -389,34 +361,30 @@ def copy_shared_folder_view(request, slug):
 
     if not folder:
         messages.warning(request, 'Dossier introuvable')
-        return redirect('shared-folder-details', share.slug)
+        return redirect('shared-folder-details', share.token)
     
-    # copy file
-    new_folder = folder.copy_folder_to_user(request.user)
+    # copy in the background
+    job = start_copy_job(request.user, folder)
 
-    if new_folder:
+    if job.status == 'done' and job.target:
         messages.success(request, 'Dossier copié')
         url = reverse('my-box')
-        return redirect(f"{url}?dossier={new_folder.slug}")
-    
-    return redirect('my-box')
+        return redirect(f"{url}?dossier={job.target.slug}")
+
+    return redirect('copy-job', job.job_uuid)
 
 @require_http_methods(['GET'])
 @login_required
+@streaming_view
 def download_shared_folder_view(request, slug):
     """
     Download shared folder
     """
     
-    share = ShareRecord.objects.filter(
-        is_deleted=False,
-        contact__is_deleted=False,
-        #recipient=request.user,
-        folder__isnull=False
-    ).filter(
-        Q(slug=slug) |
-        Q(folder__slug=slug, folder__is_deleted=False)
-    ).first()
+    share, response = get_share(request, slug, 'folder')
+
+    if response:
+        return response
         
     if not share:
         messages.warning(request, 'Lien introuvable')
@@ -436,23 +404,19 @@ def download_shared_folder_view(request, slug):
 
     if not folder:
         messages.warning(request, 'Dossier introuvable')
-        return redirect('shared-folder-details', share.slug)
+        return redirect('shared-folder-details', share.token)
     
-    if folder.is_over_30mb():
-        # check folder size before download 
-        # if it is too large, create background 
-        # and redirect user to waiting page
-        
-        messages.warning(request, 'Dossier trop large')
-        return redirect('shared-folder-details', slug)
-    
-    zip_buffer = io.BytesIO()
-    
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-        add_folder_to_zip(zip_file, folder, base_path=folder.name)
+    if not folder.is_over_download_limit():
+        return folder_zip_response(folder, request)
+
+    version = folder_content_version(folder)
+    archive = get_archive(folder, version)
 
-    zip_buffer.seek(0)
+    if archive and archive.status == 'done':
+        # unchanged since the last archive
+        return archive_response(request, archive)
 
-    response = HttpResponse(zip_buffer, content_type='application/zip')
-    response['Content-Disposition'] = f'attachment; filename="{folder.name}.zip"'
-    return response
\ No newline at end of file
+    # too large to stream within the request,
+    # build it in background and show a waiting page
+    archive = request_archive(folder, version)
+    return redirect('archive-job', archive.job_uuid)
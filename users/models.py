@@ -10,6 +10,9 @@ class UserProfile(models.Model):
     
     terms_accepted_at = models.DateTimeField(auto_now_add=True)
 
+    # key of settings.DRIVE_PLANS
+    plan = models.CharField(max_length=30, default='free')
+
     user = models.OneToOneField(
         get_user_model(),
         related_name='profile',
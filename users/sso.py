@@ -0,0 +1,190 @@
+from django.conf import settings
+from cryptography.fernet import Fernet
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import TimeoutError as PoolTimeoutError
+from functools import lru_cache
+from core.metrics import record_sso_request
+import threading
+import requests
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+class SSOError(Exception):
+    """
+    The SSO did not validate the session
+    """
+
+class SSOUnavailable(SSOError):
+    """
+    The SSO cannot be reached, is too slow or is failing
+    """
+
+@lru_cache(maxsize=8)
+def get_cipher(secret):
+    """
+    Fernet cipher of a secret, built once per process
+    """
+
+    return Fernet(secret.encode())
+
+class CircuitBreaker:
+    """
+    Stop calling a failing host. After SSO_BREAKER_FAILURES
+    errors in a row the circuit opens and calls fail right
+    away for SSO_BREAKER_RESET_AFTER seconds, then one trial
+    call decides whether it closes again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+
+            if self.trial or time.monotonic() - self.opened_at < settings.SSO_BREAKER_RESET_AFTER:
+                return False
+
+            # half open: let a single call through
+            self.trial = True
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+
+            if self.opened_at is not None or self.failures >= settings.SSO_BREAKER_FAILURES:
+                if self.opened_at is None:
+                    logger.warning(f'SSO failed {self.failures} times in a row, circuit opened')
+
+                self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+breaker = CircuitBreaker()
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """
+    Keep-alive HTTP session of the process, its pool
+    reuses the connections to the SSO between logins
+    """
+
+    global _session, _session_pid
+
+    with _session_lock:
+        # sockets are not shared with forked workers
+        if _session is None or _session_pid != os.getpid():
+            retry = Retry(
+                total=settings.SSO_RETRIES,
+                connect=settings.SSO_RETRIES,
+                read=settings.SSO_RETRIES,
+                status=settings.SSO_RETRIES,
+                backoff_factor=settings.SSO_RETRY_BACKOFF,
+                status_forcelist=(502, 503, 504),
+                # validating a session twice is harmless
+                allowed_methods=frozenset(['GET', 'POST']),
+                raise_on_status=False,
+            )
+
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=settings.SSO_POOL_SIZE,
+                max_retries=retry,
+            )
+
+            _session = requests.Session()
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+            _session_pid = os.getpid()
+
+        return _session
+
+def close_session():
+    """
+    Drop the pooled connections, the next
+    call opens a new session
+    """
+
+    global _session
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+def _is_timeout(error):
+    # once retries are exhausted a read timeout
+    # comes back wrapped in a ConnectionError
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+
+    return isinstance(error, requests.Timeout) or isinstance(reason, PoolTimeoutError)
+
+def validate_session(url, session_id):
+    """
+    Ask the SSO to validate a login session and return
+    its encrypted answer. Raises SSOUnavailable when the
+    SSO is down or too slow and SSOError when it refuses
+    the session.
+    """
+
+    if not breaker.allow():
+        record_sso_request('circuit_open')
+        raise SSOUnavailable('SSO circuit is open')
+
+    started = time.perf_counter()
+
+    try:
+        response = get_session().post(
+            url,
+            data={'session_id': session_id},
+            timeout=(settings.SSO_CONNECT_TIMEOUT, settings.SSO_READ_TIMEOUT),
+        )
+
+    except requests.RequestException as e:
+        breaker.failure()
+
+        if _is_timeout(e):
+            record_sso_request('timeout', time.perf_counter() - started)
+            raise SSOUnavailable(f'SSO timed out: {e}') from e
+
+        record_sso_request('error', time.perf_counter() - started)
+        raise SSOUnavailable(f'SSO unreachable: {e}') from e
+
+    duration = time.perf_counter() - started
+
+    if response.status_code >= 500:
+        breaker.failure()
+        record_sso_request('error', duration)
+        raise SSOUnavailable(f'SSO answered {response.status_code}')
+
+    # the SSO works, whatever it thinks of the session
+    breaker.success()
+
+    if not response.ok:
+        record_sso_request('rejected', duration)
+        raise SSOError(f'SSO refused the session: {response.status_code}')
+
+    record_sso_request('ok', duration)
+
+    return response.text
@@ -1,3 +1,159 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, override_settings
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from core.metrics import registry
+from . import sso
+import threading
+import time
 
-# Create your tests here.
+class FakeSSOHandler(BaseHTTPRequestHandler):
+    """
+    Answers session validations like the SSO: /ok validates,
+    /refused rejects, /down fails and /slow does not answer
+    in time. Every request is recorded on the server.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode()
+
+        self.server.calls.append((self.path, self.client_address[1], body))
+
+        if self.path.startswith('/slow'):
+            time.sleep(self.server.delay)
+
+        status, content = {
+            '/ok': (200, b'encrypted-profile'),
+            '/refused': (403, b''),
+            '/down': (503, b''),
+        }.get(self.path.split('?')[0], (200, b'late'))
+
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+@override_settings(
+    SSO_CONNECT_TIMEOUT=1,
+    SSO_READ_TIMEOUT=0.2,
+    SSO_RETRIES=1,
+    SSO_RETRY_BACKOFF=0,
+    SSO_POOL_SIZE=2,
+    SSO_BREAKER_FAILURES=2,
+    SSO_BREAKER_RESET_AFTER=60,
+)
+class SSOClientTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeSSOHandler)
+        cls.server.daemon_threads = True
+        cls.server.calls = []
+        cls.server.delay = 1
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.calls.clear()
+        sso.close_session()
+        sso.breaker.success()
+
+    def tearDown(self):
+        sso.close_session()
+        sso.breaker.success()
+
+    def count(self, outcome):
+        return registry.counters.get(('sso_requests_total', (('outcome', outcome),)), 0)
+
+    def observed(self):
+        histogram = registry.histograms.get(('sso_request_duration_seconds', ()))
+        return sum(histogram['counts']) if histogram else 0
+
+    def test_validation_reuses_the_connection(self):
+        ok = self.count('ok')
+        observed = self.observed()
+
+        for _ in range(3):
+            self.assertEqual(sso.validate_session(f'{self.base_url}/ok?app_id=1', 'abc'), 'encrypted-profile')
+
+        self.assertEqual(len(self.server.calls), 3)
+        self.assertEqual(self.server.calls[0][2], 'session_id=abc')
+
+        # same client port: one keep-alive connection
+        self.assertEqual(len({port for _, port, _ in self.server.calls}), 1)
+
+        self.assertEqual(self.count('ok'), ok + 3)
+        self.assertEqual(self.observed(), observed + 3)
+
+    def test_slow_sso_times_out(self):
+        timeouts = self.count('timeout')
+        started = time.perf_counter()
+
+        with self.assertRaises(sso.SSOUnavailable):
+            sso.validate_session(f'{self.base_url}/slow', 'abc')
+
+        # read timeout, once retried
+        self.assertLess(time.perf_counter() - started, 0.9)
+        self.assertEqual(self.count('timeout'), timeouts + 1)
+
+    def test_failing_sso_is_retried(self):
+        errors = self.count('error')
+
+        with self.assertRaises(sso.SSOUnavailable):
+            sso.validate_session(f'{self.base_url}/down', 'abc')
+
+        self.assertEqual(len(self.server.calls), 2)
+        self.assertEqual(self.count('error'), errors + 1)
+
+    def test_refused_session_is_not_retried(self):
+        with self.assertRaises(sso.SSOError) as raised:
+            sso.validate_session(f'{self.base_url}/refused', 'abc')
+
+        self.assertNotIsInstance(raised.exception, sso.SSOUnavailable)
+        self.assertEqual(len(self.server.calls), 1)
+        self.assertFalse(sso.breaker.is_open)
+
+    def test_circuit_opens_after_failures(self):
+        for _ in range(2):
+            with self.assertRaises(sso.SSOUnavailable):
+                sso.validate_session(f'{self.base_url}/down', 'abc')
+
+        self.assertTrue(sso.breaker.is_open)
+
+        calls = len(self.server.calls)
+        rejected = self.count('circuit_open')
+
+        with self.assertRaises(sso.SSOUnavailable):
+            sso.validate_session(f'{self.base_url}/ok', 'abc')
+
+        # failed without calling the SSO
+        self.assertEqual(len(self.server.calls), calls)
+        self.assertEqual(self.count('circuit_open'), rejected + 1)
+
+    def test_circuit_closes_after_a_successful_trial(self):
+        for _ in range(2):
+            with self.assertRaises(sso.SSOUnavailable):
+                sso.validate_session(f'{self.base_url}/down', 'abc')
+
+        with override_settings(SSO_BREAKER_RESET_AFTER=0):
+            self.assertEqual(sso.validate_session(f'{self.base_url}/ok', 'abc'), 'encrypted-profile')
+
+        self.assertFalse(sso.breaker.is_open)
+
+    def test_cipher_is_cached(self):
+        secret = 'jnRV6Q3D9QZ3uVf0s0bJ2bq1q3X6o8b4Qj0mYxV2c1M='
+
+        self.assertIs(sso.get_cipher(secret), sso.get_cipher(secret))
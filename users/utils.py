@@ -1,4 +1,5 @@
-from cryptography.fernet import Fernet, InvalidToken
+from cryptography.fernet import InvalidToken
+from .sso import get_cipher
 import random
 import string
 import base64
@@ -19,7 +20,7 @@ def decrypt_data(encrypted_data, secret, ttl=60):
     Decrypt encrypted data using Fernet
     """
     
-    cipher = Fernet(secret.encode())
+    cipher = get_cipher(secret)
     
     try:
         return cipher.decrypt(encrypted_data, ttl=ttl).decode('utf-8')
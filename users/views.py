@@ -3,14 +3,12 @@ from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, logout
 from django.contrib.auth.models import User
-from cryptography.fernet import Fernet
 from django.utils import timezone
 from .models import UserProfile
 from datetime import timedelta
 from decouple import config
-from . import utils
+from . import utils, sso
 import logging
-import requests
 import json
 
 logger = logging.getLogger(__name__)
@@ -84,17 +82,11 @@ def login_authorize_view(request):
 
     url = f'{sso_session_validation_url}?app_id={app_id}'
 
-    verification_data = {
-        'session_id': decrypted_session_data_json['session_id'],
-    }
-    
-    response = requests.post(url, data=verification_data)
-    
-    if response.ok:
-        response = response.text
-    else:
+    try:
+        response = sso.validate_session(url, decrypted_session_data_json['session_id'])
+    except sso.SSOError as e:
         logger.warning('Unexpected SSO response')
-        logger.warning('status_code=%s', response.status_code)
+        logger.warning('%s', e)
         return render(request, 'login/redirect-to-login-error.html')
     
     # all good
@@ -221,7 +213,7 @@ def my_profile_view(request):
             return render(request, 'login/redirect-to-login-error.html')
         
         # encrypt account data
-        cipher = Fernet(app_secret.encode())
+        cipher = sso.get_cipher(app_secret)
 
         account_data = {
             'id': user.profile.sso_user_id,